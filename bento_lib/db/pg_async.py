@@ -2,10 +2,17 @@ import asyncio
 import contextlib
 from collections.abc import AsyncIterator
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import aiofiles
 import asyncpg
 
+# bento_lib.search.postgres (which depends on psycopg2) is imported by the methods using it, rather than by this module.
+if TYPE_CHECKING:
+    from ..search._types import JSONSchema
+    from ..search.postgres import SearchAggregate, SearchPage
+    from ..search.queries import Query
+
 __all__ = [
     "PgAsyncDatabaseException",
     "PgAsyncDatabase",
@@ -99,3 +106,132 @@ class PgAsyncDatabase:
         conn: asyncpg.Connection
         async with self._pool.acquire() as conn:
             yield conn
+
+    async def search(
+        self,
+        query: "Query",
+        schema: "JSONSchema",
+        internal: bool = False,
+        exists_subqueries: bool = False,
+        aggregate: "SearchAggregate | None" = None,
+        page: "SearchPage | None" = None,
+        existing_conn: asyncpg.Connection | None = None,
+    ) -> list[asyncpg.Record]:
+        """
+        Executes a Bento search query against the database, with the query compiled to SQL for asyncpg via
+        bento_lib.search.postgres.search_query_to_asyncpg_sql(...).
+        :param query: The query, as nested lists and literal values.
+        :param schema: The search schema, mapping the query's fields to the database.
+        :param internal: Whether internal-only fields are allowed to be resolved.
+        :param exists_subqueries: Whether to access arrays via EXISTS subqueries rather than joins, so that each
+                                  matching row is returned once.
+        :param aggregate: How to aggregate matching rows, if they should be counted rather than fetched.
+        :param page: The page of matching rows to fetch, if they should be paginated (see SearchPage.)
+        :param existing_conn: An existing connection to use, rather than acquiring one from the pool.
+        :return: The matching rows of the schema's root relation, or the aggregate rows (see SearchAggregate.)
+        """
+        from ..search.postgres import search_query_to_asyncpg_sql
+
+        sql_text, params = search_query_to_asyncpg_sql(query, schema, internal, exists_subqueries, aggregate, page)
+        conn: asyncpg.Connection
+        async with self.connect(existing_conn) as conn:
+            return await conn.fetch(sql_text, *params)
+
+    async def stream_search(
+        self,
+        query: "Query",
+        schema: "JSONSchema",
+        internal: bool = False,
+        exists_subqueries: bool = False,
+        prefetch: int | None = None,
+        existing_conn: asyncpg.Connection | None = None,
+    ) -> AsyncIterator[asyncpg.Record]:
+        """
+        Like search(...), but streams matching rows from a server-side cursor rather than fetching them all at once.
+        :param query: The query, as nested lists and literal values.
+        :param schema: The search schema, mapping the query's fields to the database.
+        :param internal: Whether internal-only fields are allowed to be resolved.
+        :param exists_subqueries: Whether to access arrays via EXISTS subqueries rather than joins, so that each
+                                  matching row is returned once.
+        :param prefetch: The number of rows the cursor fetches at a time; defaults to asyncpg's default.
+        :param existing_conn: An existing connection to use, rather than acquiring one from the pool.
+        :return: An asynchronous iterator of the matching rows of the schema's root relation.
+        """
+        from ..search.postgres import search_query_to_asyncpg_sql
+
+        sql_text, params = search_query_to_asyncpg_sql(query, schema, internal, exists_subqueries)
+        conn: asyncpg.Connection
+        # Cursors can only be used within a transaction (or a savepoint, if the connection is already in one.)
+        async with self.connect(existing_conn) as conn, conn.transaction():
+            async for record in conn.cursor(sql_text, *params, prefetch=prefetch):
+                yield record
+
+    async def stream_search_batches(
+        self,
+        query: "Query",
+        schema: "JSONSchema",
+        batch_size: int,
+        internal: bool = False,
+        exists_subqueries: bool = False,
+        existing_conn: asyncpg.Connection | None = None,
+    ) -> AsyncIterator[list[asyncpg.Record]]:
+        """
+        Like stream_search(...), but yields matching rows in lists of up to batch_size rows, each fetched from the
+        server-side cursor in a single round trip.
+        :param query: The query, as nested lists and literal values.
+        :param schema: The search schema, mapping the query's fields to the database.
+        :param batch_size: The maximum number of rows in each batch.
+        :param internal: Whether internal-only fields are allowed to be resolved.
+        :param exists_subqueries: Whether to access arrays via EXISTS subqueries rather than joins, so that each
+                                  matching row is returned once.
+        :param existing_conn: An existing connection to use, rather than acquiring one from the pool.
+        :return: An asynchronous iterator of non-empty batches of the matching rows of the schema's root relation.
+        """
+
+        if batch_size < 1:
+            raise ValueError(f"Invalid batch size: {batch_size}")
+
+        from ..search.postgres import search_query_to_asyncpg_sql
+
+        sql_text, params = search_query_to_asyncpg_sql(query, schema, internal, exists_subqueries)
+        conn: asyncpg.Connection
+        async with self.connect(existing_conn) as conn, conn.transaction():
+            cursor = await conn.cursor(sql_text, *params)
+            while batch := await cursor.fetch(batch_size):
+                yield batch
+                if len(batch) < batch_size:
+                    break
+
+    async def search_pages(
+        self,
+        query: "Query",
+        schema: "JSONSchema",
+        page_size: int,
+        internal: bool = False,
+        exists_subqueries: bool = False,
+        existing_conn: asyncpg.Connection | None = None,
+    ) -> AsyncIterator[list[asyncpg.Record]]:
+        """
+        Yields pages of matching rows in primary key order, using keyset pagination: each page is a separate query for
+        rows with keys after the last key of the previous page, so no cursor or transaction is held open between pages.
+        :param query: The query, as nested lists and literal values.
+        :param schema: The search schema, mapping the query's fields to the database. Must declare a primary key.
+        :param page_size: The maximum number of rows in each page.
+        :param internal: Whether internal-only fields are allowed to be resolved.
+        :param exists_subqueries: Whether to access arrays via EXISTS subqueries rather than joins.
+        :param existing_conn: An existing connection to use, rather than acquiring one from the pool.
+        :return: An asynchronous iterator of non-empty pages of the matching rows of the schema's root relation.
+        """
+
+        from ..search.postgres import SearchPage, get_primary_key
+
+        primary_key = get_primary_key(schema)
+        page = SearchPage(page_size)
+
+        while rows := await self.search(
+            query, schema, internal, exists_subqueries, page=page, existing_conn=existing_conn
+        ):
+            yield rows
+            if len(rows) < page_size:
+                break
+            page = page.next_page(rows[-1][primary_key])
@@ -1,13 +1,19 @@
 from datetime import datetime
 
-from . import data_structure, operations, postgres, queries
+from . import cache, data_structure, indexing, ndjson, operations, optimizer, parallel, postgres, queries, search_schema
 
 __all__ = [
     "build_search_response",
+    "cache",
     "data_structure",
+    "indexing",
+    "ndjson",
     "operations",
+    "optimizer",
+    "parallel",
     "postgres",
     "queries",
+    "search_schema",
 ]
 
 
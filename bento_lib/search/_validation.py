@@ -0,0 +1,219 @@
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Any
+
+import jsonschema
+
+from ._types import JSONSchema
+
+__all__ = [
+    "SchemaValidator",
+    "get_schema_validator",
+]
+
+
+type FastCheck = Callable[[Any], bool]
+
+
+# Fast-path checks -----------------------------------------------------------------------------------------------------
+#  Search schemas mostly consist of a small subset of JSON schema (types, properties, items, required, enums). For
+#  schemas which only use this subset, we compile a tree of closures which determines whether a data structure is valid
+#  much faster than a general-purpose jsonschema validator. A fast check must never accept an invalid data structure,
+#  but may reject valid ones; rejected data structures are re-checked by jsonschema to collect the actual errors.
+
+# Keywords which do not affect validation (for Draft 7, "format" is an annotation unless a format checker is used.)
+ANNOTATION_KEYWORDS = frozenset(
+    {
+        "$id",
+        "$schema",
+        "$comment",
+        "title",
+        "description",
+        "default",
+        "examples",
+        "format",
+        "readOnly",
+        "writeOnly",
+        "search",
+    }
+)
+FAST_CHECK_KEYWORDS = frozenset(
+    {*ANNOTATION_KEYWORDS, "type", "enum", "const", "properties", "required", "additionalProperties", "items"}
+)
+
+TYPE_CHECKS: dict[str, FastCheck] = {
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "string": lambda v: isinstance(v, str),
+    "boolean": lambda v: isinstance(v, bool),
+    "null": lambda v: v is None,
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "integer": lambda v: (isinstance(v, int) and not isinstance(v, bool)) or (isinstance(v, float) and v.is_integer()),
+}
+
+
+def _is_str_or_none(v: Any) -> bool:
+    return v is None or isinstance(v, str)
+
+
+def _compile_fast_check(schema: JSONSchema | bool) -> FastCheck | None:
+    """
+    Compiles a JSON schema into a closure which checks whether a value is valid, if the schema only uses keywords which
+    are supported by the fast path.
+    :param schema: The (sub-)schema to compile.
+    :return: A closure returning True only if a value is valid, or None if the schema cannot be compiled.
+    """
+
+    if isinstance(schema, bool):
+        return lambda _v: schema
+
+    if not isinstance(schema, dict) or not schema.keys() <= FAST_CHECK_KEYWORDS:
+        return None
+
+    type_check: FastCheck | None = None
+    if "type" in schema:
+        types = [schema["type"]] if isinstance(schema["type"], str) else schema["type"]
+        if not all(t in TYPE_CHECKS for t in types):
+            return None
+        type_checks = tuple(TYPE_CHECKS[t] for t in types)
+        type_check = type_checks[0] if len(type_checks) == 1 else lambda v: any(tc(v) for tc in type_checks)
+
+    value_set: frozenset[str | None] | None = None
+    if "enum" in schema or "const" in schema:
+        # Only string/null enums are supported, since JSON schema equality differs from Python's for booleans/numbers
+        values = schema["enum"] if "enum" in schema else [schema["const"]]
+        if not all(_is_str_or_none(e) for e in values):
+            return None
+        value_set = frozenset(values)
+
+    property_checks: list[tuple[str, FastCheck]] = []
+    for k, sub_schema in schema.get("properties", {}).items():
+        if (pc := _compile_fast_check(sub_schema)) is None:
+            return None
+        property_checks.append((k, pc))
+    frozen_property_checks = tuple(property_checks)
+
+    required = tuple(schema.get("required", ()))
+
+    additional_check: FastCheck | None = None
+    if "additionalProperties" in schema and (
+        (additional_check := _compile_fast_check(schema["additionalProperties"])) is None
+    ):
+        return None
+    known_properties = frozenset(schema.get("properties", {}))
+
+    item_check: FastCheck | None = None
+    # Also excludes the tuple form of items, which is not supported by the fast path
+    if "items" in schema and (item_check := _compile_fast_check(schema["items"])) is None:
+        return None
+
+    # Written as a single closure with explicit loops, since this is called for every node of every data structure.
+    def fast_check(v: Any) -> bool:
+        if type_check is not None and not type_check(v):
+            return False
+
+        if value_set is not None and not (_is_str_or_none(v) and v in value_set):
+            return False
+
+        if isinstance(v, dict):
+            for k in required:
+                if k not in v:
+                    return False
+            for k, pc in frozen_property_checks:
+                if k in v and not pc(v[k]):
+                    return False
+            if additional_check is not None:
+                for k, x in v.items():
+                    if k not in known_properties and not additional_check(x):
+                        return False
+
+        elif item_check is not None and isinstance(v, list):
+            for x in v:
+                if not item_check(x):
+                    return False
+
+        return True
+
+    return fast_check
+
+
+# Validator registry ---------------------------------------------------------------------------------------------------
+
+
+class SchemaValidator:
+    """
+    A reusable validator for data structures conforming to a particular JSON schema, combining a Draft 7 jsonschema
+    validator with a compiled fast path where the schema allows it. Instances should be obtained via
+    get_schema_validator(...), which caches them.
+    """
+
+    def __init__(self, schema: JSONSchema):
+        self.schema: JSONSchema = schema
+        self._validator = jsonschema.Draft7Validator(schema)
+        self._fast_check: FastCheck | None = _compile_fast_check(schema)
+
+    @property
+    def has_fast_path(self) -> bool:
+        return self._fast_check is not None
+
+    def errors(self, instance: Any) -> tuple[str, ...]:
+        """
+        Validates an instance against the schema in a single pass.
+        :param instance: The value to validate.
+        :return: A tuple of validation error messages; empty if the instance is valid.
+        """
+        if self._fast_check is not None and self._fast_check(instance):
+            return ()
+        return tuple(err.message for err in self._validator.iter_errors(instance))
+
+
+VALIDATOR_CACHE_SIZE = 128
+
+_validators_lock = threading.Lock()
+_validators_by_identity: OrderedDict[int, tuple[JSONSchema, SchemaValidator]] = OrderedDict()
+_validators_by_schema_id: OrderedDict[str, SchemaValidator] = OrderedDict()
+
+
+def _cache_put[K, V](cache: OrderedDict[K, V], key: K, value: V) -> None:
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > VALIDATOR_CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+def get_schema_validator(schema: JSONSchema) -> SchemaValidator:
+    """
+    Returns a cached validator for a JSON schema, creating one if needed. Validators are looked up by schema object
+    identity first, then by schema $id (if the cached schema is equal to the passed one.) Schemas are assumed to not be
+    mutated after they are first used for validation.
+    :param schema: The JSON schema to get a validator for.
+    :return: The (possibly shared) validator for the schema.
+    """
+
+    with _validators_lock:
+        # The cache holds a reference to each schema, so the ID of a cached schema object cannot be re-used.
+        if (entry := _validators_by_identity.get(id(schema))) is not None and entry[0] is schema:
+            _validators_by_identity.move_to_end(id(schema))
+            return entry[1]
+
+        schema_id = schema.get("$id") if isinstance(schema, dict) else None
+
+        if (
+            isinstance(schema_id, str)
+            and (v := _validators_by_schema_id.get(schema_id)) is not None
+            and v.schema == schema
+        ):
+            _validators_by_schema_id.move_to_end(schema_id)
+            _cache_put(_validators_by_identity, id(schema), (schema, v))
+            return v
+
+    # Build outside the lock; if two threads race to build the same validator, either result is fine to cache.
+    v = SchemaValidator(schema)
+
+    with _validators_lock:
+        _cache_put(_validators_by_identity, id(schema), (schema, v))
+        if isinstance(schema_id, str):
+            _cache_put(_validators_by_schema_id, schema_id, v)
+
+    return v
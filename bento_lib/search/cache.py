@@ -0,0 +1,189 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from typing import Any
+
+from . import queries as q
+from ._types import JSONSchema
+
+__all__ = [
+    "DEFAULT_MAX_SIZE",
+    "CacheKey",
+    "query_fingerprint",
+    "schema_fingerprint",
+    "QueryResultCache",
+]
+
+# Caching of query results across requests.
+#  Queries are keyed by a fingerprint of their canonical form (see queries.canonicalize), so that equivalent queries
+#  which are written differently share cache entries. Keys also include a fingerprint of the schema and a
+#  caller-provided dataset version, which should change whenever the underlying data does; stale entries are then never
+#  hit again, and are eventually evicted.
+
+DEFAULT_MAX_SIZE = 1024
+
+# (query fingerprint, schema fingerprint, dataset version, internal)
+type CacheKey = tuple[str, str, Hashable, bool]
+
+
+def _fingerprint(value: Any, sort_keys: bool = False) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=sort_keys, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def query_fingerprint(ast: q.AST) -> str:
+    """
+    Computes a fingerprint of a query which is the same for all equivalent forms of the query (as determined by
+    queries.canonicalize(...)), and stable across processes.
+    :param ast: The query to fingerprint.
+    :return: A hex digest string.
+    """
+    return _fingerprint(q.ast_to_query(q.canonicalize(ast)))
+
+
+def schema_fingerprint(schema: JSONSchema) -> str:
+    """
+    Computes a fingerprint of a JSON schema which does not depend on object key order, and is stable across processes.
+    :param schema: The schema to fingerprint.
+    :return: A hex digest string.
+    """
+    return _fingerprint(schema, sort_keys=True)
+
+
+_MISSING = object()
+
+
+class QueryResultCache:
+    """
+    A thread-safe, size-bounded cache of query results, evicting the least recently used entries first. Results are
+    keyed by query, schema, dataset version, and whether the query was run in internal mode, so that results computed
+    with internal access are never returned to non-internal callers.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE):
+        """
+        :param max_size: The maximum number of results to keep.
+        """
+
+        if max_size < 1:
+            raise ValueError(f"Invalid cache size: {max_size}")
+
+        self.max_size: int = max_size
+        self.hits: int = 0
+        self.misses: int = 0
+
+        self._lock = threading.Lock()
+        self._results: OrderedDict[CacheKey, Any] = OrderedDict()
+        # Schema fingerprints by schema object identity; holds a reference to each schema so IDs cannot be re-used.
+        self._schema_fingerprints: OrderedDict[int, tuple[JSONSchema, str]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def _schema_fingerprint(self, schema: JSONSchema) -> str:
+        with self._lock:
+            if (entry := self._schema_fingerprints.get(id(schema))) is not None and entry[0] is schema:
+                self._schema_fingerprints.move_to_end(id(schema))
+                return entry[1]
+
+        fp = schema_fingerprint(schema)
+
+        with self._lock:
+            self._schema_fingerprints[id(schema)] = (schema, fp)
+            if len(self._schema_fingerprints) > self.max_size:
+                self._schema_fingerprints.popitem(last=False)
+
+        return fp
+
+    def key(self, ast: q.AST, schema: JSONSchema, dataset_version: Hashable, internal: bool = False) -> CacheKey:
+        """
+        Computes the cache key for a query result.
+        :param ast: The query.
+        :param schema: The JSON schema the query is run against.
+        :param dataset_version: A version identifier for the data being queried.
+        :param internal: Whether the query is run with internal-only fields accessible.
+        :return: The cache key.
+        """
+        return query_fingerprint(ast), self._schema_fingerprint(schema), dataset_version, internal
+
+    def _get(self, key: CacheKey, default: Any) -> Any:
+        with self._lock:
+            res = self._results.get(key, _MISSING)
+            if res is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._results.move_to_end(key)
+            return res
+
+    def _put(self, key: CacheKey, result: Any) -> None:
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            if len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+
+    def get(
+        self, ast: q.AST, schema: JSONSchema, dataset_version: Hashable, internal: bool = False, default: Any = None
+    ) -> Any:
+        """
+        Looks up a cached query result, counting a hit or a miss.
+        :param ast: The query.
+        :param schema: The JSON schema the query is run against.
+        :param dataset_version: A version identifier for the data being queried.
+        :param internal: Whether the query is run with internal-only fields accessible.
+        :param default: The value to return if no result is cached.
+        :return: The cached result, or the default value.
+        """
+
+        return self._get(self.key(ast, schema, dataset_version, internal), default)
+
+    def put(
+        self, ast: q.AST, schema: JSONSchema, dataset_version: Hashable, result: Any, internal: bool = False
+    ) -> None:
+        """
+        Caches a query result, evicting the least recently used result if the cache is full.
+        :param ast: The query.
+        :param schema: The JSON schema the query was run against.
+        :param dataset_version: A version identifier for the data which was queried.
+        :param result: The result to cache.
+        :param internal: Whether the query was run with internal-only fields accessible.
+        """
+
+        self._put(self.key(ast, schema, dataset_version, internal), result)
+
+    def get_or_compute[T](
+        self,
+        ast: q.AST,
+        schema: JSONSchema,
+        dataset_version: Hashable,
+        compute: Callable[[], T],
+        internal: bool = False,
+    ) -> T:
+        """
+        Returns a cached query result if one exists; otherwise, computes and caches it. Exceptions raised while
+        computing a result are not cached.
+        :param ast: The query.
+        :param schema: The JSON schema the query is run against.
+        :param dataset_version: A version identifier for the data being queried.
+        :param compute: A function which computes the query result.
+        :param internal: Whether the query is run with internal-only fields accessible.
+        :return: The (possibly cached) query result.
+        """
+
+        key = self.key(ast, schema, dataset_version, internal)
+        res = self._get(key, _MISSING)
+        if res is _MISSING:
+            res = compute()
+            self._put(key, res)
+        return res
+
+    def clear(self) -> None:
+        """
+        Removes all cached results and resets the hit and miss counters.
+        """
+        with self._lock:
+            self._results.clear()
+            self.hits = 0
+            self.misses = 0
@@ -0,0 +1,377 @@
+from collections.abc import Callable, Sequence
+from operator import and_, contains, eq, ge, gt, le, lt, or_
+from typing import Any, TypeGuard
+
+import numpy as np
+
+from . import data_structure as ds
+from . import queries as q
+from ._types import JSONSchema
+
+__all__ = [
+    "check_ast_against_data_structures",
+]
+
+# Batched, columnar evaluation of queries against many data structures at once.
+#  Every #resolve path in a query is extracted once into a typed NumPy column per array level, with owner (offset)
+#  arrays linking array items to their parent item or data structure. Index combinations for all data structures are
+#  then built as a single table of rows, and each query expression is evaluated as a vectorized operation over the rows.
+#  The result is identical to calling check_ast_against_data_structure(...) on each data structure in turn; in both,
+#  an array item which has an empty nested array accessed by the query contributes no index combinations, even if the
+#  query also accesses sibling nested arrays or other fields of the item.
+
+type Value = np.ndarray | q.LiteralValue | frozenset
+# Operators are applied to both column values and NumPy scalars, so their operands are looser than ds.BBOperator's
+type Operator = Callable[[Any, Any], Any]
+
+# Largest integer magnitude which can be stored in a float64 column without changing comparison results
+_MAX_EXACT_FLOAT_INT = 2**53
+
+_STRING_DTYPE = np.dtypes.StringDType()
+
+
+def _to_column(values: list) -> np.ndarray:
+    """
+    Converts a list of Python values into the most specific NumPy array type which preserves Python comparison semantics
+    exactly, falling back to an object array for mixed or non-scalar values.
+    :param values: The values to convert.
+    :return: A one-dimensional NumPy array.
+    """
+
+    types = {type(v) for v in values}
+
+    if types == {bool}:
+        return np.array(values, dtype=bool)
+    if types == {str}:
+        return np.array(values, dtype=_STRING_DTYPE)
+    if types == {int} and all(-(2**63) <= v < 2**63 for v in values):
+        return np.array(values, dtype=np.int64)
+    if types and types <= {int, float} and all(abs(v) <= _MAX_EXACT_FLOAT_INT for v in values if type(v) is int):
+        return np.array(values, dtype=np.float64)
+
+    return np.fromiter(values, dtype=object, count=len(values))
+
+
+def _get(value, keys: tuple[str, ...]):
+    for k in keys:
+        value = value[k]
+    return value
+
+
+class _ArrayLevel:
+    def __init__(self, path: str, parent: "_ArrayLevel | None", keys: tuple[str, ...]):
+        self.path: str = path  # Path of the array, matching the keys used in index combinations
+        self.parent: _ArrayLevel | None = parent  # Enclosing array level; None if the array is on the data structure
+        self.keys: tuple[str, ...] = keys  # Object keys to follow from the parent's items to get to the array
+        self.children: list[_ArrayLevel] = []
+
+        self.items: list = []  # Flattened items of this array level, for all data structures
+        self.owner: np.ndarray = np.zeros(0, dtype=np.int64)  # Index of each item's parent item / data structure
+
+
+class _ColumnarBatch:
+    def __init__(self, data_structures: Sequence[ds.QueryableStructure], resolves: tuple[tuple[q.Literal, ...], ...]):
+        self._data_structures: Sequence[ds.QueryableStructure] = data_structures
+        self._levels: dict[str, _ArrayLevel] = {}
+        # Resolve path -> (deepest array level or None, keys to follow from its items to get to the resolved value)
+        self._resolves: dict[tuple[str, ...], tuple[_ArrayLevel | None, tuple[str, ...]]] = {}
+        self._columns: dict[tuple[str, ...], np.ndarray] = {}
+
+        for r in resolves:
+            self._register_resolve(tuple(str(lit.value) for lit in r))
+
+        # Flatten each array level into items + owner offsets, parents before children (guaranteed by insertion order)
+        for level in self._levels.values():
+            parents = data_structures if level.parent is None else level.parent.items
+            owner: list[int] = []
+            for i, p in enumerate(parents):
+                array = _get(p, level.keys)
+                owner.extend([i] * len(array))
+                level.items.extend(array)
+            level.owner = np.array(owner, dtype=np.int64)
+
+        # Build the table of all index combinations for all data structures; one row per combination.
+        self.row_owner, self.row_items = self._index_combinations(
+            [lv for lv in self._levels.values() if lv.parent is None], len(data_structures)
+        )
+        self.n_rows: int = len(self.row_owner)
+
+    def _register_resolve(self, resolve: tuple[str, ...]) -> None:
+        if resolve in self._resolves:
+            return
+
+        level: _ArrayLevel | None = None
+        path = "_root"
+        keys: list[str] = []
+
+        for v in resolve:
+            if v == "[item]":
+                if path not in self._levels:
+                    new_level = _ArrayLevel(path, level, tuple(keys))
+                    self._levels[path] = new_level
+                    if level is not None:
+                        level.children.append(new_level)
+                level = self._levels[path]
+                keys = []
+            else:
+                keys.append(v)
+            path = f"{path}.{v}"
+
+        self._resolves[resolve] = (level, tuple(keys))
+
+    @staticmethod
+    def _grouped_product(
+        tables: list[tuple[np.ndarray, dict[str, np.ndarray]]], n_owners: int
+    ) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+        """
+        Takes the cross product of several tables of index combinations, separately for each owner (i.e., parent item
+        or data structure.) Each table is a tuple of (owner per row, {array path: item index per row}), sorted by owner.
+        Rows are produced in the same order as itertools.product would produce them for each owner.
+        """
+
+        owner = np.arange(n_owners, dtype=np.int64)
+        cols: dict[str, np.ndarray] = {}
+
+        for t_owner, t_cols in tables:
+            c1 = np.bincount(owner, minlength=n_owners)
+            c2 = np.bincount(t_owner, minlength=n_owners)
+            s1 = np.cumsum(c1) - c1
+            s2 = np.cumsum(c2) - c2
+            counts = c1 * c2
+
+            new_owner = np.repeat(np.arange(n_owners, dtype=np.int64), counts)
+            k = np.arange(len(new_owner), dtype=np.int64) - np.repeat(np.cumsum(counts) - counts, counts)
+            c2_rows = c2[new_owner]
+            i1 = s1[new_owner] + k // c2_rows
+            i2 = s2[new_owner] + k % c2_rows
+
+            cols = {**{p: v[i1] for p, v in cols.items()}, **{p: v[i2] for p, v in t_cols.items()}}
+            owner = new_owner
+
+        return owner, cols
+
+    def _level_combinations(self, level: _ArrayLevel) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+        n_items = len(level.items)
+
+        if not level.children:
+            return level.owner, {level.path: np.arange(n_items, dtype=np.int64)}
+
+        # Items without any child index combinations drop out, like in _create_index_combinations
+        item_idx, cols = self._grouped_product([self._level_combinations(c) for c in level.children], n_items)
+        return level.owner[item_idx], {level.path: item_idx, **cols}
+
+    def _index_combinations(
+        self, top_levels: list[_ArrayLevel], n_data_structures: int
+    ) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+        return self._grouped_product([self._level_combinations(lv) for lv in top_levels], n_data_structures)
+
+    def column(self, resolve: q.Args, rows: np.ndarray) -> np.ndarray:
+        key = tuple(str(lit.value) for lit in resolve)
+        level, keys = self._resolves[key]
+
+        if key not in self._columns:
+            items = self._data_structures if level is None else level.items
+            self._columns[key] = _to_column([_get(i, keys) for i in items])
+
+        col = self._columns[key]
+        return col[self.row_owner[rows]] if level is None else col[self.row_items[level.path][rows]]
+
+
+def _is_typed(v: Value) -> TypeGuard[np.ndarray]:
+    return isinstance(v, np.ndarray) and v.dtype != object
+
+
+def _to_list(v: Value, n: int) -> list:
+    return v.tolist() if isinstance(v, np.ndarray) else [v] * n
+
+
+def _elementwise(op: Operator, lhs: Value, rhs: Value, n: int) -> np.ndarray:
+    lhs_l = _to_list(lhs, n)
+    rhs_l = _to_list(rhs, n)
+    res = []
+    for lv, rv in zip(lhs_l, rhs_l):
+        try:
+            res.append(op(lv, rv))
+        except TypeError:
+            raise TypeError(f"Type-invalid use of binary operator {op} ({lv}, {rv})")
+    return _to_column(res)
+
+
+def _per_unique(op: Operator, lhs: np.ndarray, rhs: Value) -> np.ndarray:
+    """
+    Evaluates an operator against a typed column and a scalar by applying it once per unique column value; this keeps
+    exact Python operator semantics while scaling with the number of distinct values rather than the number of rows.
+    """
+    uniques, inverse = np.unique(lhs, return_inverse=True)
+    return _elementwise(op, uniques, rhs, len(uniques))[inverse]
+
+
+_NUMPY_COMPARISONS: dict[Operator, np.ufunc] = {
+    eq: np.equal,
+    lt: np.less,
+    le: np.less_equal,
+    gt: np.greater,
+    ge: np.greater_equal,
+}
+
+
+def _comparison_op(op: Operator) -> Callable[[Value, Value, int], Value]:
+    np_op = _NUMPY_COMPARISONS.get(op)
+
+    def inner(lhs: Value, rhs: Value, n: int) -> Value:
+        lhs_is_array = isinstance(lhs, np.ndarray)
+        rhs_is_array = isinstance(rhs, np.ndarray)
+
+        if not lhs_is_array and not rhs_is_array:
+            # Two constants; evaluate once and let the caller broadcast
+            return _elementwise(op, lhs, rhs, 1).tolist()[0] if n else False
+
+        lhs_vectorizable = _is_typed(lhs) or not lhs_is_array
+        rhs_vectorizable = _is_typed(rhs) or not (rhs_is_array or isinstance(rhs, frozenset))
+
+        if np_op is not None and lhs_vectorizable and rhs_vectorizable:
+            try:
+                return np.asarray(np_op(lhs, rhs), dtype=bool)
+            except TypeError:
+                # Fall through to the element-wise evaluation, which will raise a nicely-formatted TypeError
+                pass
+
+        if _is_typed(lhs) and not rhs_is_array:
+            return _per_unique(op, lhs, rhs)
+
+        return _elementwise(op, lhs, rhs, n)
+
+    return inner
+
+
+def _truthy(v: np.ndarray) -> np.ndarray:
+    if v.dtype == bool:
+        return v
+    return np.fromiter((bool(x) for x in v.tolist()), dtype=bool, count=len(v))
+
+
+def _evaluate(ast: q.AST, batch: _ColumnarBatch, rows: np.ndarray) -> Value:
+    """
+    Evaluates an expression for a subset of the batch's index combination rows.
+    :param ast: The expression to evaluate.
+    :param batch: The batch of data structures, with columns for the query's resolves.
+    :param rows: Indices of the index combination rows to evaluate the expression for.
+    :return: Either a scalar (for constant expressions) or a NumPy array with one value per row.
+    """
+
+    if ast.type == "l":
+        return ast.value
+
+    fn = ast.fn
+
+    if fn == q.FUNCTION_RESOLVE:
+        return batch.column(ast.args, rows)
+
+    if fn == q.FUNCTION_LIST:
+        return frozenset(lit.value for lit in ast.args)
+
+    n = len(rows)
+
+    if fn == q.FUNCTION_NOT:
+        child = _evaluate(ast.args[0], batch, rows)
+        if not isinstance(child, np.ndarray):
+            return not child
+        return ~_truthy(child)
+
+    if fn in (q.FUNCTION_AND, q.FUNCTION_OR):
+        is_and = fn == q.FUNCTION_AND
+        op = and_ if is_and else or_
+
+        value = _evaluate(ast.args[0], batch, rows)
+        for arg in ast.args[1:]:
+            if not isinstance(value, np.ndarray):
+                value = _to_column([value] * n)
+
+            # Mirror _binary_op's shortcut: the next argument is only evaluated for rows which aren't decided yet, and
+            # decided rows evaluate to exactly False (#and) or True (#or).
+            truth = _truthy(value)
+            pending = np.flatnonzero(truth if is_and else ~truth)
+            rhs = _evaluate(arg, batch, rows[pending])
+            lhs_pending = value[pending]
+
+            if lhs_pending.dtype == bool and (isinstance(rhs, bool) or (_is_typed(rhs) and rhs.dtype == bool)):
+                new_value = np.full(n, not is_and, dtype=bool)
+                new_value[pending] = (lhs_pending & rhs) if is_and else (lhs_pending | rhs)
+            else:
+                new_value_list = [not is_and] * n
+                for i, v in zip(pending.tolist(), _elementwise(op, lhs_pending, rhs, len(pending)).tolist()):
+                    new_value_list[i] = v
+                new_value = _to_column(new_value_list)
+
+            value = new_value
+
+        return value
+
+    lhs = _evaluate(ast.args[0], batch, rows)
+    rhs = _evaluate(ast.args[1], batch, rows)
+    return COLUMNAR_OPERATORS[fn](lhs, rhs, n)
+
+
+COLUMNAR_OPERATORS: dict[q.FunctionName, Callable[[Value, Value, int], Value]] = {
+    q.FUNCTION_LT: _comparison_op(lt),
+    q.FUNCTION_LE: _comparison_op(le),
+    q.FUNCTION_EQ: _comparison_op(eq),
+    q.FUNCTION_GT: _comparison_op(gt),
+    q.FUNCTION_GE: _comparison_op(ge),
+    # ---------------------------------------------------------------
+    q.FUNCTION_CO: _comparison_op(contains),
+    q.FUNCTION_ICO: _comparison_op(ds._icontains),
+    q.FUNCTION_IN: _comparison_op(ds._in),
+    # ---------------------------------------------------------------
+    q.FUNCTION_ISW: _comparison_op(ds._i_starts_with),
+    q.FUNCTION_IEW: _comparison_op(ds._i_ends_with),
+    q.FUNCTION_LIKE: _comparison_op(ds._like_op(case_insensitive=False)),
+    q.FUNCTION_ILIKE: _comparison_op(ds._like_op(case_insensitive=True)),
+}
+
+
+def check_ast_against_data_structures(
+    ast: q.AST,
+    data_structures: Sequence[ds.QueryableStructure],
+    schema: JSONSchema,
+    internal: bool = False,
+    return_indices: bool = False,
+    secure_errors: bool = True,
+    skip_schema_validation: bool = False,
+) -> np.ndarray:
+    """
+    Checks a query against a batch of data structures at once, using vectorized (columnar) evaluation. Results are the
+    same as calling data_structure.check_ast_against_data_structure on each data structure.
+    :param ast: A query to evaluate against the data objects.
+    :param data_structures: The data objects to evaluate the query against.
+    :param schema: A JSON schema representing valid data objects.
+    :param internal: Whether internal-only fields are allowed to be resolved.
+    :param return_indices: Whether to return the indices of matching data objects instead of a boolean mask.
+    :param secure_errors: Whether to not expose any data in error messages. Impairs debugging.
+    :param skip_schema_validation: Whether to skip schema validation on the data structures. Improves performance but
+                                   can lead to wonky errors.
+    :return: Determined by return_indices; either
+               1) A boolean array with one entry per data structure, representing whether the query matches it; or
+               2) An integer array with the indices of all data structures which the query matches.
+    """
+
+    # Validates the query and checks its permissions once, and collects its resolve paths.
+    compiled = ds.compile_query(ast, schema, internal)
+
+    if not skip_schema_validation:
+        for d in data_structures:
+            ds._validate_data_structure_against_schema(d, schema, secure_errors=secure_errors)
+
+    batch = _ColumnarBatch(data_structures, compiled.resolves)
+    value = _evaluate(compiled.ast, batch, np.arange(batch.n_rows, dtype=np.int64))  # Uses the flattened query
+
+    # Same as check_ast_against_data_structure: a row matches only if the query evaluates to exactly True.
+    if isinstance(value, np.ndarray):
+        row_matches = value if value.dtype == bool else np.array([v is True for v in value.tolist()], dtype=bool)
+    else:
+        row_matches = np.full(batch.n_rows, value is True, dtype=bool)
+
+    matches = np.zeros(len(data_structures), dtype=bool)
+    matches[batch.row_owner[row_matches]] = True
+
+    return np.flatnonzero(matches) if return_indices else matches
@@ -1,18 +1,23 @@
 import json
 import re
-from collections.abc import Callable, Iterable
-from functools import partial
-from itertools import chain, product, starmap
+from collections.abc import Callable, Iterable, Sequence
+from functools import lru_cache
+from itertools import chain, count, product
 from operator import and_, contains, eq, ge, gt, le, lt, not_, or_
-
-import jsonschema
+from typing import cast
 
 from bento_lib.utils.operators import is_not_none
 
 from . import queries as q
 from ._types import JSONSchema
+from ._validation import get_schema_validator
+from .search_schema import get_compiled_search_schema
 
-__all__ = ["check_ast_against_data_structure"]
+__all__ = [
+    "CompiledQuery",
+    "compile_query",
+    "check_ast_against_data_structure",
+]
 
 
 type QueryableStructure = dict | list | set | str | int | float | bool
@@ -110,12 +115,129 @@ def regex_from_like_pattern(pattern: str, case_insensitive: bool) -> re.Pattern:
     return re.compile("".join(regex_form), *((re.IGNORECASE,) if case_insensitive else ()))
 
 
+def split_like_pattern(pattern: str) -> tuple[list[str], list[str]]:
+    """
+    Splits an SQL-style match pattern into the literal strings between its wildcards, and the wildcards themselves,
+    handling escapes the same way as regex_from_like_pattern(...).
+    :param pattern: The SQL-style match pattern to split.
+    :return: A tuple of literal strings and (unescaped) wildcards; there is always one more literal than wildcard.
+    """
+
+    literals: list[str] = []
+    wildcards: list[str] = []
+    current: list[str] = []
+    escape_mode: bool = False
+
+    for char in pattern:
+        if char == "\\":
+            escape_mode = True
+            continue
+
+        if char in ("%", "_") and not escape_mode:
+            literals.append("".join(current))
+            wildcards.append(char)
+            current = []
+        else:
+            current.append(char)
+
+        escape_mode = False
+
+    literals.append("".join(current))
+    return literals, wildcards
+
+
+type LikeMatcher = Callable[[str], bool]
+
+
+def _like_fast_path(literals: list[str], wildcards: list[str]) -> LikeMatcher | None:
+    """
+    Builds a matcher for simple LIKE pattern shapes using plain string methods. The matcher is only valid for strings
+    which do not contain newlines, since the regex form of a pattern treats them specially.
+    :param literals: The literal strings between the pattern's wildcards.
+    :param wildcards: The pattern's wildcards.
+    :return: A matcher for the pattern, or None if the pattern does not have a simple shape.
+    """
+
+    # Runs of % with nothing in between are equivalent to a single %
+    norm_literals: list[str] = [literals[0]]
+    norm_wildcards: list[str] = []
+    for wildcard, lit in zip(wildcards, literals[1:]):
+        if wildcard == "%" and norm_wildcards and norm_wildcards[-1] == "%" and not norm_literals[-1]:
+            norm_literals[-1] = lit
+            continue
+        norm_wildcards.append(wildcard)
+        norm_literals.append(lit)
+
+    match norm_wildcards:
+        case []:  # literal
+            return norm_literals[0].__eq__
+        case ["%"]:  # prefix%, %suffix, prefix%suffix
+            prefix, suffix = norm_literals
+            min_len = len(prefix) + len(suffix)
+            if not suffix:
+                return lambda v: v.startswith(prefix)
+            if not prefix:
+                return lambda v: v.endswith(suffix)
+            return lambda v: len(v) >= min_len and v.startswith(prefix) and v.endswith(suffix)
+        case ["%", "%"] if not norm_literals[0] and not norm_literals[2]:  # %contains%
+            infix = norm_literals[1]
+            return lambda v: infix in v
+        case ["_"]:  # prefix_suffix
+            prefix, suffix = norm_literals
+            length = len(prefix) + len(suffix) + 1
+            return lambda v: len(v) == length and v.startswith(prefix) and v.endswith(suffix)
+
+    return None
+
+
+LIKE_PATTERN_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=LIKE_PATTERN_CACHE_SIZE)
+def compile_like_pattern(pattern: str, case_insensitive: bool) -> LikeMatcher:
+    """
+    Compiles an SQL-style match pattern with %/_ wildcards into a matcher function, with the same semantics as matching
+    the Regex object from regex_from_like_pattern(...). Simple pattern shapes (literal, prefix%, %suffix, %contains%,
+    and single _ wildcards) are evaluated with string methods rather than a Regex. Compiled patterns are cached.
+    :param pattern: The SQL-style match pattern to compile.
+    :param case_insensitive: Whether the matcher should be case-insensitive.
+    :return: A function which returns whether a string matches the pattern.
+    """
+
+    regex = regex_from_like_pattern(pattern, case_insensitive)
+
+    def regex_match(v: str) -> bool:
+        return regex.match(v) is not None
+
+    literals, wildcards = split_like_pattern(pattern)
+
+    # Under re.IGNORECASE, some ASCII letters also match non-ASCII characters (e.g. "k" matches the Kelvin sign), so
+    # case-insensitive fast paths are only used when both the pattern and the string are ASCII, for which lower-casing
+    # gives the same result as the Regex.
+    if case_insensitive:
+        if not pattern.isascii():
+            return regex_match
+        literals = [lit.lower() for lit in literals]
+
+    fast_match = _like_fast_path(literals, wildcards)
+
+    if fast_match is None:
+        return regex_match
+
+    # Strings containing newlines are left to the Regex, since wildcards don't match newlines and $ also matches
+    # before a trailing newline.
+    if case_insensitive:
+        return lambda v: fast_match(v.lower()) if v.isascii() and "\n" not in v else regex_match(v)
+
+    return lambda v: regex_match(v) if "\n" in v else fast_match(v)
+
+
 def _like_op(case_insensitive: bool):
     def like_inner(lhs, rhs) -> bool:
         if not isinstance(lhs, str) or not isinstance(rhs, str):
             raise TypeError(f"{q.FUNCTION_LIKE} can only be used with strings")
 
-        return regex_from_like_pattern(rhs, case_insensitive).match(lhs) is not None
+        return compile_like_pattern(rhs, case_insensitive)(lhs)
 
     return like_inner
 
@@ -130,8 +252,9 @@ def _validate_data_structure_against_schema(
     :param data_structure: The data structure to validate
     :param schema: The JSON schema to validate the data structure against
     """
-    schema_validator = jsonschema.Draft7Validator(schema)
-    if not schema_validator.is_valid(data_structure):
+    # Validators are cached per schema, and errors are collected in the same pass as validity is determined.
+    errors = get_schema_validator(schema).errors(data_structure)
+    if errors:
         # There is a mismatch between the data structure and the corresponding
         # search schema. This probably means either the schema is incorrect or
         # the service is returning data that doesn't conform to what it says it
@@ -139,7 +262,6 @@ def _validate_data_structure_against_schema(
         # schema, and validation errors will all be returned in the giant
         # error string.
 
-        errors = tuple(err.message for err in schema_validator.iter_errors(data_structure))
         errors_str = "\n".join(errors)
 
         if secure_errors:
@@ -202,14 +324,13 @@ def evaluate_no_validate(
         # Check that the current permissions (internal or not) allow us to perform the current operation on any resolved
         # fields. Internal queries are used for joins, etc. by services, or are performed by someone with unrestricted
         # access to the data.
+        # This checks the whole AST at once (and is cached for repeated queries), so sub-expressions aren't re-checked.
         # TODO: This could be made more granular (some people could be given access to specific objects / tables)
-        q.check_operation_permissions(
-            ast, schema, lambda rl, s: _resolve_properties_and_check(rl, s, index_combination), internal
-        )
+        q.check_query_permissions(ast, schema, _resolve_search_properties, internal)
 
     # Evaluate the non-literal expression recursively.
     return QUERY_CHECK_SWITCH[ast.fn](
-        ast.args, data_structure, schema, index_combination, internal, resolve_checks, check_permissions
+        ast.args, data_structure, schema, index_combination, internal, resolve_checks, False
     )
 
 
@@ -226,7 +347,13 @@ def evaluate(
     # The 'validate' flag is used to avoid redundantly validating the integrity of child data structures
     _validate_data_structure_against_schema(data_structure, schema, secure_errors=secure_errors)
     return evaluate_no_validate(
-        ast, data_structure, schema, index_combination, internal, resolve_checks, check_permissions
+        q.flatten_boolean_expressions(ast),
+        data_structure,
+        schema,
+        index_combination,
+        internal,
+        resolve_checks,
+        check_permissions,
     )
 
 
@@ -260,18 +387,11 @@ def _collect_array_lengths(
         return () if r is None else (r,)
 
     # If the current expression is a non-resolve function, recurse into its arguments and collect any additional array
-    # accesses; construct a list of possibly redundant array accesses with the arrays' lengths.
-    als = tuple(
+    # accesses, with the arrays' lengths.
+    #  Identical accesses are deduplicated; other accesses of the same array are merged when creating combinations.
+    return dict.fromkeys(
         chain.from_iterable(_collect_array_lengths(e, data_structure, schema, resolve_checks) for e in ast.args)
     )
-    return (
-        a1
-        for i1, a1 in enumerate(als)
-        if not any(
-            a1[0] == a2[0] and len(a1[2]) <= len(a2[2])  # Deduplicate identical or subset items
-            for a2 in als[i1 + 1 :]
-        )
-    )
 
 
 def _dict_combine(dicts: Iterable[dict]):
@@ -309,6 +429,31 @@ def _create_index_combinations(
         yield from _create_all_index_combinations(item_template, (array_data[2][i],))
 
 
+def _create_merged_index_combinations(
+    parent_template: IndexCombination, arrays_data: Sequence[ArrayLengthData]
+) -> Iterable[IndexCombination]:
+    """
+    Creates combinations of array indices from several length data entries for the same array (e.g. from different
+    resolve paths through the array.) The entries share the array's index, and each item's child arrays from every entry
+    are combined as siblings.
+    :param parent_template: A dictionary with information about the array's parent's current fixed indexed configuration
+    :param arrays_data: Length data entries for the same array
+    :return: An iterable of different combinations of fixed indices for the array and its children (for later search)
+    """
+
+    array_path, array_length = arrays_data[0][0], arrays_data[0][1]
+
+    for i in range(array_length):
+        item_template = {**parent_template, array_path: i}
+        children = tuple(array_data[2][i] for array_data in arrays_data if array_data[2])
+
+        if not children:
+            yield item_template
+            continue
+
+        yield from _create_all_index_combinations(item_template, children)
+
+
 def _create_all_index_combinations(
     parent_template: IndexCombination, arrays_data: Iterable[ArrayLengthData]
 ) -> Iterable[IndexCombination]:
@@ -319,6 +464,12 @@ def _create_all_index_combinations(
     :return: An iterable of different combinations of fixed indices for the arrays and their children (for later search)
     """
 
+    # The same array may have more than one entry (if it is accessed via different resolve paths which aren't subsets of
+    # each other); these must share an index rather than being crossed with each other.
+    arrays_by_path: dict[str, list[ArrayLengthData]] = {}
+    for array_data in arrays_data:
+        arrays_by_path.setdefault(array_data[0], []).append(array_data)
+
     # Combine index mappings from different combination sets into a final list of array index combinations
     # Takes the cross product of the combination sets, since they're parallel fixations and there may be inter-item
     # comparisons between the two sets.
@@ -327,7 +478,14 @@ def _create_all_index_combinations(
     return map(
         _dict_combine,
         # Loop through and recurse
-        product(*map(partial(_create_index_combinations, parent_template), arrays_data)),
+        product(
+            *(
+                _create_index_combinations(parent_template, ad[0])
+                if len(ad) == 1
+                else _create_merged_index_combinations(parent_template, ad)
+                for ad in arrays_by_path.values()
+            )
+        ),
     )
 
 
@@ -356,26 +514,14 @@ def check_ast_against_data_structure(
                2) An iterable of all index combinations where the query matches the data object
     """
 
-    if not skip_schema_validation:
-        # Validate data structure against JSON schema here to avoid having to repetitively do it later
-        _validate_data_structure_against_schema(data_structure, schema, secure_errors=secure_errors)
-
-    # Collect all array resolves and their lengths in order to properly cross-product arrays
-    array_lengths = _collect_array_lengths(ast, data_structure, schema, True)
-
-    # Create all combinations of indexes into arrays and enumerate them; to be used to loop through all combinations of
-    # array indices to freeze "[item]"s at particular indices across the whole query.
-    index_combinations = enumerate(_create_all_index_combinations({}, array_lengths))
-
-    # TODO: What to do here? Should be standardized, esp. w/r/t False returns
-
-    def _evaluate(i: int, ic: IndexCombination) -> bool:
-        return evaluate_no_validate(ast, data_structure, schema, ic, internal, False, (i == 0)) is True
-
-    if return_all_index_combinations:
-        return (ic for i, ic in index_combinations if _evaluate(i, ic))
-
-    return any(starmap(_evaluate, index_combinations))
+    # Compile the query once for this call; this validates and checks permissions for the whole query up-front, rather
+    # than per evaluation. Callers checking many data structures with the same query should use compile_query directly.
+    return compile_query(ast, schema, internal).check(
+        data_structure,
+        return_all_index_combinations=return_all_index_combinations,
+        secure_errors=secure_errors,
+        skip_schema_validation=skip_schema_validation,
+    )
 
 
 def _binary_op(
@@ -388,10 +534,6 @@ def _binary_op(
     :return: Operator lambda for use in evaluating expressions
     """
 
-    # needed for shortcutting assessment of boolean operators
-    is_and = op == and_
-    is_or = op == or_
-
     def uncurried_binary_op(
         args: q.Args,
         ds: QueryableStructure,
@@ -407,17 +549,6 @@ def _binary_op(
         # override it with a custom-message type error.
 
         lhs = evaluate_no_validate(args[0], ds, schema, ic, internal, resolve_checks, check_permissions)
-
-        # These shortcuts mean that the RHS does NOT get type-checked!
-
-        # Shortcut #and
-        if is_and and not lhs:
-            return False
-
-        # Shortcut #or
-        if is_or and lhs:
-            return True
-
         rhs = evaluate_no_validate(args[1], ds, schema, ic, internal, resolve_checks, check_permissions)
 
         try:
@@ -428,6 +559,94 @@ def _binary_op(
     return uncurried_binary_op
 
 
+# Functions whose (nested) arguments are evaluated in a single loop with an explicit stack, so that deeply nested
+# queries don't recurse; see _evaluate_boolean_op(...) and _CompiledBooleanOp.
+LOGICAL_FUNCTIONS = frozenset({q.FUNCTION_AND, q.FUNCTION_OR, q.FUNCTION_NOT})
+
+
+def _evaluate_boolean_op(
+    fn: q.FunctionName,
+    args: q.Args,
+    ds: QueryableStructure,
+    schema: JSONSchema,
+    ic: IndexCombination | None,
+    internal: bool,
+    resolve_checks: bool,
+) -> QueryableStructure:
+    """
+    Evaluates an #and / #or / #not expression. #and / #or take any number of arguments, evaluated left to right; with
+    two arguments, they behave exactly like _binary_op(and_) / _binary_op(or_). Nested #and / #or / #not arguments are
+    evaluated in the same loop, using an explicit stack, rather than recursively.
+    :param fn: The function of the expression (#and, #or, or #not)
+    :param args: The arguments of the expression
+    :return: The value of the expression
+    """
+
+    # Frames: [function, arguments, number of arguments evaluated, value so far]
+    stack: list[list] = [[fn, args, 0, None]]
+
+    while True:
+        frame = stack[-1]
+        e_fn, e_args, i, value = frame
+
+        if i == len(e_args):
+            result = not_(value) if e_fn == q.FUNCTION_NOT else value
+        elif i and (not value if e_fn == q.FUNCTION_AND else value):
+            # Shortcut #and / #or; the remaining arguments do NOT get type-checked!
+            result = e_fn == q.FUNCTION_OR
+        else:
+            arg = e_args[i]
+            frame[2] = i + 1
+
+            if arg.type == "e" and arg.fn in LOGICAL_FUNCTIONS:
+                stack.append([arg.fn, arg.args, 0, None])
+                continue
+
+            _combine_boolean_arg(frame, evaluate_no_validate(arg, ds, schema, ic, internal, resolve_checks, False))
+            continue
+
+        stack.pop()
+        if not stack:
+            return result
+        _combine_boolean_arg(stack[-1], result)
+
+
+def _combine_boolean_arg(frame: list, rhs: QueryableStructure) -> None:
+    # Combines the value of a frame's most recently evaluated argument into the frame's value
+    if frame[2] == 1:
+        frame[3] = rhs
+        return
+
+    op = and_ if frame[0] == q.FUNCTION_AND else or_
+    try:
+        frame[3] = op(frame[3], rhs)
+    except TypeError:
+        raise TypeError(f"Type-invalid use of binary operator {op} ({frame[3]}, {rhs})")
+
+
+def _boolean_op(
+    fn: q.FunctionName,
+) -> Callable[[q.Args, QueryableStructure, JSONSchema, IndexCombination | None, bool, bool, bool], QueryableStructure]:
+    """
+    Returns an #and / #or / #not operator for use in evaluating expressions; see _evaluate_boolean_op.
+    :param fn: The function (#and, #or, or #not) the operator is representing
+    :return: Operator function for use in evaluating expressions
+    """
+
+    def uncurried_boolean_op(
+        args: q.Args,
+        ds: QueryableStructure,
+        schema: JSONSchema,
+        ic: IndexCombination | None,
+        internal: bool,
+        resolve_checks: bool,
+        _check_permissions: bool,
+    ) -> QueryableStructure:
+        return _evaluate_boolean_op(fn, args, ds, schema, ic, internal, resolve_checks)
+
+    return uncurried_boolean_op
+
+
 def _resolve_checks(resolve_value: str, schema: JSONSchema):
     """
     Performs standard checks while going through any type of "resolve"-based function (where a #resolve call is being
@@ -533,6 +752,14 @@ def _resolve_properties_and_check(
     :return: The resolved value after exploring the resolve path, and the search operations that can be performed on it
     """
 
+    if (schema_path := get_compiled_search_schema(schema).get(resolve)) is not None:
+        for path in schema_path.array_paths:
+            if index_combination is None or path not in index_combination:
+                # TODO: Specific exception class
+                raise Exception(f"Index combination not provided for path {path}")  # noqa: TRY002
+        return schema_path.search_properties
+
+    # Invalid path: walk the schema to raise the appropriate error
     path = "_root"
     r_schema = schema
 
@@ -551,6 +778,29 @@ def _resolve_properties_and_check(
     return r_schema.get("search", {})
 
 
+def _resolve_search_properties(resolve: tuple[q.Literal, ...], schema: JSONSchema) -> dict:
+    """
+    Resolves a path into its search properties without requiring an index combination, i.e. checking only that the
+    path is valid for the schema. Used for checking permissions once per query rather than once per evaluation.
+    :param resolve: The path to resolve, not including the current data structure
+    :param schema: The JSON schema representing the resolving data structure
+    :return: The search properties of the schema node at the end of the resolve path
+    """
+
+    if (schema_path := get_compiled_search_schema(schema).get(resolve)) is not None:
+        return schema_path.search_properties
+
+    # Invalid path: walk the schema to raise the appropriate error
+    r_schema = schema
+
+    for current_resolve in resolve:
+        current_resolve_value = current_resolve.value
+        _resolve_checks(current_resolve_value, r_schema)
+        r_schema = r_schema["items"] if r_schema["type"] == "array" else r_schema["properties"][current_resolve_value]
+
+    return r_schema.get("search", {})
+
+
 def _resolve(
     resolve: tuple[q.Literal, ...],
     resolving_ds: QueryableStructure,
@@ -573,11 +823,13 @@ def _resolve(
 
     for current_resolve in resolve:
         current_resolve_value = current_resolve.value
-        resolving_ds = (
-            resolving_ds[index_combination[path]]
-            if current_resolve_value == "[item]"
-            else resolving_ds[current_resolve_value]
-        )
+        if current_resolve_value == "[item]":
+            if index_combination is None or path not in index_combination:
+                # TODO: Specific exception class
+                raise Exception(f"Index combination not provided for path {path}")  # noqa: TRY002
+            resolving_ds = resolving_ds[index_combination[path]]
+        else:
+            resolving_ds = resolving_ds[current_resolve_value]
         path = f"{path}.{current_resolve_value}"
 
     return resolving_ds
@@ -605,9 +857,9 @@ QUERY_CHECK_SWITCH: dict[
     q.FunctionName,
     Callable[[q.Args, QueryableStructure, JSONSchema, IndexCombination | None, bool, bool, bool], QueryableStructure],
 ] = {
-    q.FUNCTION_AND: _binary_op(and_),
-    q.FUNCTION_OR: _binary_op(or_),
-    q.FUNCTION_NOT: lambda args, *rest: not_(evaluate_no_validate(args[0], *rest)),
+    q.FUNCTION_AND: _boolean_op(q.FUNCTION_AND),
+    q.FUNCTION_OR: _boolean_op(q.FUNCTION_OR),
+    q.FUNCTION_NOT: _boolean_op(q.FUNCTION_NOT),
     # ---------------------------------------------------------------
     q.FUNCTION_LT: _binary_op(lt),
     q.FUNCTION_LE: _binary_op(le),
@@ -627,3 +879,811 @@ QUERY_CHECK_SWITCH: dict[
     q.FUNCTION_RESOLVE: _resolve,
     q.FUNCTION_LIST: _list,
 }
+
+
+# Compiled query plans -------------------------------------------------------------------------------------------------
+#  Rather than re-dispatching through QUERY_CHECK_SWITCH, re-validating, and re-building resolve path strings for every
+#  node of every evaluation, a query can be compiled once into a tree of closures with resolve paths pre-split,
+#  operators bound, and literal right-hand sides pre-converted.
+
+type Memo = dict[tuple[int, ...], QueryableStructure]
+type CompiledNode = Callable[[QueryableStructure, IndexCombination | None, Memo], QueryableStructure]
+type LiteralRHSOperator = Callable[[str], Callable[[QueryableStructure], bool]]
+
+
+_memo_keys = count()
+
+
+def _resolve_item_paths(resolve: q.Args) -> tuple[str, ...]:
+    """
+    Returns the paths of all arrays (i.e., index combination keys) which a resolve path accesses items of.
+    """
+    paths: list[str] = []
+    path = "_root"
+    for r in resolve:
+        if r.value == "[item]":
+            paths.append(path)
+        path = f"{path}.{r.value}"
+    return tuple(paths)
+
+
+class _CompileContext:
+    """
+    State for compiling a single block of a query, i.e., an expression which is evaluated in a loop over index
+    combinations of the arrays it accesses. Sub-expressions which only depend on some of these arrays have their results
+    memoized, keyed by the index combination entries they actually depend on, so that they are not re-evaluated for
+    every combination of the other arrays.
+    """
+
+    def __init__(self, ast: q.AST):
+        self._array_paths: dict[int, frozenset[str]] = {}
+        self.block_array_paths: frozenset[str] = self.array_paths(ast)
+        self.compiled: dict[int, CompiledNode] = {}  # id(AST node) -> compiled closure
+
+    def array_paths(self, ast: q.AST) -> frozenset[str]:
+        """
+        Returns the set of array paths (index combination keys) which an expression's value depends on.
+        """
+        if (paths := self._array_paths.get(id(ast))) is not None:
+            return paths
+
+        # Computed bottom-up with an explicit stack, so that deeply nested expressions don't recurse.
+        stack: list[tuple[q.AST, bool]] = [(ast, False)]
+
+        while stack:
+            e, args_done = stack.pop()
+            if id(e) in self._array_paths:
+                continue
+
+            if e.type == "l":
+                paths = frozenset()
+            elif e.fn == q.FUNCTION_RESOLVE:
+                paths = frozenset(_resolve_item_paths(e.args))
+            elif not args_done:
+                stack.append((e, True))
+                stack.extend((a, False) for a in e.args)
+                continue
+            else:
+                paths = frozenset(chain.from_iterable(self._array_paths[id(a)] for a in e.args))
+
+            self._array_paths[id(e)] = paths
+
+        return self._array_paths[id(ast)]
+
+
+def _memoize(fn: CompiledNode, array_paths: frozenset[str]) -> CompiledNode:
+    """
+    Wraps a compiled closure so its value is computed once per distinct set of indices into the arrays it depends on.
+    :param fn: The compiled closure to wrap
+    :param array_paths: The array paths (index combination keys) which the closure's value depends on
+    :return: A memoizing closure, storing values in the memo passed at evaluation time
+    """
+
+    key_base = next(_memo_keys)
+    paths = tuple(sorted(array_paths))
+
+    def memoized(ds: QueryableStructure, ic: IndexCombination | None, memo: Memo) -> QueryableStructure:
+        try:
+            key = (key_base, *(ic[p] for p in paths))  # type: ignore
+        except (KeyError, TypeError):
+            # Missing index combination entries - evaluate directly to raise the appropriate error
+            return fn(ds, ic, memo)
+
+        if key in memo:
+            return memo[key]
+
+        value = memo[key] = fn(ds, ic, memo)
+        return value
+
+    return memoized
+
+
+def _compile_node(ast: q.AST, ctx: _CompileContext) -> CompiledNode:
+    """
+    Compiles an AST node into a closure which evaluates it against a data structure and index combination.
+    :param ast: The (already validated) AST node to compile.
+    :param ctx: The compilation context of the block being compiled.
+    :return: A closure taking a data structure, an index combination, and a memo, returning the node's value.
+    """
+
+    if (fn := ctx.compiled.get(id(ast))) is not None:
+        return fn
+
+    # Arguments are compiled first, bottom-up with an explicit stack, so that compiling a node only looks up its
+    # arguments' closures in ctx.compiled rather than recursing into them. Arguments of resolves and lists are literals
+    # which are handled by their functions' compilers.
+    stack: list[tuple[q.AST, bool]] = [(ast, False)]
+
+    while stack:
+        e, args_done = stack.pop()
+        if id(e) in ctx.compiled:
+            continue
+        if not args_done and e.type == "e" and e.fn not in (q.FUNCTION_RESOLVE, q.FUNCTION_LIST):
+            stack.append((e, True))
+            stack.extend((a, False) for a in e.args)
+            continue
+        ctx.compiled[id(e)] = _compile_single_node(e, ctx)
+
+    return ctx.compiled[id(ast)]
+
+
+def _compile_single_node(ast: q.AST, ctx: _CompileContext) -> CompiledNode:
+    # Compiles a node whose arguments (if any) have already been compiled; see _compile_node(...)
+    if ast.type == "l":
+        value = ast.value
+        fn: CompiledNode = lambda _ds, _ic, _memo: value
+    else:
+        fn = QUERY_COMPILE_SWITCH[ast.fn](ast.args, ctx)
+
+        # Resolves and lists are about as cheap to evaluate as a memo lookup, so only memoize operator results which
+        # stay the same across some of the block's index combinations (including invariant sub-expressions).
+        if ast.fn not in (q.FUNCTION_RESOLVE, q.FUNCTION_LIST) and (
+            (array_paths := ctx.array_paths(ast)) < ctx.block_array_paths
+        ):
+            fn = fn.memoize(array_paths) if isinstance(fn, _CompiledBooleanOp) else _memoize(fn, array_paths)
+
+    return fn
+
+
+def _compile_block(ast: q.AST) -> tuple[CompiledNode, tuple[CompiledNode, ...]]:
+    """
+    Compiles an expression which is evaluated in a loop over the index combinations of the arrays it accesses.
+    :param ast: The (already validated) expression to compile.
+    :return: A tuple of the compiled expression and its guards: if the expression is an #and, closures for those of its
+             arguments which are invariant across all index combinations. If any guard evaluates to a falsy value, the
+             expression cannot be True for any index combination, so the whole loop can be skipped.
+    """
+
+    ctx = _CompileContext(ast)
+    fn = _compile_node(ast, ctx)
+
+    guards: tuple[CompiledNode, ...] = ()
+    if ast.type == "e" and ast.fn == q.FUNCTION_AND and ctx.block_array_paths:
+        guards = tuple(ctx.compiled[id(a)] for a in ast.args if not ctx.array_paths(a))
+
+    return fn, guards
+
+
+def _guards_pass(guards: tuple[CompiledNode, ...], ds: QueryableStructure, memo: Memo) -> bool:
+    return all(g(ds, {}, memo) for g in guards)
+
+
+def _compile_binary_op(
+    op: BBOperator, literal_rhs_op: LiteralRHSOperator | None = None
+) -> Callable[[q.Args, _CompileContext], CompiledNode]:
+    """
+    Returns a compiler for a boolean-returning binary operator, mirroring _binary_op.
+    :param op: The operator being compiled
+    :param literal_rhs_op: If specified, a function which pre-converts a string literal RHS once at compile time and
+                           returns an operator taking only the LHS value.
+    :return: A function compiling the operator's arguments into a closure
+    """
+
+    def compile_binary_op(args: q.Args, ctx: _CompileContext) -> CompiledNode:
+        lhs_fn = _compile_node(args[0], ctx)
+
+        if literal_rhs_op is not None and args[1].type == "l" and isinstance(args[1].value, str):
+            rhs_value = args[1].value
+            bound_op = literal_rhs_op(rhs_value)
+
+            def compiled_literal_rhs_op(ds: QueryableStructure, ic: IndexCombination | None, memo: Memo) -> bool:
+                lhs = lhs_fn(ds, ic, memo)
+                try:
+                    return bound_op(lhs)
+                except TypeError:
+                    raise TypeError(f"Type-invalid use of binary operator {op} ({lhs}, {rhs_value})")
+
+            return compiled_literal_rhs_op
+
+        rhs_fn = _compile_node(args[1], ctx)
+
+        def compiled_binary_op(ds: QueryableStructure, ic: IndexCombination | None, memo: Memo) -> bool:
+            lhs = lhs_fn(ds, ic, memo)
+            rhs = rhs_fn(ds, ic, memo)
+
+            try:
+                return op(lhs, rhs)
+            except TypeError:
+                raise TypeError(f"Type-invalid use of binary operator {op} ({lhs}, {rhs})")
+
+        return compiled_binary_op
+
+    return compile_binary_op
+
+
+class _CompiledBooleanOp:
+    """
+    A compiled #and / #or / #not expression, mirroring _evaluate_boolean_op. Nested compiled boolean expressions are
+    evaluated in a single loop with an explicit stack (see _evaluate_compiled_boolean_op), rather than by calling each
+    other, so that deeply nested queries don't recurse. Like other compiled closures, its value can be memoized.
+    """
+
+    __slots__ = ("args", "fn", "memo_key_base", "memo_paths")
+
+    def __init__(self, fn: q.FunctionName, args: tuple[CompiledNode, ...]):
+        self.fn: q.FunctionName = fn
+        self.args: tuple[CompiledNode, ...] = args
+        self.memo_key_base: int | None = None  # Set if the expression's value is memoized; see memoize(...)
+        self.memo_paths: tuple[str, ...] = ()
+
+    def memoize(self, array_paths: frozenset[str]) -> "_CompiledBooleanOp":
+        """
+        Memoizes the expression's value once per distinct set of indices into the arrays it depends on, like _memoize.
+        """
+        self.memo_key_base = next(_memo_keys)
+        self.memo_paths = tuple(sorted(array_paths))
+        return self
+
+    def memo_key(self, ic: IndexCombination | None) -> tuple[int, ...] | None:
+        if self.memo_key_base is None:
+            return None
+        try:
+            return self.memo_key_base, *(ic[p] for p in self.memo_paths)  # type: ignore
+        except (KeyError, TypeError):
+            # Missing index combination entries - evaluate directly to raise the appropriate error
+            return None
+
+    def __call__(self, ds: QueryableStructure, ic: IndexCombination | None, memo: Memo) -> QueryableStructure:
+        key = self.memo_key(ic)
+        if key is not None and key in memo:
+            return memo[key]
+        return _evaluate_compiled_boolean_op(self, key, ds, ic, memo)
+
+
+def _evaluate_compiled_boolean_op(
+    root: _CompiledBooleanOp,
+    root_key: tuple[int, ...] | None,
+    ds: QueryableStructure,
+    ic: IndexCombination | None,
+    memo: Memo,
+) -> QueryableStructure:
+    # Frames: [compiled expression, number of arguments evaluated, value so far, memo key]; see _evaluate_boolean_op
+    stack: list[list] = [[root, 0, None, root_key]]
+
+    while True:
+        frame = stack[-1]
+        node, i, value, key = frame
+
+        if i == len(node.args):
+            result = not_(value) if node.fn == q.FUNCTION_NOT else value
+        elif i and (not value if node.fn == q.FUNCTION_AND else value):
+            # Shortcut #and / #or, same as with _evaluate_boolean_op (the remaining arguments do NOT get type-checked!)
+            result = node.fn == q.FUNCTION_OR
+        else:
+            arg_fn = node.args[i]
+            frame[1] = i + 1
+
+            if isinstance(arg_fn, _CompiledBooleanOp):
+                arg_key = arg_fn.memo_key(ic)
+                if arg_key is None or arg_key not in memo:
+                    stack.append([arg_fn, 0, None, arg_key])
+                    continue
+                rhs = memo[arg_key]
+            else:
+                rhs = arg_fn(ds, ic, memo)
+
+            _combine_compiled_boolean_arg(frame, rhs)
+            continue
+
+        if key is not None:
+            memo[key] = result
+
+        stack.pop()
+        if not stack:
+            return result
+        _combine_compiled_boolean_arg(stack[-1], result)
+
+
+def _combine_compiled_boolean_arg(frame: list, rhs: QueryableStructure) -> None:
+    # Like _combine_boolean_arg, for frames of _evaluate_compiled_boolean_op
+    if frame[1] == 1:
+        frame[2] = rhs
+        return
+
+    op = and_ if frame[0].fn == q.FUNCTION_AND else or_
+    try:
+        frame[2] = op(frame[2], rhs)
+    except TypeError:
+        raise TypeError(f"Type-invalid use of binary operator {op} ({frame[2]}, {rhs})")
+
+
+def _compile_boolean_op(fn: q.FunctionName) -> Callable[[q.Args, _CompileContext], CompiledNode]:
+    """
+    Returns a compiler for an #and / #or / #not expression; see _CompiledBooleanOp.
+    :param fn: The function (#and, #or, or #not) being compiled
+    :return: A function compiling the expression's arguments into a compiled expression
+    """
+    return lambda args, ctx: _CompiledBooleanOp(fn, tuple(_compile_node(a, ctx) for a in args))
+
+
+def _literal_rhs_contains(rhs: str) -> Callable[[QueryableStructure], bool]:
+    return lambda lhs: rhs in lhs
+
+
+def _literal_rhs_icontains(rhs: str) -> Callable[[QueryableStructure], bool]:
+    rhs_cf = rhs.casefold()
+    return lambda lhs: rhs_cf in lhs.casefold()
+
+
+def _literal_rhs_i_starts_with(rhs: str) -> Callable[[QueryableStructure], bool]:
+    rhs_cf = rhs.casefold()
+
+    def i_starts_with(lhs: QueryableStructure) -> bool:
+        if not isinstance(lhs, str):
+            raise TypeError(f"{q.FUNCTION_ISW} can only be used with strings")
+        return lhs.casefold().startswith(rhs_cf)
+
+    return i_starts_with
+
+
+def _literal_rhs_i_ends_with(rhs: str) -> Callable[[QueryableStructure], bool]:
+    rhs_cf = rhs.casefold()
+
+    def i_ends_with(lhs: QueryableStructure) -> bool:
+        if not isinstance(lhs, str):
+            raise TypeError(f"{q.FUNCTION_IEW} can only be used with strings")
+        return lhs.casefold().endswith(rhs_cf)
+
+    return i_ends_with
+
+
+def _literal_rhs_like_op(case_insensitive: bool) -> LiteralRHSOperator:
+    def literal_rhs_like(rhs: str) -> Callable[[QueryableStructure], bool]:
+        like_match = compile_like_pattern(rhs, case_insensitive)
+
+        def like_inner(lhs: QueryableStructure) -> bool:
+            if not isinstance(lhs, str):
+                raise TypeError(f"{q.FUNCTION_LIKE} can only be used with strings")
+            return like_match(lhs)
+
+        return like_inner
+
+    return literal_rhs_like
+
+
+def _compile_resolve(args: q.Args, _ctx: _CompileContext) -> CompiledNode:
+    """
+    Compiles a resolve path into a closure, pre-computing the sequence of keys and index combination paths to follow.
+    :param args: The resolve path, not including the root data structure
+    :return: A closure resolving the path against a data structure using a particular index combination
+    """
+
+    steps: list[tuple[bool, str]] = []  # (is item access, object key or array path)
+    path = "_root"
+
+    for current_resolve in args:
+        current_resolve_value = str(current_resolve.value)
+        steps.append((True, path) if current_resolve_value == "[item]" else (False, current_resolve_value))
+        path = f"{path}.{current_resolve_value}"
+
+    frozen_steps = tuple(steps)
+
+    def compiled_resolve(ds: QueryableStructure, ic: IndexCombination | None, _memo: Memo) -> QueryableStructure:
+        for is_item, key in frozen_steps:
+            if is_item:
+                if ic is None or key not in ic:
+                    # TODO: Specific exception class
+                    raise Exception(f"Index combination not provided for path {key}")  # noqa: TRY002
+                ds = ds[ic[key]]
+            else:
+                ds = ds[key]
+        return ds
+
+    return compiled_resolve
+
+
+def _compile_list(args: q.Args, _ctx: _CompileContext) -> CompiledNode:
+    values = frozenset(literal.value for literal in args)
+    return lambda _ds, _ic, _memo: values
+
+
+QUERY_COMPILE_SWITCH: dict[q.FunctionName, Callable[[q.Args, _CompileContext], CompiledNode]] = {
+    q.FUNCTION_AND: _compile_boolean_op(q.FUNCTION_AND),
+    q.FUNCTION_OR: _compile_boolean_op(q.FUNCTION_OR),
+    q.FUNCTION_NOT: _compile_boolean_op(q.FUNCTION_NOT),
+    # ---------------------------------------------------------------
+    q.FUNCTION_LT: _compile_binary_op(lt),
+    q.FUNCTION_LE: _compile_binary_op(le),
+    q.FUNCTION_EQ: _compile_binary_op(eq),
+    q.FUNCTION_GT: _compile_binary_op(gt),
+    q.FUNCTION_GE: _compile_binary_op(ge),
+    # ---------------------------------------------------------------
+    q.FUNCTION_CO: _compile_binary_op(contains, _literal_rhs_contains),
+    q.FUNCTION_ICO: _compile_binary_op(_icontains, _literal_rhs_icontains),
+    q.FUNCTION_IN: _compile_binary_op(_in),
+    # ---------------------------------------------------------------
+    q.FUNCTION_ISW: _compile_binary_op(_i_starts_with, _literal_rhs_i_starts_with),
+    q.FUNCTION_IEW: _compile_binary_op(_i_ends_with, _literal_rhs_i_ends_with),
+    q.FUNCTION_LIKE: _compile_binary_op(_like_op(case_insensitive=False), _literal_rhs_like_op(case_insensitive=False)),
+    q.FUNCTION_ILIKE: _compile_binary_op(_like_op(case_insensitive=True), _literal_rhs_like_op(case_insensitive=True)),
+    # ---------------------------------------------------------------
+    q.FUNCTION_RESOLVE: _compile_resolve,
+    q.FUNCTION_LIST: _compile_list,
+}
+
+
+# Array predicate pushdown ---------------------------------------------------------------------------------------------
+#  Evaluating a whole query for every element of the cross product of all arrays it touches is very expensive when
+#  several arrays are involved. Since a query matches if it is True for ANY index combination (i.e., existential
+#  semantics), #and / #or sub-expressions which touch disjoint sets of top-level arrays can instead be evaluated
+#  independently over just their own arrays, as long as every array has at least one index combination. Only
+#  sub-expressions where arrays are correlated within a single comparison (or under a #not) need the cross product.
+
+type GroupIndexCombinations = dict[str, list[IndexCombination]]
+type PlanNode = Callable[[QueryableStructure, GroupIndexCombinations, Memo], bool]
+
+BOOLEAN_FUNCTIONS = frozenset(
+    {
+        q.FUNCTION_NOT,
+        q.FUNCTION_LT,
+        q.FUNCTION_LE,
+        q.FUNCTION_EQ,
+        q.FUNCTION_GT,
+        q.FUNCTION_GE,
+        q.FUNCTION_CO,
+        q.FUNCTION_ICO,
+        q.FUNCTION_IN,
+        q.FUNCTION_ISW,
+        q.FUNCTION_IEW,
+        q.FUNCTION_LIKE,
+        q.FUNCTION_ILIKE,
+    }
+)
+
+
+def _is_boolean_expression(ast: q.AST) -> bool:
+    """
+    Whether an expression is guaranteed to evaluate to a boolean, which is required to split #and / #or expressions.
+    """
+    return _PlanContext().is_boolean_expression(ast)
+
+
+def _resolve_array_group(resolve: q.Args) -> str | None:
+    """
+    Returns the path of the top-level array accessed by a resolve path (the key of its array length data), if any.
+    Nested arrays belong to the same group as their top-level array, since their items are correlated.
+    """
+    path = "_root"
+    for r in resolve:
+        if r.value == "[item]":
+            return path
+        path = f"{path}.{r.value}"
+    return None
+
+
+class _PlanContext:
+    """
+    State for planning a query. The top-level array paths each expression depends on, and whether it is guaranteed to
+    evaluate to a boolean, are computed once per node, bottom-up with an explicit stack, so that planning deeply nested
+    expressions doesn't recurse or re-walk sub-expressions. Nodes are keyed by id, so expressions created for components
+    while planning are kept alive for the lifetime of the context.
+    """
+
+    def __init__(self):
+        self._array_groups: dict[int, tuple[str, ...]] = {}
+        self._is_boolean: dict[int, bool] = {}
+        self._components: list[q.AST] = []
+
+    def _analyze(self, ast: q.AST) -> None:
+        stack: list[tuple[q.AST, bool]] = [(ast, False)]
+
+        while stack:
+            e, args_done = stack.pop()
+            if id(e) in self._array_groups:
+                continue
+
+            if e.type == "l":
+                groups: tuple[str, ...] = ()
+                is_boolean = isinstance(e.value, bool)
+            elif e.fn == q.FUNCTION_RESOLVE:
+                g = _resolve_array_group(e.args)
+                groups, is_boolean = (() if g is None else (g,)), False
+            elif not args_done:
+                stack.append((e, True))
+                stack.extend((a, False) for a in e.args)
+                continue
+            else:
+                # Collects the (ordered, de-duplicated) top-level array paths of the arguments
+                groups = tuple(dict.fromkeys(chain.from_iterable(self._array_groups[id(a)] for a in e.args)))
+                is_boolean = (
+                    all(self._is_boolean[id(a)] for a in e.args)
+                    if e.fn in (q.FUNCTION_AND, q.FUNCTION_OR)
+                    else e.fn in BOOLEAN_FUNCTIONS
+                )
+
+            self._array_groups[id(e)] = groups
+            self._is_boolean[id(e)] = is_boolean
+
+    def array_groups(self, ast: q.AST) -> tuple[str, ...]:
+        """
+        Returns the (ordered, de-duplicated) top-level array paths which an expression depends on.
+        """
+        if id(ast) not in self._array_groups:
+            self._analyze(ast)
+        return self._array_groups[id(ast)]
+
+    def is_boolean_expression(self, ast: q.AST) -> bool:
+        if id(ast) not in self._is_boolean:
+            self._analyze(ast)
+        return self._is_boolean[id(ast)]
+
+    def independent_components(self, ast: q.AST) -> tuple[q.AST, ...]:
+        """
+        Splits an #and / #or expression into expressions for its components which do not share any top-level arrays.
+        :param ast: The expression to split
+        :return: The components, in order of their first argument, or an empty tuple if the expression can't be split
+        """
+
+        if ast.type == "l" or ast.fn not in (q.FUNCTION_AND, q.FUNCTION_OR) or not self.is_boolean_expression(ast):
+            return ()
+
+        components = q.independent_components([self.array_groups(a) for a in ast.args])
+        if len(components) < 2:
+            return ()
+
+        res: list[q.AST] = []
+        for c in components:
+            if len(c) == 1:
+                res.append(ast.args[c[0]])
+                continue
+            e = q.Expression(ast.fn, [ast.args[i] for i in c])
+            self._components.append(e)
+            res.append(e)
+        return tuple(res)
+
+
+class _BooleanPlan:
+    """
+    Plan for an #and / #or expression split into independently-evaluated components. Nested component plans are
+    evaluated in a single loop with an explicit stack, rather than by calling each other.
+    """
+
+    __slots__ = ("is_and", "sub_plans")
+
+    def __init__(self, is_and: bool, sub_plans: tuple[PlanNode, ...]):
+        self.is_and: bool = is_and
+        self.sub_plans: tuple[PlanNode, ...] = sub_plans
+
+    def __call__(self, ds: QueryableStructure, gics: GroupIndexCombinations, memo: Memo) -> bool:
+        # Frames: [plan, number of sub-plans evaluated]
+        stack: list[list] = [[self, 0]]
+
+        while True:
+            frame = stack[-1]
+            plan, i = frame
+
+            if i < len(plan.sub_plans):
+                sub_plan = plan.sub_plans[i]
+                frame[1] = i + 1
+
+                if isinstance(sub_plan, _BooleanPlan):
+                    stack.append([sub_plan, 0])
+                    continue
+
+                # A sub-plan which is True for an #and (or False for an #or) doesn't decide the plan's value
+                if (value := sub_plan(ds, gics, memo)) == plan.is_and:
+                    continue
+            else:
+                value = plan.is_and
+
+            # The plan's value is decided; it decides each enclosing plan's value in the same way, up to the first
+            # enclosing plan for which it doesn't.
+            stack.pop()
+            while stack and value != stack[-1][0].is_and:
+                stack.pop()
+            if not stack:
+                return value
+
+
+def _plan_block(ast: q.AST, groups: tuple[str, ...]) -> PlanNode:
+    """
+    Builds an evaluation plan which checks whether an expression is True for ANY index combination of the arrays it
+    depends on, by evaluating it in a loop over the combinations.
+    :param ast: The (already validated) expression to plan
+    :param groups: The top-level array paths which the expression depends on
+    :return: A closure taking a data structure and per-top-level-array index combinations, returning a boolean
+    """
+
+    fn, guards = _compile_block(ast)
+
+    if not groups:  # Invariant across all index combinations; evaluate once
+        return lambda ds, _gics, memo: fn(ds, {}, memo) is True
+
+    if len(groups) == 1:
+        group = groups[0]
+        return lambda ds, gics, memo: (
+            _guards_pass(guards, ds, memo) and any(fn(ds, ic, memo) is True for ic in gics[group])
+        )
+
+    # Arrays are correlated within this expression, so we need to evaluate the cross product of their combinations.
+    return lambda ds, gics, memo: (
+        _guards_pass(guards, ds, memo)
+        and any(fn(ds, _dict_combine(ics), memo) is True for ics in product(*(gics[g] for g in groups)))
+    )
+
+
+def _plan_node(ast: q.AST) -> PlanNode:
+    """
+    Builds an evaluation plan which checks whether an expression is True for ANY index combination of the arrays it
+    depends on, splitting #and / #or expressions into independently-evaluated components where possible.
+    :param ast: The (already validated) expression to plan
+    :return: A closure taking a data structure and per-top-level-array index combinations, returning a boolean
+    """
+
+    ctx = _PlanContext()
+    plans: dict[int, PlanNode] = {}
+
+    # Planned bottom-up with an explicit stack of (expression, its components - or None if not split yet.)
+    stack: list[tuple[q.AST, tuple[q.AST, ...] | None]] = [(ast, None)]
+
+    while stack:
+        e, components = stack.pop()
+
+        if components is None:
+            if components := ctx.independent_components(e):
+                stack.append((e, components))
+                stack.extend((c, None) for c in components)
+                continue
+            plans[id(e)] = _plan_block(e, ctx.array_groups(e))
+            continue
+
+        plans[id(e)] = _BooleanPlan(e.fn == q.FUNCTION_AND, tuple(plans[id(c)] for c in components))
+
+    return plans[id(ast)]
+
+
+def _check_and_collect_resolves(ast: q.AST, resolves: list[tuple[q.Literal, ...]]) -> None:
+    """
+    Validates a query for evaluation against data structures, once for the whole AST. Also collects all the query's
+    resolve paths, in traversal order, for later array length collection. Permissions are checked separately, via
+    q.check_query_permissions(...).
+    :param ast: The AST-ified query
+    :param resolves: List to append the query's resolve paths to
+    """
+
+    # Walked in order with an explicit stack, so that deeply nested expressions don't recurse.
+    stack: list[q.AST] = [ast]
+
+    while stack:
+        e = stack.pop()
+        if e.type == "l":
+            continue
+
+        # Standard validation to prevent Postgres internal-style queries from being passed in (see _validate_not_wc docs)
+        _validate_not_wc(e)
+
+        if e.fn == q.FUNCTION_RESOLVE:
+            # Resolve arguments are always literals; see q.convert_query_to_ast
+            resolves.append(cast(tuple[q.Literal, ...], e.args))
+            continue
+
+        stack.extend(reversed(e.args))
+
+
+class CompiledQuery:
+    """
+    A query which has been validated, permission-checked, and compiled against a particular schema. Compiled queries can
+    be evaluated repeatedly against many data structures without paying per-record interpretation overhead.
+    Instances should be created via compile_query(...).
+    """
+
+    def __init__(
+        self,
+        ast: q.AST,
+        schema: JSONSchema,
+        internal: bool,
+        fn: CompiledNode,
+        guards: tuple[CompiledNode, ...],
+        plan: PlanNode,
+        resolves: tuple[tuple[q.Literal, ...], ...],
+    ):
+        self.ast: q.AST = ast
+        self.schema: JSONSchema = schema
+        self.internal: bool = internal
+        self._fn: CompiledNode = fn
+        self._guards: tuple[CompiledNode, ...] = guards
+        self._plan: PlanNode = plan
+        self.resolves: tuple[tuple[q.Literal, ...], ...] = resolves
+
+    def __call__(
+        self, data_structure: QueryableStructure, index_combination: IndexCombination | None = None
+    ) -> QueryableStructure:
+        """
+        Evaluates the compiled query into a value for a data structure, with a particular fixed index combination.
+        Equivalent to evaluate_no_validate(...) without any checks.
+        """
+        return self._fn(data_structure, index_combination, {})
+
+    def _collect_array_lengths(self, data_structure: QueryableStructure) -> tuple[ArrayLengthData, ...]:
+        """
+        Equivalent to _collect_array_lengths(...), but using the resolve paths collected at compile time rather than
+        re-walking the AST for each data structure.
+        """
+        return tuple(
+            dict.fromkeys(
+                filter(
+                    is_not_none,
+                    (_resolve_array_lengths(r, data_structure, self.schema, "_root", False) for r in self.resolves),
+                )
+            )
+        )
+
+    def _matching_index_combinations(
+        self, data_structure: QueryableStructure, index_combinations: Iterable[IndexCombination], memo: Memo
+    ) -> Iterable[IndexCombination]:
+        if not _guards_pass(self._guards, data_structure, memo):
+            return
+
+        fn = self._fn
+        yield from (ic for ic in index_combinations if fn(data_structure, ic, memo) is True)
+
+    def check(
+        self,
+        data_structure: QueryableStructure,
+        return_all_index_combinations: bool = False,
+        secure_errors: bool = True,
+        skip_schema_validation: bool = False,
+    ) -> bool | Iterable[IndexCombination]:
+        """
+        Checks the compiled query against a data structure; see check_ast_against_data_structure for parameters.
+        """
+
+        if not skip_schema_validation:
+            # Validate data structure against JSON schema here to avoid having to repetitively do it later
+            _validate_data_structure_against_schema(data_structure, self.schema, secure_errors=secure_errors)
+
+        array_lengths = self._collect_array_lengths(data_structure)
+
+        # Results of sub-expressions which do not depend on every array are shared between index combinations for the
+        # duration of this check.
+        memo: Memo = {}
+
+        if return_all_index_combinations:
+            # Create all combinations of indexes into arrays; to be used to loop through all combinations of array
+            # indices to freeze "[item]"s at particular indices across the whole query.
+            index_combinations = _create_all_index_combinations({}, array_lengths)
+            return self._matching_index_combinations(data_structure, index_combinations, memo)
+
+        # Otherwise, we only need to know if ANY index combination matches; create combinations separately for each
+        # top-level array, and let the plan only cross-product arrays which are correlated within an expression.
+        #  A top-level array can have more than one entry (e.g. if a nested array in its items is resolved before a
+        #  shallower path of the array); as in _create_all_index_combinations(...), these are merged.
+        arrays_by_path: dict[str, list[ArrayLengthData]] = {}
+        for array_data in array_lengths:
+            arrays_by_path.setdefault(array_data[0], []).append(array_data)
+
+        group_index_combinations: GroupIndexCombinations = {}
+        for path, arrays_data in arrays_by_path.items():
+            ics = list(
+                _create_index_combinations({}, arrays_data[0])
+                if len(arrays_data) == 1
+                else _create_merged_index_combinations({}, arrays_data)
+            )
+            if not ics:
+                # The cross product of all index combinations is empty, so nothing can match.
+                return False
+            group_index_combinations[path] = ics
+
+        return self._plan(data_structure, group_index_combinations, memo)
+
+
+def compile_query(ast: q.AST, schema: JSONSchema, internal: bool = False) -> CompiledQuery:
+    """
+    Validates a query and checks its operation permissions once, then compiles it into a reusable plan for evaluating it
+    against many data structures conforming to the same schema.
+    :param ast: A query to compile.
+    :param schema: A JSON schema representing valid data objects.
+    :param internal: Whether internal-only fields are allowed to be resolved.
+    :return: A compiled query, which can be called or checked against data structures.
+    """
+
+    # Long #and / #or chains are flattened first, so that compilation and evaluation don't recurse once per term.
+    ast = q.flatten_boolean_expressions(ast)
+
+    # Permission checks are cached, so re-compiling a query which was already checked doesn't walk the schema again.
+    q.check_query_permissions(ast, schema, _resolve_search_properties, internal)
+
+    resolves: list[tuple[q.Literal, ...]] = []
+    _check_and_collect_resolves(ast, resolves)
+    fn, guards = _compile_block(ast)
+    return CompiledQuery(ast, schema, internal, fn, guards, _plan_node(ast), tuple(resolves))
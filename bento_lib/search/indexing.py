@@ -0,0 +1,583 @@
+from bisect import bisect_left, bisect_right
+from collections.abc import Callable, Iterable, Iterator
+from itertools import chain
+from math import isnan
+from typing import Protocol
+
+from . import data_structure as ds
+from . import operations as op
+from . import queries as q
+from ._types import JSONSchema
+
+__all__ = [
+    "HashIndex",
+    "RangeIndex",
+    "TrigramIndex",
+    "IndexedCollection",
+]
+
+# Indexed in-memory collections of data structures.
+#  For collections which are queried repeatedly, indexes over resolve paths allow answering some query leaves (e.g.,
+#  #eq / #in / #lt / #ico with a literal) without evaluating the query against every data structure. The planner combines
+#  index results for #and / #or expressions into a set of candidate records; these candidates are then checked with the
+#  compiled query, unless the index results are known to be exact.
+
+type ResolvePath = tuple[str, ...]  # e.g. ("biosamples", "[item]", "tumor_grade", "[item]", "id")
+type RecordID = int
+type CandidateSet = set[RecordID] | None  # None: no restriction (i.e., all records are candidates)
+type Plan = tuple[CandidateSet, bool]  # Candidate set, and whether it is exact
+type Bound = tuple[q.LiteralValue, bool] | None  # (value, inclusive), or None if unbounded
+type Bounds = tuple[Bound, Bound]  # Lower and upper bounds
+
+
+class _RecordIndex(Protocol):
+    # Interface shared by all index types for keeping them up to date with the collection's records
+    def add(self, record_id: RecordID, record: ds.QueryableStructure) -> None: ...
+
+    def remove(self, record_id: RecordID, record: ds.QueryableStructure) -> None: ...
+
+
+HASH_INDEX_OPERATIONS = frozenset({op.SEARCH_OP_EQ, op.SEARCH_OP_IN})
+RANGE_INDEX_OPERATIONS = frozenset({op.SEARCH_OP_LT, op.SEARCH_OP_LE, op.SEARCH_OP_GT, op.SEARCH_OP_GE})
+TEXT_INDEX_OPERATIONS = frozenset(
+    {
+        op.SEARCH_OP_CO,
+        op.SEARCH_OP_ICO,
+        op.SEARCH_OP_ISW,
+        op.SEARCH_OP_IEW,
+        op.SEARCH_OP_LIKE,
+        op.SEARCH_OP_ILIKE,
+    }
+)
+TRIGRAM_FUNCTIONS = frozenset(
+    {q.FUNCTION_CO, q.FUNCTION_ICO, q.FUNCTION_ISW, q.FUNCTION_IEW, q.FUNCTION_LIKE, q.FUNCTION_ILIKE}
+)
+
+# Range bounds on a resolved value for each comparison, as (lower bound, upper bound) functions of the literal RHS.
+RANGE_FUNCTION_BOUNDS: dict[q.FunctionName, Callable[[q.LiteralValue], Bounds]] = {
+    q.FUNCTION_LT: lambda v: (None, (v, False)),
+    q.FUNCTION_LE: lambda v: (None, (v, True)),
+    q.FUNCTION_GT: lambda v: ((v, False), None),
+    q.FUNCTION_GE: lambda v: ((v, True), None),
+}
+# The comparison equivalent to each comparison with the arguments swapped, e.g. (#lt 5 x) => (#gt x 5)
+RANGE_FUNCTION_FLIPPED: dict[q.FunctionName, q.FunctionName] = {
+    q.FUNCTION_LT: q.FUNCTION_GT,
+    q.FUNCTION_LE: q.FUNCTION_GE,
+    q.FUNCTION_GT: q.FUNCTION_LT,
+    q.FUNCTION_GE: q.FUNCTION_LE,
+}
+
+
+def _path_values(value: ds.QueryableStructure, path: ResolvePath) -> Iterator[ds.QueryableStructure]:
+    """
+    Yields all values found at a resolve path in a data structure, for any index into any arrays along the path.
+    Missing object keys are skipped rather than raising an error.
+    """
+
+    if not path:
+        yield value
+        return
+
+    key, rest = path[0], path[1:]
+
+    if key == "[item]":
+        if isinstance(value, list):
+            for item in value:
+                yield from _path_values(item, rest)
+    elif isinstance(value, dict) and key in value:
+        yield from _path_values(value[key], rest)
+
+
+def _indexable_paths(schema: JSONSchema, operations: frozenset[str], path: ResolvePath = ()) -> Iterator[ResolvePath]:
+    """
+    Yields the resolve paths of all schema nodes whose search properties allow any of the specified operations.
+    """
+
+    if not operations.isdisjoint(schema.get("search", {}).get("operations", ())):
+        yield path
+
+    if schema.get("type") == "object":
+        for k, sub_schema in schema.get("properties", {}).items():
+            yield from _indexable_paths(sub_schema, operations, (*path, k))
+    elif schema.get("type") == "array" and isinstance(schema.get("items"), dict):
+        yield from _indexable_paths(schema["items"], operations, (*path, "[item]"))
+
+
+class HashIndex:
+    """
+    A hash index mapping values found at a particular resolve path to the IDs of records containing them. Lookups use
+    Python equality, matching the semantics of #eq / #in in the data structure evaluator.
+    """
+
+    def __init__(self, path: ResolvePath):
+        self.path: ResolvePath = path
+        self._ids_by_value: dict[ds.QueryableStructure, set[RecordID]] = {}
+
+    def _record_values(self, record: ds.QueryableStructure) -> set:
+        # Unhashable values (e.g., objects) can never be equal to a literal, so they are not indexed.
+        return {v for v in _path_values(record, self.path) if not isinstance(v, (dict, list, set))}
+
+    def add(self, record_id: RecordID, record: ds.QueryableStructure) -> None:
+        for v in self._record_values(record):
+            self._ids_by_value.setdefault(v, set()).add(record_id)
+
+    def remove(self, record_id: RecordID, record: ds.QueryableStructure) -> None:
+        for v in self._record_values(record):
+            ids = self._ids_by_value[v]
+            ids.discard(record_id)
+            if not ids:
+                del self._ids_by_value[v]
+
+    def lookup(self, value: q.LiteralValue) -> set[RecordID]:
+        return self._ids_by_value.get(value, set())
+
+
+def _value_kind(value: ds.QueryableStructure) -> str | None:
+    """
+    Returns the kind of a value for range comparisons: values of the same kind can be ordered relative to each other (as
+    with Python comparisons in the evaluator), while comparing values of different kinds raises a TypeError.
+    """
+    if isinstance(value, (int, float)):  # Includes booleans, which compare as integers
+        return "number"
+    if isinstance(value, str):  # Includes ISO dates, which are compared as strings
+        return "string"
+    return None
+
+
+class _SortedValues:
+    """
+    Parallel sorted lists of values and the record IDs they belong to, supporting incremental inserts / deletes.
+    """
+
+    def __init__(self):
+        self.values: list[q.LiteralValue] = []
+        self.ids: list[RecordID] = []
+
+    def add(self, value: q.LiteralValue, record_id: RecordID) -> None:
+        i = bisect_right(self.values, value)
+        self.values.insert(i, value)
+        self.ids.insert(i, record_id)
+
+    def remove(self, value: q.LiteralValue, record_id: RecordID) -> None:
+        lo, hi = bisect_left(self.values, value), bisect_right(self.values, value)
+        i = self.ids.index(record_id, lo, hi)
+        del self.values[i]
+        del self.ids[i]
+
+    def range(self, lower: Bound, upper: Bound) -> set[RecordID]:
+        lo = 0
+        if lower is not None:
+            lo = (bisect_left if lower[1] else bisect_right)(self.values, lower[0])
+
+        hi = len(self.values)
+        if upper is not None:
+            hi = (bisect_right if upper[1] else bisect_left)(self.values, upper[0])
+
+        return set(self.ids[lo:hi])
+
+
+class RangeIndex:
+    """
+    A sorted index over values found at a particular resolve path, for answering range comparisons (#lt, #le, #gt, #ge)
+    in O(log n + k) time. Numbers and strings (e.g., ISO dates) are kept in separately-sorted lists, since Python cannot
+    compare them with each other.
+    """
+
+    def __init__(self, path: ResolvePath):
+        self.path: ResolvePath = path
+        self._sorted: dict[str, _SortedValues] = {"number": _SortedValues(), "string": _SortedValues()}
+        self._n_incomparable: int = 0  # Number of indexed values which are neither numbers nor strings
+
+    def _record_values(self, record: ds.QueryableStructure) -> set:
+        # NaN is never less than / greater than anything (so it cannot match), and would break sorting.
+        return {
+            v
+            for v in _path_values(record, self.path)
+            if not isinstance(v, (dict, list, set)) and not (isinstance(v, float) and isnan(v))
+        }
+
+    def add(self, record_id: RecordID, record: ds.QueryableStructure) -> None:
+        for v in self._record_values(record):
+            if (kind := _value_kind(v)) is None:
+                self._n_incomparable += 1
+            else:
+                self._sorted[kind].add(v, record_id)
+
+    def remove(self, record_id: RecordID, record: ds.QueryableStructure) -> None:
+        for v in self._record_values(record):
+            if (kind := _value_kind(v)) is None:
+                self._n_incomparable -= 1
+            else:
+                self._sorted[kind].remove(v, record_id)
+
+    def lookup(self, lower: Bound, upper: Bound) -> set[RecordID] | None:
+        """
+        Finds records with a value in a range.
+        :param lower: The lower bound of the range, if any.
+        :param upper: The upper bound of the range, if any.
+        :return: A set of IDs of records with values in the range, or None if the range cannot be looked up in the
+                 index. This is the case if the bounds are not comparable with each other or with all indexed values,
+                 since evaluating the comparison would then raise an error for some records.
+        """
+
+        kinds = {_value_kind(b[0]) for b in (lower, upper) if b is not None}
+        if len(kinds) != 1 or (kind := kinds.pop()) is None:
+            return None
+
+        if self._n_incomparable or any(sv.values for k, sv in self._sorted.items() if k != kind):
+            return None
+
+        return self._sorted[kind].range(lower, upper)
+
+
+def _trigrams(value: str) -> set[str]:
+    return {value[i : i + 3] for i in range(len(value) - 2)}
+
+
+# Under re.IGNORECASE (used for #ilike), these ASCII letters also match non-ASCII characters (e.g. "i" matches "İ"
+# and "ı"), which do not case-fold to them.
+_IGNORECASE_SPECIAL_ASCII = frozenset("iksIKS")
+
+
+def _ignorecase_safe_parts(literal: str) -> list[str]:
+    """
+    Splits a literal from an #ilike pattern into parts which, when matched case-insensitively by a regex, are guaranteed
+    to also appear in the case-folded matched text: runs of ASCII characters, excluding a few special letters.
+    """
+
+    parts: list[str] = []
+    current: list[str] = []
+
+    for char in literal:
+        if char.isascii() and char not in _IGNORECASE_SPECIAL_ASCII:
+            current.append(char)
+        else:
+            parts.append("".join(current))
+            current = []
+
+    parts.append("".join(current))
+    return parts
+
+
+def _required_substrings(fn: q.FunctionName, rhs: str) -> list[str]:
+    """
+    Returns substrings which must be contained in the case-folded value of any string for which a text operator with a
+    particular literal RHS is True.
+    """
+
+    if fn in (q.FUNCTION_LIKE, q.FUNCTION_ILIKE):
+        literals, _ = ds.split_like_pattern(rhs)
+        if fn == q.FUNCTION_ILIKE:
+            literals = [part for lit in literals for part in _ignorecase_safe_parts(lit)]
+        return [lit.casefold() for lit in literals]
+
+    # #co: if a string contains another, its case-folded form contains the other's case-folded form, since case-folding
+    # is applied character by character. #ico / #isw / #iew compare case-folded strings directly.
+    return [rhs.casefold()]
+
+
+class TrigramIndex:
+    """
+    An inverted index from trigrams (3-character substrings) of case-folded strings found at a particular resolve path to
+    the IDs of records containing them. Used to find candidate records for substring and pattern operators (#co, #ico,
+    #isw, #iew, #like, #ilike); candidates must still be checked with the actual operator.
+    """
+
+    def __init__(self, path: ResolvePath):
+        self.path: ResolvePath = path
+        self._ids_by_trigram: dict[str, set[RecordID]] = {}
+        self._n_non_strings: int = 0  # Number of records with non-string values, which the index cannot handle
+
+    def _record_trigrams(self, record: ds.QueryableStructure) -> tuple[set[str], bool]:
+        values = list(_path_values(record, self.path))
+        trigrams = set().union(*(_trigrams(v.casefold()) for v in values if isinstance(v, str)))
+        return trigrams, not all(isinstance(v, str) for v in values)
+
+    def add(self, record_id: RecordID, record: ds.QueryableStructure) -> None:
+        trigrams, has_non_strings = self._record_trigrams(record)
+        self._n_non_strings += has_non_strings
+        for t in trigrams:
+            self._ids_by_trigram.setdefault(t, set()).add(record_id)
+
+    def remove(self, record_id: RecordID, record: ds.QueryableStructure) -> None:
+        trigrams, has_non_strings = self._record_trigrams(record)
+        self._n_non_strings -= has_non_strings
+        for t in trigrams:
+            ids = self._ids_by_trigram[t]
+            ids.discard(record_id)
+            if not ids:
+                del self._ids_by_trigram[t]
+
+    def lookup(self, substrings: Iterable[str]) -> set[RecordID] | None:
+        """
+        Finds candidate records whose case-folded values contain all the given (case-folded) substrings.
+        :param substrings: Substrings which must be contained in a value.
+        :return: A set of candidate record IDs, or None if the index cannot restrict candidates, i.e. if there are no
+                 substrings of at least 3 characters, or if some records have non-string values (which the operators
+                 may still handle, e.g. #co on an array.)
+        """
+
+        if self._n_non_strings:
+            return None
+
+        trigrams = set().union(*(_trigrams(s) for s in substrings))
+        if not trigrams:
+            return None
+
+        # Intersect the smallest sets first
+        sets = sorted((self._ids_by_trigram.get(t, set()) for t in trigrams), key=len)
+        return set.intersection(*sets)
+
+
+def _tighter_bound(a: Bound, b: Bound, lower: bool) -> Bound:
+    if a is None:
+        return b
+    if b is None or (a[0] > b[0] if lower else a[0] < b[0]):  # type: ignore
+        return a
+    if a[0] == b[0]:
+        return a[0], a[1] and b[1]
+    return b
+
+
+class IndexedCollection:
+    """
+    An in-memory collection of data structures conforming to a schema, with hash and range indexes over resolve paths
+    for quickly answering queries. Records are identified by integer IDs, assigned in insertion order.
+    """
+
+    def __init__(
+        self,
+        schema: JSONSchema,
+        data_structures: Iterable[ds.QueryableStructure] = (),
+        hash_index_paths: Iterable[ResolvePath] | None = None,
+        range_index_paths: Iterable[ResolvePath] | None = None,
+        text_index_paths: Iterable[ResolvePath] | None = None,
+        secure_errors: bool = True,
+    ):
+        """
+        :param schema: A JSON schema representing valid data objects.
+        :param data_structures: Initial data structures to add to the collection.
+        :param hash_index_paths: Resolve paths to build hash indexes for. By default, all paths which allow #eq or #in
+                                 operations in the schema's search properties are indexed.
+        :param range_index_paths: Resolve paths to build range indexes for. By default, all paths which allow #lt, #le,
+                                  #gt, or #ge operations in the schema's search properties are indexed.
+        :param text_index_paths: Resolve paths to build trigram indexes for. By default, all paths which allow #co, #ico,
+                                 #isw, #iew, #like, or #ilike operations in the schema's search properties are indexed.
+        :param secure_errors: Whether to obscure data structure values in validation error messages.
+        """
+
+        self.schema: JSONSchema = schema
+        self.secure_errors: bool = secure_errors
+
+        if hash_index_paths is None:
+            hash_index_paths = _indexable_paths(schema, HASH_INDEX_OPERATIONS)
+        if range_index_paths is None:
+            range_index_paths = _indexable_paths(schema, RANGE_INDEX_OPERATIONS)
+        if text_index_paths is None:
+            text_index_paths = _indexable_paths(schema, TEXT_INDEX_OPERATIONS)
+
+        self.hash_indexes: dict[ResolvePath, HashIndex] = {tuple(p): HashIndex(tuple(p)) for p in hash_index_paths}
+        self.range_indexes: dict[ResolvePath, RangeIndex] = {tuple(p): RangeIndex(tuple(p)) for p in range_index_paths}
+        self.text_indexes: dict[ResolvePath, TrigramIndex] = {
+            tuple(p): TrigramIndex(tuple(p)) for p in text_index_paths
+        }
+
+        self._records: dict[RecordID, ds.QueryableStructure] = {}
+        self._next_id: RecordID = 0
+
+        for d in data_structures:
+            self.add(d)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def _indexes(self) -> Iterator[_RecordIndex]:
+        return chain(self.hash_indexes.values(), self.range_indexes.values(), self.text_indexes.values())
+
+    def __getitem__(self, record_id: RecordID) -> ds.QueryableStructure:
+        return self._records[record_id]
+
+    def add(self, data_structure: ds.QueryableStructure) -> RecordID:
+        """
+        Validates a data structure against the collection's schema and adds it to the collection and all indexes.
+        Data structures should not be mutated after being added.
+        :param data_structure: The data structure to add.
+        :return: The ID of the new record.
+        """
+
+        ds._validate_data_structure_against_schema(data_structure, self.schema, secure_errors=self.secure_errors)
+
+        record_id = self._next_id
+        self._next_id += 1
+
+        self._records[record_id] = data_structure
+        for index in self._indexes():
+            index.add(record_id, data_structure)
+
+        return record_id
+
+    def remove(self, record_id: RecordID) -> None:
+        """
+        Removes a record from the collection and all indexes.
+        :param record_id: The ID of the record to remove.
+        """
+
+        record = self._records.pop(record_id)
+        for index in self._indexes():
+            index.remove(record_id, record)
+
+    def _leaf_index[I: (HashIndex, RangeIndex, TrigramIndex)](
+        self, indexes: dict[ResolvePath, I], resolve: q.AST
+    ) -> I | None:
+        if resolve.type == "e" and resolve.fn == q.FUNCTION_RESOLVE:
+            return indexes.get(tuple(str(a.value) for a in resolve.args))
+        return None
+
+    def _range_leaf(self, ast: q.AST) -> tuple[RangeIndex, Bounds] | None:
+        """
+        If an expression is a range comparison between an indexed path and a literal, returns the range index and the
+        bounds on the path's value.
+        """
+
+        if ast.type != "e" or ast.fn not in RANGE_FUNCTION_BOUNDS:
+            return None
+
+        fn, (lhs, rhs) = ast.fn, ast.args
+        if lhs.type == "l" and rhs.type == "e":
+            fn, lhs, rhs = RANGE_FUNCTION_FLIPPED[fn], rhs, lhs
+
+        if rhs.type != "l" or (index := self._leaf_index(self.range_indexes, lhs)) is None:
+            return None
+        if isinstance(rhs.value, float) and isnan(rhs.value):
+            return None
+
+        return index, RANGE_FUNCTION_BOUNDS[fn](rhs.value)
+
+    @staticmethod
+    def _range_plan(index: RangeIndex, bounds: Bounds) -> Plan:
+        if (ids := index.lookup(*bounds)) is None:
+            return None, False
+        return ids, "[item]" not in index.path
+
+    def _plan_and(self, args: q.Args) -> Plan:
+        """
+        Plans a (possibly nested) #and expression. Range comparisons on the same indexed path are merged into a single
+        range lookup, e.g. BETWEEN-style (#and (#ge x 5) (#lt x 10)) expressions. For array paths, this requires the
+        same item to satisfy both comparisons, which is what the evaluator does, since they share an index combination.
+        """
+
+        sub_plans: list[Plan] = []
+        ranges: dict[ResolvePath, tuple[RangeIndex, Bounds]] = {}
+
+        for a in (c for arg in args for c in q.ast_to_and_asts(arg)):
+            if (range_leaf := self._range_leaf(a)) is not None:
+                index, (lower, upper) = range_leaf
+                if index.path not in ranges:
+                    ranges[index.path] = range_leaf
+                    continue
+
+                # Only merge bounds which are comparable with each other
+                (_, (cur_lower, cur_upper)) = ranges[index.path]
+                kinds = {_value_kind(b[0]) for b in (lower, upper, cur_lower, cur_upper) if b is not None}
+                if len(kinds) == 1:
+                    ranges[index.path] = (
+                        index,
+                        (_tighter_bound(cur_lower, lower, True), _tighter_bound(cur_upper, upper, False)),
+                    )
+                    continue
+
+            sub_plans.append(self._plan(a))
+
+        sub_plans.extend(self._range_plan(index, bounds) for index, bounds in ranges.values())
+
+        # Records must be candidates for all arguments; unrestricted arguments are checked later.
+        sets = [c for c, _ in sub_plans if c is not None]
+        exact = all(e for _, e in sub_plans) and len(sets) == len(sub_plans)
+        return (set.intersection(*sets) if sets else None), exact
+
+    def _plan(self, ast: q.AST) -> Plan:
+        """
+        Computes a set of candidate records for a query expression using the collection's indexes. Candidates always
+        include every record for which the expression is True for some index combination.
+        :param ast: The query expression to plan.
+        :return: A tuple of the candidate set and whether it is exact, i.e. contains only matching records. Results
+                 involving array paths are never exact, since the correlation of items across expressions is lost.
+        """
+
+        if ast.type == "l":
+            return None, False
+
+        if ast.fn == q.FUNCTION_AND:
+            return self._plan_and(ast.args)
+
+        if ast.fn == q.FUNCTION_OR:
+            sub_plans = [self._plan(a) for a in ast.args]
+            sets = [c for c, _ in sub_plans if c is not None]
+
+            # Records may match via any argument, so a single unrestricted argument makes the whole #or unrestricted.
+            if len(sets) < len(sub_plans):
+                return None, False
+            return set.union(*sets), all(e for _, e in sub_plans)
+
+        if (range_leaf := self._range_leaf(ast)) is not None:
+            return self._range_plan(*range_leaf)
+
+        if ast.fn in TRIGRAM_FUNCTIONS:
+            lhs, rhs = ast.args
+            if (
+                rhs.type == "l"
+                and isinstance(rhs.value, str)
+                and (text_index := self._leaf_index(self.text_indexes, lhs)) is not None
+            ):
+                # Trigram matches only give candidates, which need to be checked with the actual operator
+                return text_index.lookup(_required_substrings(ast.fn, rhs.value)), False
+
+        if ast.fn == q.FUNCTION_EQ:
+            lhs, rhs = ast.args
+            if rhs.type == "e" and lhs.type == "l":
+                lhs, rhs = rhs, lhs
+            if rhs.type == "l" and (index := self._leaf_index(self.hash_indexes, lhs)) is not None:
+                return set(index.lookup(rhs.value)), "[item]" not in index.path
+
+        if ast.fn == q.FUNCTION_IN:
+            lhs, rhs = ast.args
+            if rhs.type == "e" and rhs.fn == q.FUNCTION_LIST and (index := self._leaf_index(self.hash_indexes, lhs)):
+                return set().union(*(index.lookup(a.value) for a in rhs.args)), "[item]" not in index.path
+
+        return None, False
+
+    def estimate_selectivity(self, ast: q.AST) -> float | None:
+        """
+        Estimates the fraction of records in the collection matching a query expression, from the number of candidates
+        given by the collection's indexes. Can be used as a selectivity estimator for optimizer.optimize_query(...).
+        :param ast: The query expression to estimate.
+        :return: An estimated (upper bound) fraction of matching records, or None if the indexes cannot restrict it.
+        """
+
+        candidates, _ = self._plan(q.flatten_boolean_expressions(ast))
+        if candidates is None or not self._records:
+            return None
+        return len(candidates) / len(self._records)
+
+    def search(self, ast: q.AST, internal: bool = False) -> list[RecordID]:
+        """
+        Finds all records in the collection matching a query. Equivalent to calling check_ast_against_data_structure(...)
+        on each record, except that records missing a value at an indexed path never match leaves answered by the index.
+        :param ast: A query to evaluate.
+        :param internal: Whether internal-only fields are allowed to be resolved.
+        :return: A sorted list of the IDs of matching records.
+        """
+
+        # Validate and permission-check the query, even if it ends up being answered purely from indexes
+        compiled = ds.compile_query(ast, self.schema, internal)
+
+        candidates, exact = self._plan(compiled.ast)  # Planned using the flattened query
+
+        if candidates is not None and exact:
+            return sorted(candidates)
+
+        record_ids: Iterable[RecordID] = self._records.keys() if candidates is None else candidates
+
+        # Records were validated when added, so we can skip re-validating them for every query.
+        return sorted(i for i in record_ids if compiled.check(self._records[i], skip_schema_validation=True))
@@ -0,0 +1,150 @@
+import json
+from collections.abc import Callable, Iterable, Iterator
+from typing import Any
+
+from . import data_structure as ds
+from . import queries as q
+from ._types import JSONSchema
+from ._validation import ANNOTATION_KEYWORDS
+
+__all__ = [
+    "filter_ndjson_lines",
+]
+
+# Streaming evaluation of queries against NDJSON (newline-delimited JSON) exports of a dataset.
+#  Lines are parsed one at a time, so memory use is bounded by the largest record rather than the whole file. Each parsed
+#  record is then projected down to just the keys reachable from the query's #resolve paths, and only this projection
+#  is validated against a correspondingly projected schema and evaluated, so large unrelated parts of records are never
+#  validated or traversed.
+
+# Projection tree: for each object key (or "[item]" for array items) reachable by a resolve path, either a sub-tree or
+# None, meaning the whole value is needed.
+type ProjectionTree = dict[str, "ProjectionTree | None"]
+type Projector = Callable[[Any], Any]
+
+# Schema keywords for which dropping object properties / projecting array items doesn't change the validity of data.
+OBJECT_PROJECTION_KEYWORDS = frozenset({*ANNOTATION_KEYWORDS, "type", "properties", "required", "additionalProperties"})
+ARRAY_PROJECTION_KEYWORDS = frozenset({*ANNOTATION_KEYWORDS, "type", "items", "minItems", "maxItems"})
+
+
+def _projection_tree(resolves: Iterable[tuple[q.Literal, ...]]) -> ProjectionTree | None:
+    """
+    Builds a projection tree from the resolve paths of a query.
+    :param resolves: The resolve paths used by the query.
+    :return: A projection tree, or None if the whole data structure is needed.
+    """
+
+    tree: ProjectionTree = {}
+
+    for resolve in resolves:
+        if not resolve:  # Resolving the root data structure
+            return None
+
+        node = tree
+        for i, r in enumerate(resolve):
+            key = str(r.value)
+            if i == len(resolve) - 1:
+                node[key] = None
+                break
+            if key in node and node[key] is None:
+                break  # Already need the whole value
+            node = node.setdefault(key, {})  # type: ignore
+
+    return tree
+
+
+def _compile_projection(schema: JSONSchema, tree: ProjectionTree | None) -> tuple[JSONSchema, Projector | None]:
+    """
+    Projects a schema down to the paths in a projection tree, and compiles a corresponding projector function for data.
+    Schema nodes using keywords where removing parts of the data could change its validity are not projected.
+    :param schema: The (sub-)schema to project.
+    :param tree: The projection (sub-)tree to apply.
+    :return: A tuple of the projected schema and a projector function, or None if values should be kept as-is.
+    """
+
+    if tree is None:
+        return schema, None
+
+    schema_type = schema.get("type")
+
+    if schema_type == "object" and schema.keys() <= OBJECT_PROJECTION_KEYWORDS:
+        properties = schema.get("properties", {})
+        projections = {k: _compile_projection(properties[k], child) for k, child in tree.items() if k in properties}
+        projectors = tuple((k, p) for k, (_, p) in projections.items())
+
+        projected_schema = {**schema, "properties": {k: s for k, (s, _) in projections.items()}}
+        if "required" in schema:
+            projected_schema["required"] = [k for k in schema["required"] if k in projections]
+
+        def project_object(v: Any) -> Any:
+            if not isinstance(v, dict):
+                return v  # Leave as-is for validation to catch
+            res = {}
+            for k, p in projectors:
+                if k in v:
+                    res[k] = v[k] if p is None else p(v[k])
+            return res
+
+        return projected_schema, project_object
+
+    if schema_type == "array" and schema.keys() <= ARRAY_PROJECTION_KEYWORDS and isinstance(schema.get("items"), dict):
+        item_schema, item_projector = _compile_projection(schema["items"], tree.get("[item]"))
+        if item_projector is None:
+            return schema, None
+
+        def project_array(v: Any) -> Any:
+            return [item_projector(x) for x in v] if isinstance(v, list) else v
+
+        return {**schema, "items": item_schema}, project_array
+
+    return schema, None
+
+
+def filter_ndjson_lines(
+    ast: q.AST,
+    lines: Iterable[bytes | str],
+    schema: JSONSchema,
+    internal: bool = False,
+    limit: int | None = None,
+    secure_errors: bool = True,
+    skip_schema_validation: bool = False,
+) -> Iterator[bytes | str]:
+    """
+    Lazily filters lines of an NDJSON file (one JSON data structure per line) by a query. Equivalent to calling
+    check_ast_against_data_structure(...) on each parsed line, except that only the parts of each data structure which
+    the query can resolve are validated against the schema. Blank lines are skipped.
+    :param ast: A query to evaluate against each data structure.
+    :param lines: An iterable of NDJSON lines, e.g. an open file.
+    :param schema: A JSON schema representing valid data objects.
+    :param internal: Whether internal-only fields are allowed to be resolved.
+    :param limit: If specified, the maximum number of matching lines to yield; no more lines are read after this.
+    :param secure_errors: Whether to obscure data structure values in validation error messages.
+    :param skip_schema_validation: Whether to skip validating data structures against the (projected) schema.
+    :return: A generator of the (unmodified) lines whose data structures match the query.
+    """
+
+    # Validate, permission-check, and compile the query once up front
+    compiled = ds.compile_query(ast, schema, internal)
+    projected_schema, projector = _compile_projection(schema, _projection_tree(compiled.resolves))
+
+    if limit is not None and limit <= 0:
+        return
+
+    n_matches = 0
+
+    for line in lines:
+        if not line.strip():
+            continue
+
+        data_structure = json.loads(line)
+        if projector is not None:
+            data_structure = projector(data_structure)
+
+        if not skip_schema_validation:
+            ds._validate_data_structure_against_schema(data_structure, projected_schema, secure_errors=secure_errors)
+
+        if compiled.check(data_structure, secure_errors=secure_errors, skip_schema_validation=True):
+            yield line
+            n_matches += 1
+            if limit is not None and n_matches >= limit:
+                return
@@ -0,0 +1,188 @@
+from collections.abc import Callable, Iterable
+from math import inf, prod
+
+from . import data_structure as ds
+from . import queries as q
+from ._types import JSONSchema
+
+__all__ = [
+    "SelectivityEstimator",
+    "estimate_cost_and_selectivity",
+    "sample_selectivity_estimator",
+    "optimize_query",
+]
+
+# Cost-based reordering of #and / #or terms.
+#  Both the data structure evaluator and Postgres short-circuit boolean operators, evaluating terms in order. For an
+#  #and, it is best to first evaluate terms which are cheap and likely to be False; for an #or, terms which are cheap and
+#  likely to be True. Terms are ranked by their estimated cost and selectivity (the fraction of records/index
+#  combinations for which they are True) and put in the optimal order.
+#
+#  Reordering only changes the result of a query if it contains type-invalid sub-expressions: like with short-circuiting
+#  in general, whether such a sub-expression is reached (and raises a TypeError) may depend on the order of terms.
+
+# A function returning the estimated selectivity of a predicate (an expression which is not #and / #or / #not), or None
+# to use the default estimate.
+type SelectivityEstimator = Callable[[q.AST], float | None]
+
+# Relative cost of evaluating each function, not including the cost of its arguments.
+FUNCTION_COSTS: dict[q.FunctionName, float] = {
+    q.FUNCTION_AND: 0,
+    q.FUNCTION_OR: 0,
+    q.FUNCTION_NOT: 0,
+    q.FUNCTION_LT: 1,
+    q.FUNCTION_LE: 1,
+    q.FUNCTION_EQ: 1,
+    q.FUNCTION_GT: 1,
+    q.FUNCTION_GE: 1,
+    q.FUNCTION_IN: 1,
+    q.FUNCTION_CO: 2,
+    q.FUNCTION_ICO: 4,  # Case-folds both sides
+    q.FUNCTION_ISW: 3,
+    q.FUNCTION_IEW: 3,
+    q.FUNCTION_LIKE: 4,
+    q.FUNCTION_ILIKE: 6,
+    q.FUNCTION_RESOLVE: 1,
+    q.FUNCTION_LIST: 0,
+    q.FUNCTION_HELPER_WC: 1,
+}
+RESOLVE_SEGMENT_COST = 0.5
+# Resolving through an array is more expensive, and expressions which depend on arrays are evaluated for each index
+# combination, whereas array-invariant expressions are memoized.
+RESOLVE_ARRAY_COST = 4
+
+# Default selectivity of predicates when no estimate is available.
+DEFAULT_SELECTIVITY = 0.5
+FUNCTION_SELECTIVITIES: dict[q.FunctionName, float] = {
+    q.FUNCTION_LT: 1 / 3,
+    q.FUNCTION_LE: 1 / 3,
+    q.FUNCTION_EQ: 0.1,
+    q.FUNCTION_GT: 1 / 3,
+    q.FUNCTION_GE: 1 / 3,
+    q.FUNCTION_IN: 0.2,
+    q.FUNCTION_CO: 0.2,
+    q.FUNCTION_ICO: 0.25,
+    q.FUNCTION_ISW: 0.2,
+    q.FUNCTION_IEW: 0.2,
+    q.FUNCTION_LIKE: 0.2,
+    q.FUNCTION_ILIKE: 0.25,
+}
+
+
+def _short_circuit_cost(fn: q.FunctionName, estimates: Iterable[tuple[float, float]]) -> float:
+    # Each term is only evaluated if all previous terms were True (#and) / False (#or)
+    cost: float = 0
+    p_reached: float = 1
+    for c, s in estimates:
+        cost += p_reached * c
+        p_reached *= s if fn == q.FUNCTION_AND else 1 - s
+    return cost
+
+
+def _estimate(ast: q.AST, selectivity: SelectivityEstimator | None) -> tuple[float, float]:
+    if ast.type == "l":
+        if isinstance(ast.value, bool):
+            return 0, 1.0 if ast.value else 0.0
+        return 0, DEFAULT_SELECTIVITY
+
+    if ast.fn == q.FUNCTION_RESOLVE:
+        cost = FUNCTION_COSTS[q.FUNCTION_RESOLVE] + sum(
+            RESOLVE_ARRAY_COST if a.value == "[item]" else RESOLVE_SEGMENT_COST for a in ast.args
+        )
+        return cost, DEFAULT_SELECTIVITY
+
+    if ast.fn == q.FUNCTION_NOT:
+        c, s = _estimate(ast.args[0], selectivity)
+        return c, 1 - s
+
+    if ast.fn in (q.FUNCTION_AND, q.FUNCTION_OR):
+        estimates = [_estimate(t, selectivity) for t in ast.args]
+        if ast.fn == q.FUNCTION_AND:
+            s = prod(s for _, s in estimates)
+        else:
+            s = 1 - prod(1 - s for _, s in estimates)
+        return _short_circuit_cost(ast.fn, estimates), s
+
+    cost = FUNCTION_COSTS.get(ast.fn, 1) + sum(_estimate(a, None)[0] for a in ast.args)
+
+    estimated = selectivity(ast) if selectivity is not None else None
+    leaf_s = FUNCTION_SELECTIVITIES.get(ast.fn, DEFAULT_SELECTIVITY) if estimated is None else estimated
+
+    return cost, min(max(leaf_s, 0.0), 1.0)
+
+
+def estimate_cost_and_selectivity(ast: q.AST, selectivity: SelectivityEstimator | None = None) -> tuple[float, float]:
+    """
+    Estimates the relative cost of evaluating an expression, and its selectivity (the fraction of the time it is True.)
+    :param ast: The expression to estimate.
+    :param selectivity: An optional function providing selectivity estimates for predicates.
+    :return: A tuple of (cost, selectivity).
+    """
+    return _estimate(q.flatten_boolean_expressions(ast), selectivity)
+
+
+def sample_selectivity_estimator(
+    sample: Iterable[ds.QueryableStructure], schema: JSONSchema, internal: bool = False
+) -> SelectivityEstimator:
+    """
+    Creates a selectivity estimator which evaluates predicates against a sample of data structures. Estimates are
+    cached per predicate.
+    :param sample: The sample of data structures, which are assumed to be valid against the schema.
+    :param schema: The JSON schema of the data structures.
+    :param internal: Whether internal-only fields are allowed to be resolved.
+    :return: A selectivity estimator.
+    """
+
+    sample_tuple = tuple(sample)
+    estimates: dict[q.AST, float | None] = {}
+
+    def estimate(ast: q.AST) -> float | None:
+        if not sample_tuple:
+            return None
+
+        if ast not in estimates:
+            try:
+                compiled = ds.compile_query(ast, schema, internal)
+                n_matches = sum(1 for d in sample_tuple if compiled.check(d, skip_schema_validation=True))
+                estimates[ast] = n_matches / len(sample_tuple)
+            except (TypeError, ValueError):  # Type-invalid or forbidden predicates: leave to the actual query
+                estimates[ast] = None
+
+        return estimates[ast]
+
+    return estimate
+
+
+def _rank(fn: q.FunctionName, estimate: tuple[float, float]) -> float:
+    c, s = estimate
+    # #and: cheap terms which are likely to be False first; #or: cheap terms which are likely to be True first
+    p_short_circuit = 1 - s if fn == q.FUNCTION_AND else s
+    return c / p_short_circuit if p_short_circuit > 0 else inf
+
+
+def _optimize(ast: q.AST, selectivity: SelectivityEstimator | None) -> q.AST:
+    if ast.type == "l" or ast.fn == q.FUNCTION_RESOLVE:
+        return ast
+
+    args = tuple(_optimize(a, selectivity) for a in ast.args)
+
+    if ast.fn not in (q.FUNCTION_AND, q.FUNCTION_OR) or not ds._is_boolean_expression(ast):
+        return q.Expression(ast.fn, args)
+
+    ranks = [_rank(ast.fn, _estimate(a, selectivity)) for a in args]
+
+    # Sorting is stable, so terms with the same rank stay in query order.
+    return q.Expression(ast.fn, tuple(a for _, a in sorted(zip(ranks, args), key=lambda ra: ra[0])))
+
+
+def optimize_query(ast: q.AST, selectivity: SelectivityEstimator | None = None) -> q.AST:
+    """
+    Reorders the terms of (possibly nested) #and / #or expressions in a query so that the cheapest and most selective
+    terms are evaluated first. Only expressions whose terms all evaluate to booleans are reordered. The optimized query
+    can be used with any search backend.
+    :param ast: The query to optimize.
+    :param selectivity: An optional function providing selectivity estimates for predicates, e.g. from
+                        sample_selectivity_estimator(...) or IndexedCollection.estimate_selectivity.
+    :return: An equivalent query, with (flattened) #and / #or terms reordered.
+    """
+    return _optimize(q.flatten_boolean_expressions(ast), selectivity)
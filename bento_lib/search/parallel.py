@@ -0,0 +1,133 @@
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import batched, chain
+from multiprocessing.context import BaseContext
+from typing import Self
+
+from . import data_structure as ds
+from . import queries as q
+from ._types import JSONSchema
+
+__all__ = [
+    "DEFAULT_CHUNK_SIZE",
+    "ParallelSearchExecutor",
+]
+
+# Process-parallel evaluation of queries against many data structures.
+#  Query evaluation in Python is CPU-bound and holds the GIL, so threads don't help. Instead, the query AST and schema
+#  are sent to each worker process once (in the pool initializer), where the query is compiled and kept for the
+#  lifetime of the worker; afterwards, only chunks of data structures and their results cross process boundaries.
+
+DEFAULT_CHUNK_SIZE = 256
+
+_worker_query: ds.CompiledQuery | None = None
+
+
+def _init_worker(ast: q.AST, schema: JSONSchema, internal: bool) -> None:
+    global _worker_query
+    _worker_query = ds.compile_query(ast, schema, internal)
+
+
+def _check_chunk(
+    chunk: tuple[ds.QueryableStructure, ...], secure_errors: bool, skip_schema_validation: bool
+) -> list[bool]:
+    return [
+        _worker_query.check(d, secure_errors=secure_errors, skip_schema_validation=skip_schema_validation)  # type: ignore
+        for d in chunk
+    ]
+
+
+def _index_combinations_chunk(
+    chunk: tuple[ds.QueryableStructure, ...], secure_errors: bool, skip_schema_validation: bool
+) -> list[list[ds.IndexCombination]]:
+    return [
+        list(
+            _worker_query.check(  # type: ignore
+                d,
+                return_all_index_combinations=True,
+                secure_errors=secure_errors,
+                skip_schema_validation=skip_schema_validation,
+            )
+        )
+        for d in chunk
+    ]
+
+
+class ParallelSearchExecutor:
+    """
+    Evaluates a query against many data structures using a pool of worker processes. Results are identical to, and in
+    the same order as, calling check_ast_against_data_structure(...) on each data structure in turn. Should be used as a
+    context manager, or shut down via shutdown() when no longer needed.
+    """
+
+    def __init__(
+        self,
+        ast: q.AST,
+        schema: JSONSchema,
+        internal: bool = False,
+        max_workers: int | None = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        secure_errors: bool = True,
+        skip_schema_validation: bool = False,
+        mp_context: BaseContext | None = None,
+    ):
+        """
+        :param ast: A query to evaluate against data structures.
+        :param schema: A JSON schema representing valid data objects.
+        :param internal: Whether internal-only fields are allowed to be resolved.
+        :param max_workers: The number of worker processes to use. Defaults to the number of available CPUs.
+        :param chunk_size: The number of data structures sent to a worker process at a time.
+        :param secure_errors: Whether to obscure data structure values in validation error messages.
+        :param skip_schema_validation: Whether to skip validating data structures against the schema.
+        :param mp_context: The multiprocessing context used to start worker processes.
+        """
+
+        if chunk_size < 1:
+            raise ValueError(f"Invalid chunk size: {chunk_size}")
+
+        # Compile locally first, so invalid queries raise here rather than in every worker process. The compiled query's
+        # flattened AST is sent to workers, since pickling very deeply nested ASTs can exceed the recursion limit.
+        ast = ds.compile_query(ast, schema, internal).ast
+
+        self.chunk_size: int = chunk_size
+        self.secure_errors: bool = secure_errors
+        self.skip_schema_validation: bool = skip_schema_validation
+
+        self._pool = ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=mp_context, initializer=_init_worker, initargs=(ast, schema, internal)
+        )
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_args) -> None:
+        self.shutdown()
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+    def _map_chunks(self, fn, data_structures: Iterable[ds.QueryableStructure]) -> list:
+        chunk_fn = partial(fn, secure_errors=self.secure_errors, skip_schema_validation=self.skip_schema_validation)
+        # Executor.map preserves input order, so per-chunk results can simply be concatenated.
+        return list(chain.from_iterable(self._pool.map(chunk_fn, batched(data_structures, self.chunk_size))))
+
+    def check(
+        self, data_structures: Iterable[ds.QueryableStructure], return_indices: bool = False
+    ) -> list[bool] | list[int]:
+        """
+        Checks the query against each data structure.
+        :param data_structures: The data structures to check.
+        :param return_indices: Whether to return the indices of matching data structures rather than a list of booleans.
+        :return: Either a list of booleans, one per data structure, or a list of matching indices.
+        """
+        results: list[bool] = self._map_chunks(_check_chunk, data_structures)
+        return [i for i, r in enumerate(results) if r] if return_indices else results
+
+    def index_combinations(self, data_structures: Iterable[ds.QueryableStructure]) -> list[list[ds.IndexCombination]]:
+        """
+        Finds all matching index combinations of the query for each data structure.
+        :param data_structures: The data structures to check.
+        :return: A list of lists of matching index combinations, one list per data structure.
+        """
+        return self._map_chunks(_index_combinations_chunk, data_structures)
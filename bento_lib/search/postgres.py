@@ -1,22 +1,50 @@
 import functools
+import hashlib
 import re
-from collections.abc import Callable
-from typing import Literal
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Container, Hashable, Iterable, Sequence
+from typing import Any, Literal, cast
 
 from psycopg2 import sql
 
+from . import operations as op
 from . import queries as q
 from ._types import JSONSchema
+from .search_schema import SchemaPath, SearchSchemaPath, get_compiled_search_schema
 
 # Search Rules:
 #  - If an object or query doesn't match the schema, it's an error.
 #  - If an optional property isn't present, it's "False".
 
 
-__all__ = ["search_query_to_psycopg2_sql"]
+__all__ = [
+    "search_ast_to_psycopg2_sql",
+    "search_query_to_psycopg2_sql",
+    "SearchAggregate",
+    "SearchPage",
+    "get_primary_key",
+    "InComposable",
+    "render_asyncpg_sql",
+    "search_ast_to_asyncpg_sql",
+    "search_query_to_asyncpg_sql",
+    "DEFAULT_LARGE_LIST_SIZE",
+    "render_psycopg3_sql",
+    "search_ast_to_psycopg3_sql",
+    "search_query_to_psycopg3_sql",
+    "DEFAULT_SQL_TEMPLATE_CACHE_SIZE",
+    "SQLTemplateCache",
+    "sql_template_cache",
+    "PostgresIndex",
+    "recommend_postgres_indexes",
+    "postgres_index_ddl",
+]
 
 
 type SQLComposableWithParams = tuple[sql.Composable, tuple]
+type SQLTextWithParams = tuple[str, list]
+type SQLParamsDict = dict[str, Any]
+type SQLTextWithNamedParams = tuple[str, SQLParamsDict]
 
 QUERY_ROOT = q.Literal("$root")
 SQL_ROOT = sql.Identifier("_root")
@@ -271,27 +299,49 @@ def collect_resolve_join_tables(
     )
 
 
+def _derived_memo(schema: JSONSchema, name: str) -> dict:
+    return get_compiled_search_schema(schema).derived.setdefault(name, {})
+
+
+def resolve_join_tables(resolve: tuple[q.Literal, ...], schema: JSONSchema) -> tuple[JoinAndSelectData, ...]:
+    """
+    Memoized version of collect_resolve_join_tables(...) for a #resolve path starting from the root. Join data for a
+    path only depends on the schema, so it is computed once per schema and path, no matter how many times (or in how
+    many queries) the path is resolved. Errors are not memoized.
+    :param resolve: The arguments of a #resolve expression.
+    :param schema: The search schema.
+    :return: Tuple of tables with joining properties.
+    """
+    memo = _derived_memo(schema, "postgres_join_tables")
+    if (res := memo.get(resolve)) is None:
+        res = memo[resolve] = collect_resolve_join_tables((QUERY_ROOT, *resolve), schema)
+    return res
+
+
 def collect_join_tables(ast: q.AST, terms: tuple, schema: JSONSchema) -> tuple[JoinAndSelectData, ...]:
-    if isinstance(ast, q.Literal):
-        return terms
+    terms_list = list(terms)
+    existing_aliases = {t.current_alias_str for t in terms_list if t is not None}
 
-    if ast.fn == q.FUNCTION_RESOLVE:
-        terms_list = list(terms)
-        collected_joins = collect_resolve_join_tables((QUERY_ROOT, *ast.args), schema)
+    # Visit resolves in pre-order with an explicit stack, keeping the set of existing aliases up to date as joins are
+    # added rather than re-computing it for each join.
+    stack: list[q.AST] = [ast]
 
-        for j in collected_joins:
-            existing_aliases = {t.current_alias_str for t in terms_list if t is not None}
-            if j.current_alias_str is not None and j.current_alias_str not in existing_aliases:
-                terms_list.append(j)
+    while stack:
+        e = stack.pop()
 
-        return tuple(terms_list)
+        if isinstance(e, q.Literal):
+            continue
 
-    new_terms = terms
+        if e.fn == q.FUNCTION_RESOLVE:
+            for j in resolve_join_tables(e.args, schema):
+                if j.current_alias_str is not None and j.current_alias_str not in existing_aliases:
+                    terms_list.append(j)
+                    existing_aliases.add(j.current_alias_str)
+            continue
 
-    for item in (a for a in ast.args if isinstance(a, q.Expression)):
-        new_terms = collect_join_tables(item, new_terms, schema)
+        stack.extend(a for a in reversed(e.args) if isinstance(a, q.Expression))
 
-    return new_terms
+    return tuple(terms_list)
 
 
 def join_fragment(ast: q.AST, schema: JSONSchema) -> sql.Composable:
@@ -304,7 +354,10 @@ def join_fragment(ast: q.AST, schema: JSONSchema) -> sql.Composable:
     :return: The SQL fragment with all the aliased joins.
     """
 
-    terms = collect_join_tables(ast, (), schema)
+    return _join_fragment(collect_join_tables(ast, (), schema), schema)
+
+
+def _join_fragment(terms: tuple[JoinAndSelectData, ...], schema: JSONSchema) -> sql.Composable:
     if not terms:  # Query was probably just a literal
         # TODO: Don't hard-code _root?
         search_database_properties = _get_search_and_database_properties(schema)[1]
@@ -357,36 +410,586 @@ def join_fragment(ast: q.AST, schema: JSONSchema) -> sql.Composable:
     )
 
 
+# EXISTS subqueries
+#  Joining every array relation (unnest(...), json(b)_array_elements(...), or a one-to-many relation) into the query's
+#  FROM clause multiplies rows: a query over two arrays returns one row per pair of matching items, and therefore
+#  duplicate root rows. Instead, each resolve path can be split at its first array: joins before the array (the root,
+#  and many-to-one relations) stay in the outer query, and the rest are moved into a correlated EXISTS subquery.
+#  Independent components of #and / #or expressions (those not sharing a top-level array) get their own subqueries, and
+#  all other expressions accessing arrays get a single subquery covering the arrays they access. Each root row is
+#  returned at most once, and matches exactly when it would with joins, i.e. if ANY row of its joined relations does:
+#   - Relations are left-joined, so a root row without related rows still has a (NULL) row to match. Subqueries only
+#     inner-join a relation if the expression is never true for its NULL rows (i.e., is null-rejecting for it), which
+#     lets Postgres plan them as semi-joins.
+#   - Array functions are cross-joined, so a root row with an empty array has no rows to match at all, even for terms
+#     not accessing the array. When a query is split into components, root rows must therefore also have items in any
+#     such arrays which aren't accessed by a subquery that must match anyway.
+
+
+def _resolve_exists_split(
+    resolve: tuple[q.Literal, ...], schema: JSONSchema
+) -> tuple[tuple[JoinAndSelectData, ...], tuple[JoinAndSelectData, ...], tuple[q.Literal, ...] | None, bool]:
+    """
+    Splits the join tables for a #resolve path at the path's first array.
+    :param resolve: The arguments of a #resolve expression.
+    :param schema: The search schema.
+    :return: A tuple of (join tables before the first array, join tables from the first array onwards, the path of the
+             first array - or None if the path doesn't access an array, and whether the join tables from the first array
+             onwards may have no rows, i.e. whether they include an array function rather than only relations.)
+    """
+    memo = _derived_memo(schema, "postgres_exists_split")
+    if (res := memo.get(resolve)) is None:
+        terms = resolve_join_tables(resolve, schema)
+        compiled_schema = get_compiled_search_schema(schema)
+        # terms[i] is the join data for the path resolve[:i]; terms[0] is the root, which is never an array.
+        arrays = [
+            i
+            for i in range(1, len(terms))
+            if compiled_schema.get(resolve[:i]).schema["type"] == "array"  # type: ignore
+        ]
+        res = (terms, (), None, False)
+        if arrays:
+            i = arrays[0]
+            res = (terms[:i], terms[i:], resolve[:i], any(terms[j].key_link is None for j in arrays))
+        memo[resolve] = res
+    return res
+
+
+def _collect_resolves(ast: q.AST) -> list[tuple[q.Literal, ...]]:
+    resolves: list[tuple[q.Literal, ...]] = []
+    stack: list[q.AST] = [ast]
+
+    while stack:
+        e = stack.pop()
+        if isinstance(e, q.Literal):
+            continue
+        if e.fn == q.FUNCTION_RESOLVE:
+            # Resolve arguments are always literals; see q.convert_query_to_ast
+            resolves.append(cast(tuple[q.Literal, ...], e.args))
+            continue
+        stack.extend(reversed(e.args))
+
+    return resolves
+
+
+type _ExistsNodeData = tuple[tuple[tuple[q.Literal, ...], ...], frozenset[str], frozenset[str]]
+
+
+class _ExistsContext:
+    """
+    Data for compiling the sub-expressions of an AST with EXISTS subqueries. For each sub-expression, this is:
+     - the first arrays it accesses, which it must share an EXISTS subquery with other expressions for;
+     - the aliases of (left-joined) relations for whose NULL rows it is always NULL, i.e. it is strict for;
+     - the aliases of relations for whose NULL rows it is never true, i.e. it is null-rejecting for.
+    These are computed once, bottom-up and with an explicit stack, since asking for each sub-expression's data
+    separately would walk deeply nested expressions once per level.
+    """
+
+    def __init__(self, ast: q.AST, schema: JSONSchema):
+        self._schema = schema
+        self._data: dict[int, _ExistsNodeData] = {}
+        self._components: list[q.AST] = []  # Keeps created components alive, so their IDs aren't re-used
+        self._group_resolves: dict[tuple[q.Literal, ...], list[tuple[q.Literal, ...]]] = {}
+        self._analyze(ast)
+
+    def _analyze(self, ast: q.AST) -> None:
+        data = self._data
+        stack: list[tuple[q.AST, bool]] = [(ast, False)]
+
+        while stack:
+            e, visited = stack.pop()
+            if id(e) in data:
+                continue
+            if isinstance(e, q.Literal):
+                data[id(e)] = ((), frozenset(), frozenset())
+            elif e.fn == q.FUNCTION_RESOLVE:
+                resolve = cast(tuple[q.Literal, ...], e.args)
+                before, after, a, _ = _resolve_exists_split(resolve, self._schema)
+                if a is not None:
+                    self._group_resolves.setdefault(a, []).append(resolve)
+                # Resolved values are NULL for NULL rows of any left-joined relation on their path
+                aliases = frozenset(
+                    t.current_alias_str for t in (*before, *after) if t.key_link is not None and t.current_alias_str
+                )
+                data[id(e)] = (() if a is None else (a,), aliases, aliases)
+            elif visited:
+                data[id(e)] = self._combine(e.fn, e.args)
+            else:
+                stack.append((e, True))
+                stack.extend((a, False) for a in e.args)
+
+    def _combine(self, fn: q.FunctionName, args: Sequence[q.AST]) -> _ExistsNodeData:
+        arg_data = [self._data[id(a)] for a in args]
+        groups = tuple(dict.fromkeys(g for d in arg_data for g in d[0]))
+
+        if fn == q.FUNCTION_NOT:
+            return groups, arg_data[0][1], arg_data[0][1]
+
+        if fn in (q.FUNCTION_AND, q.FUNCTION_OR):
+            # (NULL AND FALSE) is FALSE and (NULL OR TRUE) is TRUE, so #and / #or are only strict for relations all their
+            # arguments are strict for. #and is never true if any argument isn't, and #or only if no argument is.
+            strict = frozenset.intersection(*(d[1] for d in arg_data))
+            combine = frozenset.union if fn == q.FUNCTION_AND else frozenset.intersection
+            return groups, strict, combine(*(d[2] for d in arg_data))
+
+        # Other functions (comparisons, lists, ...) are NULL if any of their arguments are
+        strict = frozenset().union(*(d[1] for d in arg_data))
+        return groups, strict, strict
+
+    def array_groups(self, ast: q.AST) -> tuple[tuple[q.Literal, ...], ...]:
+        return self._data[id(ast)][0]
+
+    def null_rejecting(self, ast: q.AST) -> frozenset[str]:
+        return self._data[id(ast)][2]
+
+    def components(self, ast: q.AST) -> list[q.AST]:
+        # The independent components of an #and / #or expression, or an empty list if it cannot be split.
+        if not isinstance(ast, q.Expression) or ast.fn not in (q.FUNCTION_AND, q.FUNCTION_OR):
+            return []
+
+        components = q.independent_components([self.array_groups(a) for a in ast.args])
+        if len(components) == 1:
+            return []
+
+        res: list[q.AST] = []
+        for c in components:
+            if len(c) == 1:
+                res.append(ast.args[c[0]])
+                continue
+            component = q.Expression(ast.fn, [ast.args[i] for i in c])
+            self._data[id(component)] = self._combine(ast.fn, component.args)
+            self._components.append(component)
+            res.append(component)
+        return res
+
+    def unchecked_empty_arrays(self, ast: q.AST) -> list[tuple[JoinAndSelectData, ...]]:
+        """
+        Returns the join tables (from the first array onwards) of arrays which may be empty, and which root rows must
+        have items in to match the expression, but which aren't accessed by a subquery which must match anyway: either
+        a subquery for the whole expression, or for a component of a top-level #and expression.
+        """
+        if not (components := self.components(ast)):
+            return []
+        required = (
+            {g for c in components if not self.components(c) for g in self.array_groups(c)}
+            if ast.fn == q.FUNCTION_AND
+            else set()
+        )
+        return [
+            _unique_terms(_resolve_exists_split(r, self._schema)[1] for r in resolves)
+            for g, resolves in self._group_resolves.items()
+            if g not in required and any(_resolve_exists_split(r, self._schema)[3] for r in resolves)
+        ]
+
+
+def _unique_terms(term_groups: Iterable[tuple[JoinAndSelectData, ...]]) -> tuple[JoinAndSelectData, ...]:
+    # Like collect_join_tables(...): only join data with an alias is kept, and each alias is only included once.
+    terms: dict[str, JoinAndSelectData] = {}
+    for ts in term_groups:
+        for t in ts:
+            if t.current_alias_str is not None:
+                terms.setdefault(t.current_alias_str, t)
+    return tuple(terms.values())
+
+
+SQL_EXISTS_ROW = sql.SQL("(SELECT 1) AS {alias}").format(alias=sql.Identifier("_exists"))
+
+
+def _exists_sql(
+    terms: tuple[JoinAndSelectData, ...], null_rejecting: Container[str], condition: sql.Composable | None
+) -> sql.Composable:
+    # Relations are listed in path order, so relation functions (e.g. unnest) only refer to relations listed before
+    # them (or in the outer query.) Relations are joined like they are without subqueries (see _join_fragment), except
+    # for relations the condition is null-rejecting for, which are inner-joined; if the first one is, its key link to
+    # the outer query becomes a condition of the subquery.
+    relations: list[sql.Composable] = []
+    conditions: list[sql.Composable] = []
+
+    for t in terms:
+        # Terms with an alias always have a relation (see _unique_terms), and related terms always have a parent.
+        r1, a1, a0 = t.relations.current, t.aliases.current, t.aliases.parent
+        assert r1 is not None and a1 is not None
+        relation = sql.SQL("{r1} AS {a1}{s1}").format(r1=r1, a1=a1, s1=t.current_alias_sql_schema or SQL_NOTHING)
+
+        if t.key_link is None:  # Relation function
+            relations.append(sql.SQL("CROSS JOIN {r}").format(r=relation) if relations else relation)
+            continue
+
+        assert a0 is not None
+        key_link = sql.SQL("{a0}.{f0} = {a1}.{f1}").format(
+            a0=a0, a1=a1, f0=sql.Identifier(t.key_link[0]), f1=sql.Identifier(t.key_link[1])
+        )
+        if t.current_alias_str not in null_rejecting:
+            # Left-joined to a single row if it is the first relation, so that the subquery always has a row
+            if not relations:
+                relations.append(SQL_EXISTS_ROW)
+            relations.append(sql.SQL("LEFT JOIN {r} ON {k}").format(r=relation, k=key_link))
+        elif relations:
+            relations.append(sql.SQL("JOIN {r} ON {k}").format(r=relation, k=key_link))
+        else:
+            relations.append(relation)
+            conditions.append(key_link)
+
+    if condition is not None:
+        conditions.append(condition)
+
+    return sql.SQL("EXISTS (SELECT 1 FROM {relations}{where})").format(
+        relations=sql.SQL(" ").join(relations),
+        where=sql.SQL(" WHERE {c}").format(c=sql.SQL(" AND ").join(conditions)) if conditions else SQL_NOTHING,
+    )
+
+
+def _exists_subquery(
+    ast: q.AST, params: tuple, schema: JSONSchema, internal: bool = False, null_rejecting: Container[str] = frozenset()
+) -> SQLComposableWithParams:
+    terms = _unique_terms(_resolve_exists_split(r, schema)[1] for r in _collect_resolves(ast))
+    expr_sql, expr_params = _search_ast_to_psycopg2_expr(ast, params, schema, internal)
+    return _exists_sql(terms, null_rejecting, sql.SQL("({expr})").format(expr=expr_sql)), expr_params
+
+
+def _search_ast_to_psycopg2_exists_expr(
+    ast: q.AST, params: tuple, schema: JSONSchema, internal: bool = False
+) -> SQLComposableWithParams:
+    # Assumes permissions have already been checked for the AST; see search_ast_to_psycopg2_expr
+    #  Components are emitted with an explicit stack, so that long chains of split #and / #or expressions don't recurse.
+    ctx = _ExistsContext(ast, schema)
+    parts: list[sql.Composable] = []
+    expr_params: list = []
+    stack: list[q.AST | sql.Composable] = [ast]
+
+    while stack:
+        e = stack.pop()
+
+        if isinstance(e, sql.Composable):
+            parts.append(e)
+            continue
+
+        if components := ctx.components(e):
+            op = SQL_AND if e.fn == q.FUNCTION_AND else SQL_OR
+            for i in range(len(components) - 1, -1, -1):
+                stack.extend((SQL_CLOSE, components[i], SQL_OPEN))
+                if i:
+                    stack.append(op)
+            continue
+
+        e_sql, e_params = (
+            _exists_subquery(e, (), schema, internal, ctx.null_rejecting(e))
+            if ctx.array_groups(e)
+            else _search_ast_to_psycopg2_expr(e, (), schema, internal)
+        )
+        parts.append(e_sql)
+        expr_params.extend(e_params)
+
+    # Expressions which aren't split compile just as they would without EXISTS subqueries (or as a single subquery)
+    expr_sql = parts[0] if len(parts) == 1 else sql.Composed(parts)
+
+    if arrays := ctx.unchecked_empty_arrays(ast):
+        expr_sql = sql.SQL(" AND ").join(
+            (*(_exists_sql(terms, (), None) for terms in arrays), sql.SQL("({expr})").format(expr=expr_sql))
+        )
+
+    return expr_sql, params + tuple(expr_params)
+
+
+def _exists_params_in_query_order(ast: q.AST, schema: JSONSchema) -> bool:
+    # Whether compiling a (flattened) AST with EXISTS subqueries keeps its parameters in query order; they are out of
+    # order if the components of an #and / #or expression are not in argument order, e.g. [a0 AND a2] AND [b1].
+    ctx = _ExistsContext(ast, schema)
+    stack: list[q.AST] = [ast]
+
+    while stack:
+        e = stack.pop()
+        if isinstance(e, q.Expression) and e.fn in (q.FUNCTION_AND, q.FUNCTION_OR):
+            components = q.independent_components([ctx.array_groups(a) for a in e.args])
+            if len(components) > 1:
+                if [i for c in components for i in c] != list(range(len(e.args))):
+                    return False
+                stack.extend(e.args[c[0]] for c in components if len(c) == 1)
+
+    return True
+
+
+def exists_join_fragment(ast: q.AST, schema: JSONSchema) -> sql.Composable:
+    """
+    Like join_fragment(...), but only joining relations before the first array of each resolve path, for use with
+    EXISTS subqueries.
+    :param ast: The AST representation of the query being executed.
+    :param schema: The JSON schema + extra Bento search properties for
+    :return: The SQL fragment with all the aliased joins.
+    """
+    return _join_fragment(_exists_outer_terms(ast, schema), schema)
+
+
+def _exists_outer_terms(ast: q.AST, schema: JSONSchema) -> tuple[JoinAndSelectData, ...]:
+    return _unique_terms(_resolve_exists_split(r, schema)[0] for r in _collect_resolves(ast))
+
+
 def search_ast_to_psycopg2_expr(
     ast: q.AST, params: tuple, schema: JSONSchema, internal: bool = False
 ) -> SQLComposableWithParams:
+    # Before doing anything, check that the permissions are correct given the AST and the search schema. This is done
+    # once for the whole AST (and cached for repeated queries), rather than once per sub-expression.
+    #  TODO: use OIDC to maybe dynamically inject permissions/access levels somehow - either into schema or as a param
+    q.check_query_permissions(ast, schema, search_getter=get_search_properties, internal=internal)
+    return _search_ast_to_psycopg2_expr(ast, params, schema, internal)
+
+
+def _search_ast_to_psycopg2_expr(
+    ast: q.AST, params: tuple, schema: JSONSchema, internal: bool = False
+) -> SQLComposableWithParams:
+    # Assumes permissions have already been checked for the AST; see search_ast_to_psycopg2_expr
     if isinstance(ast, q.Literal):
         return sql.Placeholder(), (*params, ast.value)
 
-    # Before doing anything, check that the permissions are correct given the AST and the search schema.
-    #  TODO: use OIDC to maybe dynamically inject permissions/access levels somehow - either into schema or as a param
-    q.check_operation_permissions(ast, schema, search_getter=get_search_properties, internal=internal)
-
     # Begin recursively constructing the SQL expression, starting with the top-most expression in our query
     return POSTGRES_SEARCH_LANGUAGE_FUNCTIONS[ast.fn](ast.args, params, schema, internal)
 
 
-def search_query_to_psycopg2_sql(query, schema: JSONSchema, internal: bool = False) -> SQLComposableWithParams:
-    # TODO: Shift recursion to not have to add in the extra SELECT for the root?
-    ast = q.convert_query_to_ast_and_preprocess(query)
-    sql_obj, params = search_ast_to_psycopg2_expr(ast, (), schema, internal)
+# Aggregation
+#  Rather than selecting matching rows, a query can be compiled to count them, optionally broken down by the values of
+#  one or more fields. Each field gets its own grouping set, along with an empty grouping set for the total count, so a
+#  single query returns the total and every field's per-value counts (e.g. all the buckets for a set of charts.)
+#  Rows are counted by the root relation's primary key, since joining arrays can multiply rows; when rows are known to
+#  be unique (EXISTS subqueries, without grouping by array fields), they are just counted.
+#  Breaking counts down by a field must not change which rows are counted, so relations only needed to group by are
+#  left-joined (laterally, for array functions): a row with an empty array is counted with a NULL value for the field.
+
+
+class SearchAggregate:
+    """
+    Describes how to aggregate the results of a search query: the number of distinct matching root rows, optionally
+    broken down by the values of a set of fields. Aggregate queries return a column per field (group_0, group_1, ...),
+    a grouping column, and a count column. Each row is either the total count, or the count for a value of a single
+    field; for the count of field i, bit (n - 1 - i) of the grouping column is 0, where n is the number of fields.
+    """
+
+    def __init__(self, group_by: Sequence[SchemaPath] = ()):
+        """
+        :param group_by: Paths (i.e., #resolve arguments) of fields to break the count down by.
+        """
+        self.group_by: tuple[tuple[q.Literal, ...], ...] = tuple(tuple(map(q.Literal, path)) for path in group_by)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, SearchAggregate) and self.group_by == other.group_by
+
+    def __hash__(self) -> int:
+        return hash(self.group_by)
+
+    def __repr__(self):  # pragma: no cover
+        return f"<SearchAggregate group_by={self.group_by}>"
+
+
+def get_primary_key(schema: JSONSchema) -> str:
+    if (primary_key := _get_search_and_database_properties(schema)[1].get("primary_key")) is None:
+        raise SyntaxError("Search schema does not declare a primary key for the root relation")
+    return primary_key
+
+
+def _group_join_fragment(terms: tuple[JoinAndSelectData, ...], query_terms: int, schema: JSONSchema) -> sql.Composable:
+    # Like _join_fragment, but as a single chain of joins in path order, so that the terms after the first query_terms
+    # (which are only needed to group by) can be left-joined laterally to the terms they are nested in.
+    if not terms:
+        return _join_fragment(terms, schema)
+
+    joins: list[sql.Composable] = []
+
+    for i, term in enumerate(terms):
+        r1, a1 = term.relations.current, term.aliases.current
+        if r1 is None:
+            continue
+        assert a1 is not None  # Terms with relations are always aliased; see collect_resolve_join_tables
+        relation = sql.SQL("{r1} AS {a1}{s1}").format(r1=r1, a1=a1, s1=term.current_alias_sql_schema or SQL_NOTHING)
+        if not joins:
+            joins.append(relation)
+        elif term.key_link is not None:
+            a0 = term.aliases.parent
+            assert a0 is not None  # Key-linked terms are always nested in a relation
+            joins.append(
+                sql.SQL(" LEFT JOIN {relation} ON {a0}.{f0} = {a1}.{f1}").format(
+                    relation=relation,
+                    a0=a0,
+                    a1=a1,
+                    f0=sql.Identifier(term.key_link[0]),
+                    f1=sql.Identifier(term.key_link[1]),
+                )
+            )
+        elif i < query_terms:
+            joins.append(sql.SQL(" CROSS JOIN {relation}").format(relation=relation))
+        else:
+            joins.append(sql.SQL(" LEFT JOIN LATERAL {relation} ON true").format(relation=relation))
+
+    return sql.Composed(joins)
+
+
+def _count_sql(schema: JSONSchema, rows_unique: bool) -> sql.Composable:
+    if rows_unique:
+        return sql.SQL("COUNT(*)")
+    return sql.SQL("COUNT(DISTINCT {root}.{pk})").format(root=SQL_ROOT, pk=sql.Identifier(get_primary_key(schema)))
+
+
+# Pagination
+#  Matching rows can be fetched a page at a time, ordered by the root relation's primary key as declared in the search
+#  schema. Pages are found by seeking past the last key of the previous page (keyset pagination), rather than with an
+#  OFFSET, so fetching a later page is as cheap as fetching the first. The key and page size are passed as parameters,
+#  so every page of a query shares the same SQL.
+
+
+class SearchPage:
+    """
+    Describes a page of search results: up to limit root rows, in primary key order, with keys greater than after (if
+    given.) The next page starts after the primary key of the last row of the current page; see next_page(...).
+    """
+
+    def __init__(self, limit: int, after: q.LiteralValue | None = None):
+        """
+        :param limit: The maximum number of rows in the page.
+        :param after: The primary key of the last row of the previous page, if any.
+        """
+
+        if limit < 1:
+            raise ValueError(f"Invalid page size: {limit}")
+
+        self.limit: int = limit
+        self.after: q.LiteralValue | None = after
+
+    def next_page(self, last_key: q.LiteralValue) -> "SearchPage":
+        """
+        :param last_key: The primary key of the last row of this page.
+        :return: The page of results following this one.
+        """
+        return SearchPage(self.limit, last_key)
+
+    def __repr__(self):  # pragma: no cover
+        return f"<SearchPage limit={self.limit} after={self.after}>"
+
+
+def _page_shape(page: SearchPage | None) -> bool | None:
+    # The part of a page which the SQL depends on
+    return None if page is None else page.after is not None
+
+
+def _page_params(page: SearchPage | None) -> tuple:
+    if page is None:
+        return ()
+    return (page.limit,) if page.after is None else (page.after, page.limit)
+
+
+def search_ast_to_psycopg2_sql(
+    ast: q.AST,
+    schema: JSONSchema,
+    internal: bool = False,
+    exists_subqueries: bool = False,
+    aggregate: SearchAggregate | None = None,
+    page: SearchPage | None = None,
+) -> SQLComposableWithParams:
+    # Takes an already-converted (and possibly optimized, see optimizer.optimize_query) AST
+    #  If exists_subqueries is True, arrays are accessed via EXISTS subqueries rather than joins, so that each root row
+    #  is returned at most once; see _search_ast_to_psycopg2_exists_expr.
+    #  If aggregate is given, matching rows are counted rather than selected; see SearchAggregate.
+    #  If page is given, only a page of matching rows is selected, in primary key order; see SearchPage.
+
+    if aggregate is not None and page is not None:
+        raise ValueError("Cannot paginate aggregated search results")
+
+    ast = q.flatten_boolean_expressions(ast)
+
+    if exists_subqueries:
+        q.check_query_permissions(ast, schema, search_getter=get_search_properties, internal=internal)
+        sql_obj, params = _search_ast_to_psycopg2_exists_expr(ast, (), schema, internal)
+        terms = _exists_outer_terms(ast, schema)
+    else:
+        # TODO: Shift recursion to not have to add in the extra SELECT for the root?
+        sql_obj, params = search_ast_to_psycopg2_expr(ast, (), schema, internal)
+        terms = collect_join_tables(ast, (), schema)
+
+    if page is not None:
+        pk = sql.SQL("{root}.{pk}").format(root=SQL_ROOT, pk=sql.Identifier(get_primary_key(schema)))
+        # Joined arrays can multiply rows, so pages need to be made of distinct root rows.
+        # noinspection SqlDialectInspection,SqlNoDataSourceInspection
+        return sql.SQL(
+            "SELECT {distinct}{root}.* FROM {relations_with_joins} WHERE {query_expr} ORDER BY {pk} LIMIT {limit}"
+        ).format(
+            distinct=SQL_NOTHING if exists_subqueries else sql.SQL("DISTINCT ON ({pk}) ").format(pk=pk),
+            root=SQL_ROOT,
+            relations_with_joins=_join_fragment(terms, schema),
+            query_expr=(
+                sql_obj
+                if page.after is None
+                else sql.SQL("({query_expr}) AND {pk} > {after}").format(
+                    query_expr=sql_obj, pk=pk, after=sql.Placeholder()
+                )
+            ),
+            pk=pk,
+            limit=sql.Placeholder(),
+        ), params + _page_params(page)
+
+    if aggregate is None:
+        # noinspection SqlDialectInspection,SqlNoDataSourceInspection
+        return sql.SQL("SELECT {root}.* FROM {relations_with_joins} WHERE {query_expr}").format(
+            root=SQL_ROOT, relations_with_joins=_join_fragment(terms, schema), query_expr=sql_obj
+        ), params
+
+    query_terms = len(terms)
+    for path in aggregate.group_by:
+        # Breaking counts down by a field reveals its values, so it must be accessible like any other field.
+        q.check_query_permissions(
+            q.Expression(q.FUNCTION_RESOLVE, path), schema, search_getter=get_search_properties, internal=internal
+        )
+        # Fields to group by are always joined, even when arrays are otherwise accessed via EXISTS subqueries; see
+        # _group_join_fragment.
+        terms = collect_join_tables(q.Expression(q.FUNCTION_RESOLVE, path), terms, schema)
+
+    count_sql = _count_sql(
+        schema, exists_subqueries and all(_resolve_exists_split(path, schema)[2] is None for path in aggregate.group_by)
+    )
+
+    if not aggregate.group_by:
+        # noinspection SqlDialectInspection,SqlNoDataSourceInspection
+        return sql.SQL("SELECT {count} AS {count_alias} FROM {relations_with_joins} WHERE {query_expr}").format(
+            count=count_sql,
+            count_alias=sql.Identifier("count"),
+            relations_with_joins=_join_fragment(terms, schema),
+            query_expr=sql_obj,
+        ), params
+
+    group_sqls = tuple(_resolve(path, (), schema, internal)[0] for path in aggregate.group_by)
+
     # noinspection SqlDialectInspection,SqlNoDataSourceInspection
-    return sql.SQL("SELECT {root}.* FROM {relations_with_joins} WHERE {query_expr}").format(
-        root=SQL_ROOT, relations_with_joins=join_fragment(ast, schema), query_expr=sql_obj
+    return sql.SQL(
+        "SELECT {groups}, GROUPING({group_list}) AS {grouping_alias}, {count} AS {count_alias} "
+        "FROM {relations_with_joins} WHERE {query_expr} GROUP BY GROUPING SETS ({grouping_sets}, ())"
+    ).format(
+        groups=sql.SQL(", ").join(
+            sql.SQL("{g} AS {a}").format(g=g, a=sql.Identifier(f"group_{i}")) for i, g in enumerate(group_sqls)
+        ),
+        group_list=sql.SQL(", ").join(group_sqls),
+        grouping_alias=sql.Identifier("grouping"),
+        count=count_sql,
+        count_alias=sql.Identifier("count"),
+        relations_with_joins=_group_join_fragment(terms, query_terms, schema),
+        query_expr=sql_obj,
+        grouping_sets=sql.SQL(", ").join(sql.SQL("({g})").format(g=g) for g in group_sqls),
     ), params
 
 
+def search_query_to_psycopg2_sql(
+    query,
+    schema: JSONSchema,
+    internal: bool = False,
+    exists_subqueries: bool = False,
+    aggregate: SearchAggregate | None = None,
+    page: SearchPage | None = None,
+) -> SQLComposableWithParams:
+    # Queries with the same shape as a previous query re-use its SQL; see SQLTemplateCache
+    return sql_template_cache.search_query_to_psycopg2_sql(query, schema, internal, exists_subqueries, aggregate, page)
+
+
 def uncurried_binary_op(
     op: str, args: q.Args, params: tuple, schema: JSONSchema, internal: bool = False
 ) -> SQLComposableWithParams:
     # TODO: Need to fix params!! Use named params
-    lhs_sql, lhs_params = search_ast_to_psycopg2_expr(args[0], params, schema, internal)
-    rhs_sql, rhs_params = search_ast_to_psycopg2_expr(args[1], params, schema, internal)
+    lhs_sql, lhs_params = _search_ast_to_psycopg2_expr(args[0], params, schema, internal)
+    rhs_sql, rhs_params = _search_ast_to_psycopg2_expr(args[1], params, schema, internal)
     return (
         sql.SQL("({lhs}) {op} ({rhs})").format(lhs=lhs_sql, op=sql.SQL(op), rhs=rhs_sql),
         params + lhs_params + rhs_params,  # Collect all params together from elsewhere + both sides of the expression
@@ -397,23 +1000,102 @@ def _binary_op(op) -> Callable[[q.Args, tuple, JSONSchema, bool], SQLComposableW
     return lambda args, params, schema, internal: uncurried_binary_op(op, args, params, schema, internal)
 
 
-def _in(args: q.Args, params: tuple, schema: JSONSchema, internal: bool = False) -> SQLComposableWithParams:
-    lhs_sql, lhs_params = search_ast_to_psycopg2_expr(args[0], params, schema, internal)
-    rhs_sql, rhs_params = search_ast_to_psycopg2_expr(args[1], params, schema, internal)
-    return sql.SQL("({lhs}) IN {rhs}").format(lhs=lhs_sql, rhs=rhs_sql), params + lhs_params + rhs_params
+SQL_AND = sql.SQL(" AND ")
+SQL_OR = sql.SQL(" OR ")
+SQL_NOT_OPEN = sql.SQL("NOT (")
+SQL_OPEN = sql.SQL("(")
+SQL_CLOSE = sql.SQL(")")
+
+
+def _boolean_expr(
+    fn: q.FunctionName, args: q.Args, params: tuple, schema: JSONSchema, internal: bool = False
+) -> SQLComposableWithParams:
+    # #and / #or take any number of arguments: (a) AND (b) AND (c) ...; #not takes one: NOT (a)
+    #  Nested #and / #or / #not arguments are emitted in order with an explicit stack, into a single (flat) sequence of
+    #  SQL, so that neither composing nor rendering the SQL for deeply nested queries recurses.
+    parts: list[sql.Composable] = []
+    expr_params: list = []
+    stack: list[q.AST | sql.Composable] = [q.Expression(fn, args)]
+
+    while stack:
+        e = stack.pop()
+
+        if isinstance(e, sql.Composable):
+            parts.append(e)
+        elif isinstance(e, q.Expression) and e.fn == q.FUNCTION_NOT:
+            stack.extend((SQL_CLOSE, e.args[0], SQL_NOT_OPEN))
+        elif isinstance(e, q.Expression) and e.fn in (q.FUNCTION_AND, q.FUNCTION_OR):
+            op = SQL_AND if e.fn == q.FUNCTION_AND else SQL_OR
+            for i in range(len(e.args) - 1, -1, -1):
+                stack.extend((SQL_CLOSE, e.args[i], SQL_OPEN))
+                if i:
+                    stack.append(op)
+        else:
+            e_sql, e_params = _search_ast_to_psycopg2_expr(e, (), schema, internal)
+            parts.append(e_sql)
+            expr_params.extend(e_params)
+
+    return sql.Composed(parts), params + tuple(expr_params)
 
 
-def _not(args: q.Args, params: tuple, schema: JSONSchema, internal: bool = False) -> SQLComposableWithParams:
-    child_sql, child_params = search_ast_to_psycopg2_expr(args[0], params, schema, internal)
-    return sql.SQL("NOT ({child})").format(child=child_sql), params + child_params
+def _boolean_op(fn: q.FunctionName) -> Callable[[q.Args, tuple, JSONSchema, bool], SQLComposableWithParams]:
+    return lambda args, params, schema, internal: _boolean_expr(fn, args, params, schema, internal)
+
+
+class InComposable(sql.Composable):
+    """
+    An ({lhs}) IN {rhs} expression, where the right-hand side is a placeholder for a tuple of values. With psycopg2, this
+    is rendered as-is, using psycopg2's tuple adaptation; it is kept distinct from other SQL so that targets without
+    tuple adaptation can render it as an array comparison instead (see render_asyncpg_sql.)
+    """
+
+    def __init__(self, lhs: sql.Composable, rhs: sql.Composable, element_type: str | None):
+        """
+        :param lhs: The SQL for the value being checked.
+        :param rhs: The SQL for the values being checked against.
+        :param element_type: The Postgres type of the values, if known from the search schema.
+        """
+        # The parts are also wrapped, so that equal expressions compare equal like other composables
+        super().__init__((lhs, rhs, element_type))
+        self.lhs: sql.Composable = lhs
+        self.rhs: sql.Composable = rhs
+        self.element_type: str | None = element_type
+
+    def as_string(self, context) -> str:
+        return f"({self.lhs.as_string(context)}) IN {self.rhs.as_string(context)}"
+
+
+# JSON schema types whose values are stored as a typed column or record field when they aren't array items
+_PRIMITIVE_JSON_SCHEMA_TYPES = frozenset({"string", "integer", "number", "boolean"})
+
+
+def _in_element_type(lhs: q.AST, schema: JSONSchema) -> str | None:
+    # Array items may be JSON(B) values rather than typed values, so their type isn't taken from the schema.
+    if (
+        not isinstance(lhs, q.Expression)
+        or lhs.fn != q.FUNCTION_RESOLVE
+        or not lhs.args
+        or lhs.args[-1].value == "[item]"
+    ):
+        return None
+    schema_path = get_compiled_search_schema(schema).get(cast(tuple[q.Literal, ...], lhs.args))
+    if schema_path is None or schema_path.schema.get("type") not in _PRIMITIVE_JSON_SCHEMA_TYPES:
+        return None
+    return json_schema_to_postgres_type(schema_path.schema, "jsonb")
+
+
+def _in(args: q.Args, params: tuple, schema: JSONSchema, internal: bool = False) -> SQLComposableWithParams:
+    lhs_sql, lhs_params = _search_ast_to_psycopg2_expr(args[0], params, schema, internal)
+    rhs_sql, rhs_params = _search_ast_to_psycopg2_expr(args[1], params, schema, internal)
+    return InComposable(lhs_sql, rhs_sql, _in_element_type(args[0], schema)), params + lhs_params + rhs_params
 
 
 def _like_op(op: str) -> Callable[[tuple[q.AST, q.AST], tuple, JSONSchema, bool], SQLComposableWithParams]:
     def inner(
         args: tuple[q.AST, q.AST], params: tuple, schema: JSONSchema, internal: bool = False
     ) -> SQLComposableWithParams:
-        lhs_sql, lhs_params = search_ast_to_psycopg2_expr(args[0], params, schema, internal)
-        rhs_sql, rhs_params = search_ast_to_psycopg2_expr(args[1], params, schema, internal)
+        lhs_sql, lhs_params = _search_ast_to_psycopg2_expr(args[0], params, schema, internal)
+        rhs_sql, rhs_params = _search_ast_to_psycopg2_expr(args[1], params, schema, internal)
 
         return (
             sql.SQL("{lhs} {op} {rhs}").format(lhs=lhs_sql, op=sql.SQL(op), rhs=rhs_sql),
@@ -449,32 +1131,39 @@ def _wildcard(
     if isinstance(args[0], q.Expression):
         raise NotImplementedError(f"Cannot currently use {q.FUNCTION_HELPER_WC} on an expression")  # TODO
 
+    return sql.Placeholder(), (*params, _wildcard_param(args[0].value, args[1].value))
+
+
+def _wildcard_param(value: q.LiteralValue, wc_loc: q.LiteralValue) -> str:
     # TODO: py3.10: match
-    if args[1].value == "start":
+    if wc_loc == "start":
         wcs = "{}%"
-    elif args[1].value == "end":
+    elif wc_loc == "end":
         wcs = "%{}"
     else:  # anywhere
         wcs = "%{}%"
 
     try:
-        return sql.Placeholder(), (*params, wcs.format(args[0].value.replace("%", r"\%").replace("_", r"\_")))
+        return wcs.format(value.replace("%", r"\%").replace("_", r"\_"))  # type: ignore
     except AttributeError:
         # Can happen with non-string argument to #_wc, which will throw on .replace(...)
         raise TypeError(f"Type-invalid use of function {q.FUNCTION_HELPER_WC}")
 
 
 def get_relation(resolve: tuple[q.Literal, ...], schema: JSONSchema):
-    aliases = collect_resolve_join_tables((QUERY_ROOT, *resolve), schema)[-1].aliases
+    aliases = resolve_join_tables(resolve, schema)[-1].aliases
     return aliases.current if aliases.current is not None else aliases.parent
 
 
 def get_field(resolve: tuple[q.Literal, ...], schema: JSONSchema) -> str | None:
-    return collect_resolve_join_tables((QUERY_ROOT, *resolve), schema)[-1].field_alias
+    if (schema_path := get_compiled_search_schema(schema).get(resolve)) is not None:
+        return schema_path.field
+    # Invalid path: collect join tables to raise the appropriate error
+    return resolve_join_tables(resolve, schema)[-1].field_alias
 
 
 def get_search_properties(resolve: tuple[q.Literal, ...], schema: JSONSchema) -> dict:
-    return collect_resolve_join_tables((QUERY_ROOT, *resolve), schema)[-1].search_properties
+    return resolve_join_tables(resolve, schema)[-1].search_properties
 
 
 def _resolve(args: q.Args, params: tuple, schema: JSONSchema, _internal: bool = False) -> SQLComposableWithParams:
@@ -487,28 +1176,31 @@ def _resolve(args: q.Args, params: tuple, schema: JSONSchema, _internal: bool =
     :param _internal: (unused here) whether we are querying from a global-access context, or a permissioned one.
     :return: A tuple of the SQL representation for the field access, and the params tuple (unchanged here).
     """
-    f_id = get_field(args, schema)
-    return sql.SQL("{relation}.{field}").format(
-        relation=get_relation(args, schema), field=sql.Identifier(f_id) if f_id is not None else sql.SQL("*")
-    ), params
+    # Like join tables, the field access SQL for a path only depends on the schema.
+    memo = _derived_memo(schema, "postgres_resolve_sql")
+    if (res := memo.get(args)) is None:
+        f_id = get_field(args, schema)
+        res = memo[args] = sql.SQL("{relation}.{field}").format(
+            relation=get_relation(args, schema), field=sql.Identifier(f_id) if f_id is not None else sql.SQL("*")
+        )
+    return res, params
 
 
 def _list(args: q.Args, params: tuple, _schema: JSONSchema, _internal: bool = False) -> SQLComposableWithParams:
     # :param args: a tuple of query.Literal objects to be used in an IN clause.
     # with psycopg2, it must be passed as a tuple of tuples, hence the enclosing
     # parentheses in the following statement.
-    # TODO: for large lists, the syntax IN (VALUES ("patient1"), ("patient2")) which creates
-    #  a table construct on the fly is recommended performance-wise (better indexing)
-    # FUTURE: psycopg3 won't allow the "tuples adaptation" syntax anymore:
+    # psycopg3 (and asyncpg) don't allow the "tuples adaptation" syntax; for these, IN expressions are rendered as array
+    # comparisons instead, with large lists un-nested into a semi-join (see render_psycopg3_sql.)
     # https://www.psycopg.org/psycopg3/docs/basic/from_pg2.html#you-cannot-use-in-s-with-a-tuple
     values = tuple(a.value for a in args)
     return sql.Placeholder(), (*params, values)
 
 
 POSTGRES_SEARCH_LANGUAGE_FUNCTIONS: dict[str, Callable[[q.Args, tuple, JSONSchema, bool], SQLComposableWithParams]] = {
-    q.FUNCTION_AND: _binary_op("AND"),
-    q.FUNCTION_OR: _binary_op("OR"),
-    q.FUNCTION_NOT: _not,
+    q.FUNCTION_AND: _boolean_op(q.FUNCTION_AND),
+    q.FUNCTION_OR: _boolean_op(q.FUNCTION_OR),
+    q.FUNCTION_NOT: _boolean_op(q.FUNCTION_NOT),
     # -------------------------------------------
     q.FUNCTION_LT: _binary_op("<"),
     q.FUNCTION_LE: _binary_op("<="),
@@ -530,3 +1222,797 @@ POSTGRES_SEARCH_LANGUAGE_FUNCTIONS: dict[str, Callable[[q.Args, tuple, JSONSchem
     # -------------------------------------------
     q.FUNCTION_HELPER_WC: _wildcard,
 }
+
+
+# SQL text targets (asyncpg, psycopg 3)
+#  asyncpg and psycopg 3 have no client-side tuple adaptation; instead, queries are sent as text with placeholders to be
+#  bound (and, optionally, prepared) by the server. SQL composed for psycopg2 is rendered to text directly, without
+#  needing a psycopg2 connection: identifiers are always quoted, placeholders are numbered in order, and IN expressions
+#  become = ANY(...::type[]) array comparisons, with the corresponding (tuple) parameters passed as lists. The SQL for a
+#  list therefore doesn't depend on its length, so it can be prepared once and re-used for any list.
+#  For very large lists, Postgres plans = ANY(...) as a scan over the array for each row; these are instead rendered as
+#  IN (SELECT unnest(...)), which is planned like IN (VALUES ...) - i.e., as a (hashed) semi-join - but still takes the
+#  list as a single array parameter.
+
+# Lists with more than this many values are rendered as IN (SELECT unnest(...)) for psycopg 3
+DEFAULT_LARGE_LIST_SIZE = 1000
+
+
+def _quote_identifier(s: str) -> str:
+    return '"' + s.replace('"', '""') + '"'
+
+
+class _InRHS:
+    # Stack marker for rendering the right-hand side of an IN expression, once its left-hand side has been rendered.
+    __slots__ = ("in_sql",)
+
+    def __init__(self, in_sql: InComposable):
+        self.in_sql: InComposable = in_sql
+
+
+def _render_sql_text(
+    sql_obj: sql.Composable,
+    placeholder: Callable[[int], str],
+    unescape_percent: bool,
+    unnest_params: Container[int] = frozenset(),
+) -> str:
+    """
+    Renders SQL composed by this module as text.
+    :param sql_obj: The SQL to render, e.g. from search_ast_to_psycopg2_sql(...).
+    :param placeholder: Function returning the placeholder text for the nth parameter (starting from 1).
+    :param unescape_percent: Whether to un-escape psycopg2-style (%%) literal percent signs.
+    :param unnest_params: Numbers of list parameters to check against with IN (SELECT unnest(...)) rather than = ANY(...)
+    :return: The SQL text.
+    """
+
+    parts: list[str] = []
+    n_params = 0
+
+    # Render in order with an explicit stack, since SQL for deeply nested queries is deeply nested too.
+    stack: list[sql.Composable | _InRHS | str] = [sql_obj]
+
+    while stack:
+        c = stack.pop()
+
+        if isinstance(c, str):
+            parts.append(c)
+        elif isinstance(c, sql.Composed):
+            stack.extend(reversed(c.seq))
+        elif isinstance(c, sql.SQL):
+            parts.append(c.string.replace("%%", "%") if unescape_percent else c.string)
+        elif isinstance(c, sql.Identifier):
+            parts.append(".".join(map(_quote_identifier, c.strings)))
+        elif isinstance(c, sql.Placeholder) and c.name is None:
+            n_params += 1
+            parts.append(placeholder(n_params))
+        elif isinstance(c, InComposable):
+            stack.extend((_InRHS(c), c.lhs, "("))
+        elif isinstance(c, _InRHS):
+            # The left-hand side has been rendered, so if the right-hand side is a placeholder, its number is known.
+            in_sql = c.in_sql
+            array_type = f"::{in_sql.element_type}[]" if in_sql.element_type else ""
+            if isinstance(in_sql.rhs, sql.Placeholder) and n_params + 1 in unnest_params:
+                stack.extend((f"{array_type}))", in_sql.rhs, ") IN (SELECT unnest("))
+            else:
+                stack.extend((f"{array_type})", in_sql.rhs, ") = ANY("))
+        else:
+            raise TypeError(f"Cannot render SQL as text: {c!r}")
+
+    return "".join(parts)
+
+
+def _array_params(params: tuple) -> list:
+    # asyncpg and psycopg 3 adapt lists (but not tuples) to arrays
+    return [list(p) if isinstance(p, tuple) else p for p in params]
+
+
+def render_asyncpg_sql(sql_obj: sql.Composable) -> str:
+    """
+    Renders SQL composed by this module as text with $n-style placeholders, for use with asyncpg.
+    :param sql_obj: The SQL to render, e.g. from search_ast_to_psycopg2_sql(...).
+    :return: The SQL text.
+    """
+    return _render_sql_text(sql_obj, "${}".format, unescape_percent=True)
+
+
+def _search_ast_to_asyncpg_template(
+    ast: q.AST,
+    schema: JSONSchema,
+    internal: bool = False,
+    exists_subqueries: bool = False,
+    aggregate: SearchAggregate | None = None,
+    page: SearchPage | None = None,
+) -> tuple[str, tuple]:
+    sql_obj, params = search_ast_to_psycopg2_sql(ast, schema, internal, exists_subqueries, aggregate, page)
+    return render_asyncpg_sql(sql_obj), params
+
+
+def search_ast_to_asyncpg_sql(
+    ast: q.AST,
+    schema: JSONSchema,
+    internal: bool = False,
+    exists_subqueries: bool = False,
+    aggregate: SearchAggregate | None = None,
+    page: SearchPage | None = None,
+) -> SQLTextWithParams:
+    """
+    Compiles a query AST to SQL text and parameters for asyncpg, e.g. for conn.fetch(sql_text, *params).
+    Unlike with psycopg2, parameter values are not interpolated client-side, so literal values must have Python types
+    which match the types of the fields they are compared to.
+    :param ast: The query AST.
+    :param schema: The search schema.
+    :param internal: Whether internal-only fields are allowed to be resolved.
+    :param exists_subqueries: Whether to access arrays via EXISTS subqueries rather than joins, so that each root row is
+                              returned at most once.
+    :param aggregate: How to aggregate matching rows, if they should be counted rather than selected.
+    :param page: The page of matching rows to select, if they should be paginated.
+    :return: A tuple of the SQL text and a list of its parameter values.
+    """
+    sql_text, params = _search_ast_to_asyncpg_template(ast, schema, internal, exists_subqueries, aggregate, page)
+    return sql_text, _array_params(params)
+
+
+def search_query_to_asyncpg_sql(
+    query: q.Query,
+    schema: JSONSchema,
+    internal: bool = False,
+    exists_subqueries: bool = False,
+    aggregate: SearchAggregate | None = None,
+    page: SearchPage | None = None,
+) -> SQLTextWithParams:
+    # Queries with the same shape as a previous query re-use its SQL text; see SQLTemplateCache
+    return sql_template_cache.search_query_to_asyncpg_sql(query, schema, internal, exists_subqueries, aggregate, page)
+
+
+def _psycopg3_placeholder_name(n: int) -> str:
+    return f"p{n}"
+
+
+def _psycopg3_placeholder(n: int) -> str:
+    return f"%({_psycopg3_placeholder_name(n)})s"
+
+
+def _large_list_params(params: tuple, large_list_size: int) -> frozenset[int]:
+    return frozenset(n for n, p in enumerate(params, 1) if isinstance(p, tuple) and len(p) > large_list_size)
+
+
+def render_psycopg3_sql(sql_obj: sql.Composable, unnest_params: Container[int] = frozenset()) -> str:
+    """
+    Renders SQL composed by this module as text with named (%(pn)s-style) placeholders, for use with psycopg 3.
+    :param sql_obj: The SQL to render, e.g. from search_ast_to_psycopg2_sql(...).
+    :param unnest_params: Numbers (starting from 1) of list parameters to check against with IN (SELECT unnest(...))
+                          rather than = ANY(...), e.g. for very large lists.
+    :return: The SQL text.
+    """
+    return _render_sql_text(sql_obj, _psycopg3_placeholder, unescape_percent=False, unnest_params=unnest_params)
+
+
+def _psycopg3_params(params: tuple) -> SQLParamsDict:
+    return {_psycopg3_placeholder_name(n): p for n, p in enumerate(_array_params(params), 1)}
+
+
+def _search_ast_to_psycopg3_template(
+    ast: q.AST,
+    schema: JSONSchema,
+    internal: bool = False,
+    large_list_size: int = DEFAULT_LARGE_LIST_SIZE,
+    exists_subqueries: bool = False,
+    aggregate: SearchAggregate | None = None,
+    page: SearchPage | None = None,
+) -> tuple[str, tuple]:
+    sql_obj, params = search_ast_to_psycopg2_sql(ast, schema, internal, exists_subqueries, aggregate, page)
+    return render_psycopg3_sql(sql_obj, _large_list_params(params, large_list_size)), params
+
+
+def search_ast_to_psycopg3_sql(
+    ast: q.AST,
+    schema: JSONSchema,
+    internal: bool = False,
+    large_list_size: int = DEFAULT_LARGE_LIST_SIZE,
+    exists_subqueries: bool = False,
+    aggregate: SearchAggregate | None = None,
+    page: SearchPage | None = None,
+) -> SQLTextWithNamedParams:
+    """
+    Compiles a query AST to SQL text and named parameters for psycopg 3, e.g. for
+    cursor.execute(sql_text, params, prepare=True). The SQL text only depends on the query's shape (and on which lists are
+    larger than large_list_size), so it can be prepared once by the server and re-used for repeated queries.
+    :param ast: The query AST.
+    :param schema: The search schema.
+    :param internal: Whether internal-only fields are allowed to be resolved.
+    :param large_list_size: Lists with more values than this are checked against with IN (SELECT unnest(...)).
+    :param exists_subqueries: Whether to access arrays via EXISTS subqueries rather than joins, so that each root row is
+                              returned at most once.
+    :param aggregate: How to aggregate matching rows, if they should be counted rather than selected.
+    :param page: The page of matching rows to select, if they should be paginated.
+    :return: A tuple of the SQL text and a dictionary of its parameter values.
+    """
+    sql_text, params = _search_ast_to_psycopg3_template(
+        ast, schema, internal, large_list_size, exists_subqueries, aggregate, page
+    )
+    return sql_text, _psycopg3_params(params)
+
+
+def search_query_to_psycopg3_sql(
+    query: q.Query,
+    schema: JSONSchema,
+    internal: bool = False,
+    large_list_size: int = DEFAULT_LARGE_LIST_SIZE,
+    exists_subqueries: bool = False,
+    aggregate: SearchAggregate | None = None,
+    page: SearchPage | None = None,
+) -> SQLTextWithNamedParams:
+    # Queries with the same shape as a previous query re-use its SQL text; see SQLTemplateCache
+    return sql_template_cache.search_query_to_psycopg3_sql(
+        query, schema, internal, large_list_size, exists_subqueries, aggregate, page
+    )
+
+
+# SQL template caching
+#  The SQL generated for a query only depends on the query's shape - its functions, resolve paths, and where its literal
+#  values are - and not on the literal values themselves, which are all passed as parameters. Front ends tend to send
+#  the same query shapes with different values many times, so the composed SQL for each shape is cached. For a query
+#  with a cached shape, a single walk over the query collects its parameter values, skipping AST conversion,
+#  permission checks, and SQL composition.
+
+DEFAULT_SQL_TEMPLATE_CACHE_SIZE = 1024
+
+# Placeholder for a parameter in a query shape
+_PARAM = ("?",)
+
+# Which wildcards are added to the right-hand side of each containment function; must match
+# POSTGRES_SEARCH_LANGUAGE_FUNCTIONS.
+CONTAINS_WILDCARD_LOCATIONS: dict[q.FunctionName, str] = {
+    q.FUNCTION_CO: "anywhere",
+    q.FUNCTION_ICO: "anywhere",
+    q.FUNCTION_ISW: "start",
+    q.FUNCTION_IEW: "end",
+}
+
+# Functions whose arguments are never expressions (in valid queries); these are handled as a whole.
+_LEAF_FUNCTIONS = frozenset({q.FUNCTION_RESOLVE, q.FUNCTION_LIST, q.FUNCTION_HELPER_WC})
+
+
+def _is_literal_value(v) -> bool:
+    return isinstance(v, q.literal_types)
+
+
+def _is_expression_query(query) -> bool:
+    return isinstance(query, list) and len(query) > 0 and isinstance(query[0], str) and query[0] in q.VALID_FUNCTIONS
+
+
+def _query_shape_and_params(query: q.Query) -> tuple[tuple[Hashable, ...], tuple] | None:
+    """
+    Computes the shape of a query, along with its parameter values in the order they appear in the generated SQL. The
+    shape is a flat (prefix-notation) tuple, so that hashing and comparing it doesn't recurse for deeply nested queries.
+    :param query: The query, as nested lists and literal values.
+    :return: A tuple of (shape, parameters), or None if the query's shape can't be cached; in particular, for queries
+             which are invalid, so that errors are always raised by the regular query compilation path.
+    """
+
+    shape: list[Hashable] = []
+    params: list = []
+
+    # Entries are (query, function of the parent expression, index of the query in the parent's arguments)
+    stack: list[tuple[q.Query, q.FunctionName | None, int]] = [(query, None, 0)]
+
+    while stack:
+        e, parent_fn, i = stack.pop()
+
+        if parent_fn in CONTAINS_WILDCARD_LOCATIONS and i == 2:
+            # The right-hand side of a containment function becomes a wildcard pattern parameter
+            if not _is_literal_value(e):
+                return None
+            try:
+                params.append(_wildcard_param(e, CONTAINS_WILDCARD_LOCATIONS[parent_fn]))  # type: ignore
+            except TypeError:
+                return None
+            shape.append(_PARAM)
+            continue
+
+        if not isinstance(e, list):
+            if not _is_literal_value(e):
+                return None
+            params.append(e)
+            shape.append(_PARAM)
+            continue
+
+        if not _is_expression_query(e):
+            return None
+
+        fn, args = e[0], e[1:]
+
+        if fn in _LEAF_FUNCTIONS:
+            if not all(_is_literal_value(a) for a in args):
+                return None
+
+            if fn == q.FUNCTION_RESOLVE:
+                # Resolve paths are part of the SQL; types are included, since e.g. 1 == True
+                shape.extend((fn, len(args), *((type(a), a) for a in args)))
+            elif fn == q.FUNCTION_LIST:
+                # Lists are passed as a single (tuple) parameter, so the SQL doesn't depend on their length
+                if not args:
+                    return None
+                params.append(tuple(args))
+                shape.extend((fn, _PARAM))
+            else:  # #_wc
+                if len(args) != 2:
+                    return None
+                try:
+                    params.append(_wildcard_param(args[0], args[1]))
+                except TypeError:
+                    return None
+                shape.extend((fn, (type(args[1]), args[1])))
+
+            continue
+
+        shape.extend((fn, len(args)))
+        stack.extend((a, fn, j) for j, a in reversed(tuple(enumerate(args, 1))))
+
+    return tuple(shape), tuple(params)
+
+
+class SQLTemplateCache:
+    """
+    A thread-safe, size-bounded cache of the SQL generated for query shapes, evicting the least recently used shapes
+    first. SQL is keyed by query shape, schema object identity, whether the query is run in internal mode, and the
+    target (psycopg2 composables, or asyncpg / psycopg 3 SQL text, with or without EXISTS subqueries); schemas are
+    assumed to not be mutated after they are first used for searching.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_SQL_TEMPLATE_CACHE_SIZE):
+        """
+        :param max_size: The maximum number of query shapes to keep SQL for.
+        """
+
+        if max_size < 1:
+            raise ValueError(f"Invalid cache size: {max_size}")
+
+        self.max_size: int = max_size
+        self.hits: int = 0
+        self.misses: int = 0
+
+        self._lock = threading.Lock()
+        # Values hold a reference to each schema, so the ID of a cached schema object cannot be re-used.
+        self._templates: OrderedDict[
+            tuple[tuple[Hashable, ...], int, bool, Hashable, Hashable], tuple[JSONSchema, sql.Composable | str]
+        ] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+    def _search_query_to_template[T: sql.Composable | str](
+        self,
+        query: q.Query,
+        schema: JSONSchema,
+        internal: bool,
+        target: Hashable,
+        compile_ast: Callable[[q.AST, JSONSchema, bool], tuple[T, tuple]],
+        params_variant: Callable[[tuple], Hashable] | None = None,
+        extra_params: tuple = (),
+        exists_subqueries: bool = False,
+    ) -> tuple[T, tuple]:
+        # params_variant, if given, computes the part of a query's parameters which the target's SQL depends on.
+        # extra_params are parameters which don't come from the query (e.g. for pagination), placed after its own.
+        # If exists_subqueries is True, SQL is only cached if the compiled parameters are in query order; whether terms
+        # are re-ordered into EXISTS subqueries only depends on the query's shape, so such shapes are never cached.
+        shape_and_params = _query_shape_and_params(query)
+
+        if shape_and_params is not None:
+            shape, params = shape_and_params
+            params += extra_params
+            key = (shape, id(schema), internal, target, params_variant(params) if params_variant else None)
+
+            with self._lock:
+                if (entry := self._templates.get(key)) is not None and entry[0] is schema:
+                    self.hits += 1
+                    self._templates.move_to_end(key)
+                    # Templates are keyed by target, so a cached template always has the type compile_ast returns
+                    return cast(T, entry[1]), params
+
+        with self._lock:
+            self.misses += 1
+
+        ast = q.convert_query_to_ast_and_preprocess(query)
+        template, sql_params = compile_ast(ast, schema, internal)
+
+        # The parameters collected from the shape should always match the generated ones; only cache the SQL if they do.
+        #  Equal values can't show that parameters are in the same order, so order is checked separately when it may
+        #  differ.
+        if (
+            shape_and_params is not None
+            and sql_params == params
+            and (not exists_subqueries or _exists_params_in_query_order(q.flatten_boolean_expressions(ast), schema))
+        ):
+            with self._lock:
+                self._templates[key] = (schema, template)
+                self._templates.move_to_end(key)
+                if len(self._templates) > self.max_size:
+                    self._templates.popitem(last=False)
+
+        return template, sql_params
+
+    def search_query_to_psycopg2_sql(
+        self,
+        query: q.Query,
+        schema: JSONSchema,
+        internal: bool = False,
+        exists_subqueries: bool = False,
+        aggregate: SearchAggregate | None = None,
+        page: SearchPage | None = None,
+    ) -> SQLComposableWithParams:
+        """
+        Equivalent to converting the query to an AST and calling search_ast_to_psycopg2_sql(...), but re-using the SQL
+        generated for any previous query with the same shape.
+        :param query: The query, as nested lists and literal values.
+        :param schema: The search schema.
+        :param internal: Whether internal-only fields are allowed to be resolved.
+        :param exists_subqueries: Whether to access arrays via EXISTS subqueries rather than joins.
+        :param aggregate: How to aggregate matching rows, if they should be counted rather than selected.
+        :param page: The page of matching rows to select, if they should be paginated.
+        :return: A tuple of the SQL for the query and its parameter values.
+        """
+        return self._search_query_to_template(
+            query,
+            schema,
+            internal,
+            ("psycopg2", exists_subqueries, aggregate, _page_shape(page)),
+            functools.partial(
+                search_ast_to_psycopg2_sql, exists_subqueries=exists_subqueries, aggregate=aggregate, page=page
+            ),
+            extra_params=_page_params(page),
+            exists_subqueries=exists_subqueries,
+        )
+
+    def search_query_to_asyncpg_sql(
+        self,
+        query: q.Query,
+        schema: JSONSchema,
+        internal: bool = False,
+        exists_subqueries: bool = False,
+        aggregate: SearchAggregate | None = None,
+        page: SearchPage | None = None,
+    ) -> SQLTextWithParams:
+        """
+        Equivalent to converting the query to an AST and calling search_ast_to_asyncpg_sql(...), but re-using the SQL
+        text rendered for any previous query with the same shape.
+        :param query: The query, as nested lists and literal values.
+        :param schema: The search schema.
+        :param internal: Whether internal-only fields are allowed to be resolved.
+        :param exists_subqueries: Whether to access arrays via EXISTS subqueries rather than joins.
+        :param aggregate: How to aggregate matching rows, if they should be counted rather than selected.
+        :param page: The page of matching rows to select, if they should be paginated.
+        :return: A tuple of the SQL text for the query and a list of its parameter values.
+        """
+        sql_text, params = self._search_query_to_template(
+            query,
+            schema,
+            internal,
+            ("asyncpg", exists_subqueries, aggregate, _page_shape(page)),
+            functools.partial(
+                _search_ast_to_asyncpg_template, exists_subqueries=exists_subqueries, aggregate=aggregate, page=page
+            ),
+            extra_params=_page_params(page),
+            exists_subqueries=exists_subqueries,
+        )
+        return sql_text, _array_params(params)
+
+    def search_query_to_psycopg3_sql(
+        self,
+        query: q.Query,
+        schema: JSONSchema,
+        internal: bool = False,
+        large_list_size: int = DEFAULT_LARGE_LIST_SIZE,
+        exists_subqueries: bool = False,
+        aggregate: SearchAggregate | None = None,
+        page: SearchPage | None = None,
+    ) -> SQLTextWithNamedParams:
+        """
+        Equivalent to converting the query to an AST and calling search_ast_to_psycopg3_sql(...), but re-using the SQL
+        text rendered for any previous query with the same shape (and the same lists larger than large_list_size.)
+        :param query: The query, as nested lists and literal values.
+        :param schema: The search schema.
+        :param internal: Whether internal-only fields are allowed to be resolved.
+        :param large_list_size: Lists with more values than this are checked against with IN (SELECT unnest(...)).
+        :param exists_subqueries: Whether to access arrays via EXISTS subqueries rather than joins.
+        :param aggregate: How to aggregate matching rows, if they should be counted rather than selected.
+        :param page: The page of matching rows to select, if they should be paginated.
+        :return: A tuple of the SQL text for the query and a dictionary of its parameter values.
+        """
+        sql_text, params = self._search_query_to_template(
+            query,
+            schema,
+            internal,
+            ("psycopg3", exists_subqueries, aggregate, _page_shape(page)),
+            functools.partial(
+                _search_ast_to_psycopg3_template,
+                large_list_size=large_list_size,
+                exists_subqueries=exists_subqueries,
+                aggregate=aggregate,
+                page=page,
+            ),
+            functools.partial(_large_list_params, large_list_size=large_list_size),
+            extra_params=_page_params(page),
+            exists_subqueries=exists_subqueries,
+        )
+        return sql_text, _psycopg3_params(params)
+
+    def clear(self) -> None:
+        """
+        Removes all cached SQL and resets the hit and miss counters.
+        """
+        with self._lock:
+            self._templates.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# Default cache, used by the module-level search_query_to_*_sql(...) functions
+sql_template_cache = SQLTemplateCache()
+
+
+# Index recommendations
+#  Search schemas declare which fields can be queried, with which operations, and how each field is stored, so indexes
+#  can be recommended for exactly what users are allowed to query:
+#   - btree indexes for comparisons (#eq, #lt, ..., #in) on columns;
+#   - pg_trgm GIN indexes for pattern matching (#co, #ico, #isw, #iew, #like, #ilike) on text columns;
+#   - btree indexes on the keys used to join nested relations to their parents, other than primary keys.
+#  Fields stored inside JSON(B) columns or Postgres arrays are accessed through set-returning functions
+#  (json(b)_to_record, json(b)_array_elements, unnest), which cannot use indexes on the underlying column. Expression
+#  indexes on JSON(B) paths, and GIN indexes for jsonb containment (@>), can still be recommended with json_indexes=True
+#  for other queries against these columns, but are not used by SQL generated by this module.
+
+_BTREE_INDEX_OPERATIONS = frozenset(
+    {op.SEARCH_OP_EQ, op.SEARCH_OP_LT, op.SEARCH_OP_LE, op.SEARCH_OP_GT, op.SEARCH_OP_GE, op.SEARCH_OP_IN}
+)
+_TRIGRAM_INDEX_OPERATIONS = frozenset(
+    {op.SEARCH_OP_CO, op.SEARCH_OP_ICO, op.SEARCH_OP_ISW, op.SEARCH_OP_IEW, op.SEARCH_OP_LIKE, op.SEARCH_OP_ILIKE}
+)
+_CONTAINMENT_INDEX_OPERATIONS = frozenset({op.SEARCH_OP_EQ, op.SEARCH_OP_IN})
+
+# Postgres truncates identifiers longer than this
+_MAX_IDENTIFIER_LENGTH = 63
+
+# Where the children of an object / array node are stored: (relation, relation primary key, JSON(B) column, path of keys
+# into the column, JSON structure type). The column is None for columns of the relation itself; the path is None if the
+# node is (within) an item of a JSON array, and therefore not at a fixed path. Nodes stored in Postgres arrays, or which
+# cannot be mapped, have no container.
+type _IndexContainer = tuple[str, str | None, str | None, tuple[str, ...] | None, str | None]
+
+
+def _quote_literal(s: str) -> str:
+    return "'" + s.replace("'", "''") + "'"
+
+
+class PostgresIndex:
+    """
+    A recommended index on a column, or on a path into a JSON(B) column, of a relation.
+    """
+
+    def __init__(
+        self,
+        relation: str,
+        column: str,
+        method: str = "btree",
+        opclass: str | None = None,
+        json_path: tuple[str, ...] = (),
+        cast: str | None = None,
+    ):
+        """
+        :param relation: The relation (table) to index.
+        :param column: The column to index.
+        :param method: The index access method, e.g. btree or gin.
+        :param opclass: The operator class to index with, if not the default for the column or expression's type.
+        :param json_path: Keys of a path into the (JSON or JSONB) column, if the text value at the path is indexed
+                          rather than the column itself.
+        :param cast: A type to cast the text value at json_path to, if any.
+        """
+
+        self.relation: str = relation
+        self.column: str = column
+        self.method: str = method
+        self.opclass: str | None = opclass
+        self.json_path: tuple[str, ...] = json_path
+        self.cast: str | None = cast
+
+    @property
+    def expression(self) -> str:
+        """
+        The indexed column or expression, as SQL text.
+        """
+        column = _quote_identifier(self.column)
+        if not self.json_path:
+            return column
+        *keys, last_key = map(_quote_literal, self.json_path)
+        expr = f"{column}{''.join(f' -> {k}' for k in keys)} ->> {last_key}"
+        return f"({expr})::{self.cast}" if self.cast else expr
+
+    @property
+    def name(self) -> str:
+        """
+        A name for the index, derived from what it indexes; names too long for Postgres are shortened with a hash.
+        """
+        suffix = "trgm_idx" if self.opclass == "gin_trgm_ops" else ("idx" if self.method == "btree" else "gin_idx")
+        name = re.sub(r"\W+", "_", "_".join((self.relation, self.column, *self.json_path, suffix)))
+        if len(name) > _MAX_IDENTIFIER_LENGTH:
+            name_hash = hashlib.sha256(name.encode("utf-8")).hexdigest()[:8]
+            name = f"{name[: _MAX_IDENTIFIER_LENGTH - len(name_hash) - 1]}_{name_hash}"
+        return name
+
+    @property
+    def ddl(self) -> str:
+        """
+        The CREATE INDEX statement for the index, which does nothing if an index with the same name already exists.
+        """
+        expr = f"({self.expression})" if self.json_path else self.expression
+        opclass = f" {self.opclass}" if self.opclass else ""
+        return (
+            f"CREATE INDEX IF NOT EXISTS {_quote_identifier(self.name)} ON {_quote_identifier(self.relation)} "
+            f"USING {self.method} ({expr}{opclass})"
+        )
+
+    def __eq__(self, other):
+        return isinstance(other, PostgresIndex) and self.ddl == other.ddl
+
+    def __hash__(self):
+        return hash(self.ddl)
+
+    def __repr__(self):  # pragma: no cover
+        return f"<PostgresIndex {self.ddl}>"
+
+
+def _join_key_indexes(
+    schema_path: SearchSchemaPath, parent: _IndexContainer | None, primary_key: str | None
+) -> tuple[PostgresIndex, ...]:
+    # Indexes on the keys joining a node's relation to its parent's; see collect_resolve_join_tables(...)
+    relationship = schema_path.database_properties.get("relationship")
+    if relationship is None:
+        return ()
+
+    relationship_type = relationship["type"]
+    if relationship_type == "MANY_TO_ONE":
+        parent_key, key = relationship["foreign_key"], primary_key
+    elif relationship_type == "ONE_TO_MANY":
+        parent_key, key = relationship["parent_primary_key"], relationship["parent_foreign_key"]
+    else:
+        raise SyntaxError(f"Invalid relationship type: {relationship_type}")
+
+    indexes: list[PostgresIndex] = []
+    # Keys can only be indexed on relations; primary keys are already indexed.
+    if parent is not None and parent[2] is None and parent_key != parent[1]:
+        indexes.append(PostgresIndex(parent[0], parent_key))
+    if key is not None and key != primary_key:
+        indexes.append(PostgresIndex(schema_path.relation, key))  # type: ignore
+    return tuple(indexes)
+
+
+def _index_container(
+    schema_path: SearchSchemaPath, parent: _IndexContainer | None
+) -> tuple[_IndexContainer | None, tuple[PostgresIndex, ...]]:
+    # Returns the container for the children of an object / array node, and the join key indexes for the node
+    database_properties = schema_path.database_properties
+
+    if schema_path.relation is not None:
+        primary_key = database_properties.get("primary_key")
+        return (
+            (schema_path.relation, primary_key, None, None, None),
+            _join_key_indexes(schema_path, parent, primary_key),
+        )
+
+    structure_type = database_properties.get("type")
+    if structure_type not in ("json", "jsonb") or parent is None or schema_path.field is None:
+        return None, ()
+
+    relation, primary_key, column, json_path, parent_structure_type = parent
+
+    if column is None:  # A JSON(B) column of the parent relation
+        column, json_path = schema_path.field, ()
+    else:
+        structure_type = parent_structure_type
+        if json_path is not None:
+            json_path = (*json_path, schema_path.field)
+
+    if schema_path.schema["type"] == "array":
+        json_path = None
+
+    return (relation, primary_key, column, json_path, structure_type), ()
+
+
+def _field_indexes(
+    schema_path: SearchSchemaPath, parent: _IndexContainer | None, json_indexes: bool
+) -> tuple[PostgresIndex, ...]:
+    if parent is None or schema_path.field is None:
+        return ()
+
+    relation, primary_key, column, json_path, structure_type = parent
+    operations = schema_path.operations
+    is_string = schema_path.schema.get("type") == "string"
+    indexes: list[PostgresIndex] = []
+
+    if column is None:  # A column of the relation
+        field = schema_path.field
+        if field != "[item]":
+            if operations & _BTREE_INDEX_OPERATIONS and field != primary_key:
+                indexes.append(PostgresIndex(relation, field))
+            if operations & _TRIGRAM_INDEX_OPERATIONS and is_string:
+                indexes.append(PostgresIndex(relation, field, "gin", "gin_trgm_ops"))
+        return tuple(indexes)
+
+    if not json_indexes:
+        return ()
+
+    if json_path is not None:
+        path = (*json_path, schema_path.field)
+        if operations & _BTREE_INDEX_OPERATIONS:
+            # Values at JSON paths are extracted as text; cast them like json(b)_to_record(...) would, so that
+            # comparisons are typed.
+            cast = None if is_string else json_schema_to_postgres_type(schema_path.schema, structure_type)  # type: ignore
+            indexes.append(PostgresIndex(relation, column, json_path=path, cast=cast))
+        if operations & _TRIGRAM_INDEX_OPERATIONS and is_string:
+            indexes.append(PostgresIndex(relation, column, "gin", "gin_trgm_ops", json_path=path))
+
+    # Containment can find values anywhere in a jsonb column, including in array items
+    if structure_type == "jsonb" and operations & _CONTAINMENT_INDEX_OPERATIONS:
+        indexes.append(PostgresIndex(relation, column, "gin", "jsonb_path_ops"))
+
+    return tuple(indexes)
+
+
+def recommend_postgres_indexes(
+    schema: JSONSchema, internal: bool = False, json_indexes: bool = False
+) -> list[PostgresIndex]:
+    """
+    Recommends indexes for the queryable fields of a search schema, based on each field's permitted operations and how
+    it is stored in the database.
+    :param schema: The search schema.
+    :param internal: Whether to include internal-only fields.
+    :param json_indexes: Whether to include indexes on JSON(B) columns, which generated SQL doesn't use.
+    :return: The recommended indexes, without duplicates, in schema order.
+    """
+
+    query_modes = ("internal", "all") if internal else ("all",)
+
+    containers: dict[SchemaPath, _IndexContainer | None] = {}
+    join_key_indexes: dict[SchemaPath, tuple[PostgresIndex, ...]] = {}
+    indexes: dict[PostgresIndex, None] = {}  # Ordered set
+
+    # Compiled schema paths are in pre-order, so the container of a node's parent is known when the node is reached.
+    for path, schema_path in get_compiled_search_schema(schema).paths.items():
+        parent = containers.get(path[:-1]) if path else None
+
+        if schema_path.schema.get("type") in ("object", "array"):
+            if path:
+                containers[path], join_key_indexes[path] = _index_container(schema_path, parent)
+            elif schema_path.relation is not None:
+                containers[path] = (
+                    schema_path.relation,
+                    schema_path.database_properties.get("primary_key"),
+                    None,
+                    None,
+                    None,
+                )
+            continue
+
+        if not path or schema_path.queryable not in query_modes or not schema_path.operations:
+            continue
+
+        # Querying a field joins the relations of all its ancestors
+        for i in range(1, len(path)):
+            indexes.update(dict.fromkeys(join_key_indexes.get(path[:i], ())))
+        indexes.update(dict.fromkeys(_field_indexes(schema_path, parent, json_indexes)))
+
+    return list(indexes)
+
+
+def postgres_index_ddl(schema: JSONSchema, internal: bool = False, json_indexes: bool = False) -> list[str]:
+    """
+    Returns statements creating the recommended indexes for a search schema (see recommend_postgres_indexes(...)),
+    preceded by a statement creating the pg_trgm extension if any trigram indexes are recommended.
+    :param schema: The search schema.
+    :param internal: Whether to include internal-only fields.
+    :param json_indexes: Whether to include indexes on JSON(B) columns, which generated SQL doesn't use.
+    :return: A list of SQL statements.
+    """
+    indexes = recommend_postgres_indexes(schema, internal, json_indexes)
+    extensions = ["CREATE EXTENSION IF NOT EXISTS pg_trgm"] if any(i.opclass == "gin_trgm_ops" for i in indexes) else []
+    return [*extensions, *(i.ddl for i in indexes)]
@@ -1,8 +1,13 @@
 from __future__ import annotations  # noqa: I001
 
+import json
+import threading
+
 from abc import ABC
-from collections.abc import Callable, Sequence
+from collections import OrderedDict
+from collections.abc import Callable, Hashable, Iterable, Sequence
 from typing import Any
+from weakref import WeakValueDictionary
 
 from ._types import JSONSchema
 from .operations import (
@@ -52,9 +57,15 @@ __all__ = [
     # -------------------------------------------
     "convert_query_to_ast",
     "convert_query_to_ast_and_preprocess",
+    "flatten_boolean_expressions",
+    "ast_to_query",
+    "canonicalize",
     "ast_to_and_asts",
     "and_asts_to_ast",
+    "independent_components",
     "check_operation_permissions",
+    "PERMISSION_CACHE_SIZE",
+    "check_query_permissions",
 ]
 
 
@@ -108,11 +119,12 @@ VALID_FUNCTIONS = (
 )
 
 BINARY_RANGE = (2, 2)
+VARIADIC_RANGE = (2, None)
 
 # Keys are functions, values are a tuple of (minimum argument count, maximum argument count)
 FUNCTION_ARGUMENTS = {
-    FUNCTION_AND: BINARY_RANGE,
-    FUNCTION_OR: BINARY_RANGE,
+    FUNCTION_AND: VARIADIC_RANGE,
+    FUNCTION_OR: VARIADIC_RANGE,
     FUNCTION_NOT: (1, 1),
     FUNCTION_LT: BINARY_RANGE,
     FUNCTION_LE: BINARY_RANGE,
@@ -172,27 +184,68 @@ type Args = tuple[AST, ...]
 
 
 class AST(ABC):
+    # AST nodes are immutable and slotted, so that large sets of cached queries and compiled plans stay compact. Hashes
+    # are computed once per node, when it is created, from the (already computed) hashes of its arguments; neither
+    # hashing nor comparing nodes recurses, so both work for arbitrarily deeply nested queries.
+    __slots__ = ()
+
     type: str
     fn: str
     args: Args
     value: Any
 
+    def __setattr__(self, name: str, value: Any):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __delattr__(self, name: str):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
 
 class Expression(AST):
+    __slots__ = ("_hash", "args", "fn")
+
     type = "e"
+    _hash: int | None
 
     def __init__(self, fn: str, args: Sequence[AST]):
         assert fn in VALID_FUNCTIONS
-        self.fn = fn
+        object.__setattr__(self, "fn", fn)
 
         arg_range = FUNCTION_ARGUMENTS[fn]
         assert len(args) >= arg_range[0] and (arg_range[1] is None or len(args) <= arg_range[1])
-        self.args: Args = tuple(args)
+        object.__setattr__(self, "args", tuple(args))
+
+        # Arguments' hashes were computed when they were created, so hashing the tuple of arguments doesn't recurse.
+        #  Expressions with unhashable (i.e., non-AST) arguments only raise an error if they are hashed.
+        try:
+            object.__setattr__(self, "_hash", hash((fn, self.args)))
+        except TypeError:
+            object.__setattr__(self, "_hash", None)
+
+    def __reduce__(self):
+        return Expression, (self.fn, self.args)
 
     def __eq__(self, other):
-        return (
-            isinstance(other, Expression) and self.fn == other.fn and all(a == b for a, b in zip(self.args, other.args))
-        )
+        # Compare with an explicit stack rather than via tuple comparison of arguments, which would recurse.
+        stack: list[tuple[AST, AST]] = [(self, other)]
+
+        while stack:
+            a, b = stack.pop()
+            if a is b:
+                continue
+            if not isinstance(a, Expression):  # Literal (or other value)
+                if a != b:
+                    return False
+                continue
+            # Expressions with different hashes cannot be equal
+            if not isinstance(b, Expression) or a._hash != b._hash or a.fn != b.fn or len(a.args) != len(b.args):
+                return False
+            stack.extend(zip(a.args, b.args))
+
+        return True
+
+    def __hash__(self):
+        return self._hash if self._hash is not None else hash((self.fn, self.args))
 
     @property
     def value(self) -> Expression:
@@ -205,17 +258,38 @@ class Expression(AST):
         return f"<Expression {self.fn} [{', '.join(repr(a) for a in self.args)}]>"
 
 
+# Literals are interned: creating a literal which is equal to (and of the same type as) an existing one returns the
+# existing instance, so repeated values like resolve path segments ("[item]", "biosamples", ...) are only stored once.
+# Entries are removed once no AST refers to them anymore.
+_interned_literals: WeakValueDictionary[tuple[type, LiteralValue], Literal] = WeakValueDictionary()
+
+
 class Literal(AST):
+    __slots__ = ("__weakref__", "_hash", "value")
+
     type = "l"
     fn = FUNCTION_HELPER_LITERAL
     args = ()
+    _hash: int
 
-    def __init__(self, value: LiteralValue):
+    def __new__(cls, value: LiteralValue):
         assert any(isinstance(value, t) for t in literal_types)
-        self.value = value
+
+        # Literals which compare equal but have different types (e.g. 1, 1.0, and True) are kept distinct
+        key = (type(value), value)
+        if (lit := _interned_literals.get(key)) is not None:
+            return lit
+
+        lit = super().__new__(cls)
+        object.__setattr__(lit, "value", value)
+        object.__setattr__(lit, "_hash", hash(value))
+        return _interned_literals.setdefault(key, lit)
+
+    def __reduce__(self):
+        return Literal, (self.value,)
 
     def __eq__(self, other):
-        return isinstance(other, Literal) and self.value == other.value
+        return self is other or (isinstance(other, Literal) and self.value == other.value)
 
     def __str__(self):
         return str(self.value)
@@ -224,12 +298,12 @@ class Literal(AST):
         return f"<Literal {self.value}>"
 
     def __hash__(self):
-        return self.value.__hash__()
+        return self._hash
 
 
 def convert_query_to_ast(query: Query) -> AST:
     """
-    Recursive function that converts a list of nested lists and scalars to
+    Function that converts a list of nested lists and scalars to
     an AST object containing nested Expression and Literal objects.
     In the Query argument, a list defines an expression and otherwise the
     scalar values should define the literals.
@@ -256,36 +330,211 @@ def convert_query_to_ast(query: Query) -> AST:
                 - value: "John Doe"
         )
     """
-    if isinstance(query, list):
-        if len(query) == 0 or not isinstance(query[0], str) or query[0] not in VALID_FUNCTIONS:
-            raise SyntaxError(f"Invalid expression: {query}")
+    if not isinstance(query, list):
+        return _convert_literal(query)
+
+    # Nested expressions are converted using an explicit stack rather than recursion, so that arbitrarily deeply nested
+    # queries can be converted. Each stack entry holds an expression's query and its converted arguments so far.
+    _validate_expression_query(query)
+    stack: list[tuple[list, list[AST]]] = [(query, [])]
+
+    while True:
+        expr_query, args = stack[-1]
+
+        if len(args) < len(expr_query) - 1:
+            arg_query = expr_query[len(args) + 1]
+            if isinstance(arg_query, list):
+                _validate_expression_query(arg_query)
+                stack.append((arg_query, []))
+            else:
+                args.append(_convert_literal(arg_query))
+            continue
+
+        stack.pop()
 
         try:
-            return Expression(query[0], tuple(convert_query_to_ast(q) for q in query[1:]))
+            expr = Expression(expr_query[0], args)
         except AssertionError:
-            raise SyntaxError(f"Invalid number of arguments for function {query[0]}: {len(query[1:])}")
+            raise SyntaxError(f"Invalid number of arguments for function {expr_query[0]}: {len(expr_query[1:])}")
+
+        if not stack:
+            return expr
+
+        stack[-1][1].append(expr)
+
+
+def _validate_expression_query(query: list) -> None:
+    if len(query) == 0 or not isinstance(query[0], str) or query[0] not in VALID_FUNCTIONS:
+        raise SyntaxError(f"Invalid expression: {query}")
+
+    if query[0] == FUNCTION_RESOLVE and any(isinstance(q, list) for q in query[1:]):
+        raise TypeError(f"Invalid {FUNCTION_RESOLVE} expression (arguments must be literals): {query}")
+
 
-    elif any(isinstance(query, t) for t in literal_types):
+def _convert_literal(query: Query) -> Literal:
+    if any(isinstance(query, t) for t in literal_types):
         return Literal(query)
 
     raise ValueError(f"Invalid literal: {query}")
 
 
-def simplify_nots(ast: AST) -> AST:
-    # not (not a) => a
+def _fold_ast[T](
+    ast: AST,
+    fold_literal: Callable[[Literal], T],
+    fold_expression: Callable[[AST, list[T]], T],
+    rewrite: Callable[[AST], AST] | None = None,
+) -> T:
+    """
+    Folds an AST bottom-up using an explicit stack rather than recursion, so that arbitrarily deep ASTs can be processed.
+    :param ast: The AST to fold.
+    :param fold_literal: A function computing the result for a literal.
+    :param fold_expression: A function computing the result for an expression, given the results for its arguments.
+    :param rewrite: An optional function applied to each node before it is folded (and before its arguments are.)
+    :return: The result of the fold for the root of the AST.
+    """
+
+    if rewrite is not None:
+        ast = rewrite(ast)
 
     if ast.type == "l":
+        return fold_literal(ast)  # type: ignore
+
+    stack: list[tuple[AST, list[T]]] = [(ast, [])]
+
+    while True:
+        expr, folded_args = stack[-1]
+
+        if len(folded_args) < len(expr.args):
+            arg = expr.args[len(folded_args)]
+            if rewrite is not None:
+                arg = rewrite(arg)
+            if arg.type == "l":
+                folded_args.append(fold_literal(arg))  # type: ignore
+            else:
+                stack.append((arg, []))
+            continue
+
+        stack.pop()
+        res = fold_expression(expr, folded_args)
+
+        if not stack:
+            return res
+
+        stack[-1][1].append(res)
+
+
+def _identity_literal(lit: Literal) -> AST:
+    return lit
+
+
+def _rebuild_expression(expr: AST, args: list[AST]) -> AST:
+    return Expression(expr.fn, args)
+
+
+def _simplify_double_nots(ast: AST) -> AST:
+    # not (not a) => a
+    while ast.type == "e" and ast.fn == FUNCTION_NOT and ast.args[0].type == "e" and ast.args[0].fn == FUNCTION_NOT:
+        ast = ast.args[0].args[0]
+    return ast
+
+
+def _flatten_boolean_expression(ast: AST, simplify_double_nots: bool = False) -> AST:
+    # (and e1 (and e2 e3)) => (and e1 e2 e3), and similarly for #or
+    # Applied top-down, so that each chain of nested expressions is only traversed once.
+
+    if simplify_double_nots:
+        ast = _simplify_double_nots(ast)
+
+    if ast.type != "e" or ast.fn not in (FUNCTION_AND, FUNCTION_OR):
         return ast
 
-    if ast.fn == FUNCTION_NOT and ast.args[0].type == "e" and ast.args[0].fn == FUNCTION_NOT:
-        return simplify_nots(ast.args[0].args[0])
+    terms: list[AST] = []
+    stack: list[AST] = list(reversed(ast.args))
+
+    while stack:
+        a = stack.pop()
+        if simplify_double_nots:
+            a = _simplify_double_nots(a)
+        if a.type == "e" and a.fn == ast.fn:
+            stack.extend(reversed(a.args))
+        else:
+            terms.append(a)
+
+    return Expression(ast.fn, terms)
+
+
+def _preprocess_expression(ast: AST) -> AST:
+    return _flatten_boolean_expression(ast, simplify_double_nots=True)
 
-    return Expression(fn=ast.fn, args=[simplify_nots(a) for a in ast.args])
+
+def simplify_nots(ast: AST) -> AST:
+    # not (not a) => a
+    return _fold_ast(ast, _identity_literal, _rebuild_expression, rewrite=_simplify_double_nots)
+
+
+def flatten_boolean_expressions(ast: AST) -> AST:
+    """
+    Flattens nested #and / #or expressions into single expressions with many arguments, e.g. the right-deep chains
+    produced by and_asts_to_ast(...) in older versions, or by query builders. Evaluating a flattened expression does not
+    recurse once per term, so very long chains of terms are evaluated faster and without hitting recursion limits.
+    :param ast: The AST to flatten.
+    :return: An equivalent AST, with nested #and / #or expressions flattened.
+    """
+    return _fold_ast(ast, _identity_literal, _rebuild_expression, rewrite=_flatten_boolean_expression)
 
 
 def convert_query_to_ast_and_preprocess(query: Query) -> AST:
     ast = convert_query_to_ast(query)
-    return simplify_nots(ast)
+    return _fold_ast(ast, _identity_literal, _rebuild_expression, rewrite=_preprocess_expression)
+
+
+def ast_to_query(ast: AST) -> Query:
+    """
+    Converts an AST back into the nested list form of a query; the inverse of convert_query_to_ast(...).
+    :param ast: The AST to convert.
+    :return: The query, as nested lists and literal values.
+    """
+    return _fold_ast(ast, lambda lit: lit.value, lambda expr, args: [expr.fn, *args])
+
+
+# Functions for which argument order and repetition don't change the result.
+#  - #list only appears as the right-hand side of #in, where it is treated as a set.
+COMMUTATIVE_FUNCTIONS = frozenset({FUNCTION_AND, FUNCTION_OR, FUNCTION_LIST})
+
+
+def _canonical_sort_key(ast: AST) -> str:
+    # JSON distinguishes literal types which compare equal in Python (e.g. 1, 1.0, and true.)
+    return json.dumps(ast_to_query(ast))
+
+
+def _canonical_expression(expr: AST, args: list[AST]) -> AST:
+    if expr.fn not in COMMUTATIVE_FUNCTIONS:
+        return Expression(expr.fn, args)
+
+    # Arguments are already canonical, so nested terms only need to be flattened by one level. Terms are then
+    # de-duplicated and sorted by their canonical JSON representation.
+    terms = {
+        _canonical_sort_key(a): a
+        for arg in args
+        for a in (arg.args if arg.type == "e" and arg.fn == expr.fn else (arg,))
+    }
+    sorted_terms = tuple(terms[k] for k in sorted(terms))
+
+    if len(sorted_terms) == 1 and expr.fn != FUNCTION_LIST:
+        return sorted_terms[0]
+
+    return Expression(expr.fn, sorted_terms)
+
+
+def canonicalize(ast: AST) -> AST:
+    """
+    Converts an AST into a canonical form, such that equivalent queries which differ only in the nesting, order, or
+    repetition of #and / #or terms (or #list items), or in double negation, are converted into the same AST. The
+    canonical AST is equivalent to the original, and can be used (or hashed) as a cache key.
+    :param ast: The AST to canonicalize.
+    :return: The canonical form of the AST.
+    """
+    return _fold_ast(ast, _identity_literal, _canonical_expression, rewrite=_preprocess_expression)
 
 
 def ast_to_and_asts(ast: AST) -> tuple[AST, ...]:
@@ -293,29 +542,67 @@ def ast_to_and_asts(ast: AST) -> tuple[AST, ...]:
     # (and (and e1 e2) e3) => <e1, e2, e3>
     # (and e1 (and e2 e3)) => <e1, e2, e3>
     # (and (and e1 e2) (and e3 e4)) => <e1, e2, e3, e4>
+    # (and e1 e2 e3) => <e1, e2, e3>
     # etc.
 
-    if ast.type != "e" or ast.fn != FUNCTION_AND:
-        return (ast,)
+    asts: list[AST] = []
+    stack: list[AST] = [ast]
 
-    return *ast_to_and_asts(ast.args[0]), *ast_to_and_asts(ast.args[1])
-
-
-def _and_asts_to_ast_rec(asts: tuple[AST, ...]) -> AST:
-    if len(asts) == 1:  # Base case
-        return asts[0]
+    while stack:
+        a = stack.pop()
+        if a.type == "e" and a.fn == FUNCTION_AND:
+            stack.extend(reversed(a.args))
+        else:
+            asts.append(a)
 
-    return Expression(FUNCTION_AND, [asts[0], _and_asts_to_ast_rec(asts[1:])])
+    return tuple(asts)
 
 
 def and_asts_to_ast(asts: tuple[AST, ...]) -> AST | None:
     # ()               => None
-    # (e1, e2, e3, e4) => (and e1 (and e2 (and e3 e4)))
+    # (e1,)            => e1
+    # (e1, e2, e3, e4) => (and e1 e2 e3 e4)
 
     if len(asts) == 0:
         return None
 
-    return _and_asts_to_ast_rec(asts)
+    if len(asts) == 1:
+        return asts[0]
+
+    return Expression(FUNCTION_AND, asts)
+
+
+def independent_components(arg_groups: Sequence[Iterable[Hashable]]) -> list[list[int]]:
+    """
+    Partitions the arguments of an expression into components which do not share any groups (e.g., top-level arrays
+    accessed by the argument), such that arguments sharing a group are in the same component.
+    :param arg_groups: The groups of each argument
+    :return: A list of lists of argument indices, ordered by each component's first argument
+    """
+
+    # Union-find over argument indices, where each component's root is its first argument; this keeps partitioning
+    # linear in the number of arguments, even for very long (flattened) #and / #or expressions.
+    roots: list[int] = list(range(len(arg_groups)))
+    group_args: dict[Hashable, int] = {}
+
+    def _find(i: int) -> int:
+        while roots[i] != i:
+            roots[i] = roots[roots[i]]
+            i = roots[i]
+        return i
+
+    for i, groups in enumerate(arg_groups):
+        for g in groups:
+            if (j := group_args.setdefault(g, i)) != i:
+                ri, rj = _find(i), _find(j)
+                roots[max(ri, rj)] = min(ri, rj)
+
+    # Roots are visited in ascending order of first argument, and indices are appended in ascending order.
+    components: dict[int, list[int]] = {}
+    for i in range(len(arg_groups)):
+        components.setdefault(_find(i), []).append(i)
+
+    return list(components.values())
 
 
 def check_operation_permissions(
@@ -351,3 +638,56 @@ def check_operation_permissions(
     ):
         # TODO: Custom exception?
         raise ValueError(f"Schema forbids using function: {ast.fn}\nAST: {ast}\nSchema: \n{schema}")
+
+
+# Caching of permission checks
+#  Checking a query's permissions resolves the search properties of each #resolve path against the schema. Successful
+#  checks are cached, keyed by the query, the schema's identity, the internal flag and the search property getter, so
+#  that repeated identical queries (e.g. from the same endpoint) skip walking the schema entirely. Schemas are assumed
+#  not to be mutated once they are used for searching. Failed checks are not cached.
+
+PERMISSION_CACHE_SIZE = 1024
+
+_permission_cache: OrderedDict[tuple[AST, int, bool, Callable], JSONSchema] = OrderedDict()
+_permission_cache_lock = threading.Lock()
+
+
+def check_query_permissions(
+    ast: AST,
+    schema: JSONSchema,
+    search_getter: Callable[[tuple[Literal, ...], dict], dict],
+    internal: bool = False,
+) -> None:
+    """
+    Checks the operation permissions of every expression in a query (see check_operation_permissions), caching
+    successful checks so that repeated identical queries against the same schema are only checked once.
+    :param ast: The query to check.
+    :param schema: The JSON schema being queried; cached checks are tied to this schema object.
+    :param search_getter: A function resolving a path into its search properties; should not be created per call.
+    :param internal: Whether internal-only fields are allowed to be resolved.
+    """
+
+    if ast.type == "l":
+        return
+
+    key = (ast, id(schema), internal, search_getter)
+
+    with _permission_cache_lock:
+        # The cache holds a reference to each schema, so a schema's ID cannot be re-used while its entries exist.
+        if _permission_cache.get(key) is schema:
+            _permission_cache.move_to_end(key)
+            return
+
+    # Check each expression in pre-order (the same order as a recursive check), without recursion.
+    stack: list[AST] = [ast]
+    while stack:
+        e = stack.pop()
+        check_operation_permissions(e, schema, search_getter, internal)
+        if e.type == "e" and e.fn != FUNCTION_RESOLVE:
+            stack.extend(a for a in reversed(e.args) if a.type == "e")
+
+    with _permission_cache_lock:
+        _permission_cache[key] = schema
+        _permission_cache.move_to_end(key)
+        if len(_permission_cache) > PERMISSION_CACHE_SIZE:
+            _permission_cache.popitem(last=False)
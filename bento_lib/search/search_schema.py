@@ -0,0 +1,131 @@
+import threading
+from collections import OrderedDict
+
+from . import queries as q
+from ._types import JSONSchema
+
+__all__ = [
+    "SCHEMA_CACHE_SIZE",
+    "SchemaPath",
+    "SearchSchemaPath",
+    "CompiledSearchSchema",
+    "get_compiled_search_schema",
+]
+
+# Compiled search schemas
+#  Resolving a query path otherwise walks the nested JSON schema (properties / items / search.database) one level at a
+#  time, every time the path is resolved. A compiled search schema walks the whole schema once, and maps every
+#  resolvable path to the information the search backends need, so that looking up a path is a single dictionary
+#  lookup. Only valid paths are in the table; for other paths, backends walk the schema in order to raise their usual
+#  errors.
+
+# A resolve path, not including the root, e.g. ("biosamples", "[item]", "id")
+type SchemaPath = tuple[q.LiteralValue, ...]
+
+SCHEMA_CACHE_SIZE = 128
+
+
+class SearchSchemaPath:
+    """
+    Information about a single resolvable path in a search schema.
+    """
+
+    def __init__(self, path: SchemaPath, schema: JSONSchema, array_paths: tuple[str, ...]):
+        """
+        :param path: The resolve path, not including the root.
+        :param schema: The sub-schema at the end of the path.
+        :param array_paths: The string paths (e.g. "_root.biosamples") of each array whose items are accessed along the
+                            path, in order; these are the keys of index combinations.
+        """
+
+        self.path: SchemaPath = path
+        self.schema: JSONSchema = schema
+        self.array_paths: tuple[str, ...] = array_paths
+
+        self.search_properties: dict = schema.get("search", {})
+        self.queryable: str = self.search_properties.get("queryable", "none")
+        self.operations: frozenset[str] = frozenset(self.search_properties.get("operations", ()))
+
+        # Postgres mapping information for the schema node: a relation, if the node is stored in its own table, and the
+        # column (or JSON field) the node is stored in, defaulting to the node's property name.
+        self.database_properties: dict = self.search_properties.get("database", {})
+        self.relation: str | None = self.database_properties.get("relation")
+        self.field: str | None = self.database_properties.get("field", str(path[-1]) if path else None)
+
+    def __repr__(self):  # pragma: no cover
+        return f"<SearchSchemaPath {self.path}>"
+
+
+class CompiledSearchSchema:
+    """
+    A table of every resolvable path in a search schema, built in a single pass over the schema. Instances should be
+    obtained via get_compiled_search_schema(...), which caches them.
+    """
+
+    def __init__(self, schema: JSONSchema):
+        self.schema: JSONSchema = schema
+        self.paths: dict[SchemaPath, SearchSchemaPath] = {}
+        # Paths are also indexed by tuples of literals, i.e. #resolve arguments, so that lookups don't need to build a
+        # new key. Literals are interned, so comparing a query's path to a key is a series of identity checks.
+        self._paths_by_resolve: dict[tuple[q.Literal, ...], SearchSchemaPath] = {}
+        # Data derived from the schema by search backends (e.g. Postgres join tables for each resolve path), keyed by
+        # backend-specific names. Derived data lives as long as the compiled schema, and must only depend on the schema.
+        self.derived: dict[str, dict] = {}
+
+        # Walk the schema with an explicit stack, adding paths in pre-order (i.e., in the order properties are defined.)
+        stack: list[tuple[SchemaPath, JSONSchema, str, tuple[str, ...]]] = [((), schema, "_root", ())]
+
+        while stack:
+            path, sub_schema, path_str, array_paths = stack.pop()
+            self.paths[path] = self._paths_by_resolve[tuple(map(q.Literal, path))] = SearchSchemaPath(
+                path, sub_schema, array_paths
+            )
+
+            if sub_schema.get("type") == "object":
+                stack.extend(
+                    ((*path, k), s, f"{path_str}.{k}", array_paths)
+                    for k, s in reversed(sub_schema.get("properties", {}).items())
+                    if isinstance(s, dict)
+                )
+            elif sub_schema.get("type") == "array" and isinstance(sub_schema.get("items"), dict):
+                stack.append(((*path, "[item]"), sub_schema["items"], f"{path_str}.[item]", (*array_paths, path_str)))
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def get(self, resolve: tuple[q.Literal, ...]) -> SearchSchemaPath | None:
+        """
+        Looks up the information for a resolve path.
+        :param resolve: The arguments of a #resolve expression.
+        :return: The path's information, or None if the path cannot be resolved against the schema.
+        """
+        return self._paths_by_resolve.get(resolve)
+
+
+_compiled_schemas_lock = threading.Lock()
+_compiled_schemas: OrderedDict[int, tuple[JSONSchema, CompiledSearchSchema]] = OrderedDict()
+
+
+def get_compiled_search_schema(schema: JSONSchema) -> CompiledSearchSchema:
+    """
+    Returns a cached compiled search schema for a JSON schema, creating one if needed. Compiled schemas are looked up by
+    schema object identity; schemas are assumed to not be mutated after they are first used for searching.
+    :param schema: The JSON schema to get a compiled search schema for.
+    :return: The (possibly shared) compiled search schema.
+    """
+
+    # This is called for every path lookup, so hits don't take the lock (or update recency): reading a dictionary is
+    # atomic, and the cache holds a reference to each schema, so the ID of a cached schema object cannot be re-used.
+    # Eviction is therefore in insertion order.
+    if (entry := _compiled_schemas.get(id(schema))) is not None and entry[0] is schema:
+        return entry[1]
+
+    # Build outside the lock; if two threads race to build the same table, either result is fine to cache.
+    compiled = CompiledSearchSchema(schema)
+
+    with _compiled_schemas_lock:
+        _compiled_schemas[id(schema)] = (schema, compiled)
+        if len(_compiled_schemas) > SCHEMA_CACHE_SIZE:
+            _compiled_schemas.popitem(last=False)
+
+    return compiled
@@ -1 +1,8 @@
-CREATE TABLE IF NOT EXISTS test_table (id SERIAL PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS test_table (id SERIAL PRIMARY KEY, name TEXT, tags JSONB[] NOT NULL DEFAULT '{}');
+CREATE TABLE IF NOT EXISTS test_ref (id SERIAL PRIMARY KEY, code TEXT);
+CREATE TABLE IF NOT EXISTS test_table_item (
+    id SERIAL PRIMARY KEY,
+    test_table_id INTEGER NOT NULL,
+    ref_id INTEGER,
+    code TEXT
+);
@@ -7,6 +7,7 @@ import pytest
 import pytest_asyncio
 
 from bento_lib.db.pg_async import PgAsyncDatabase, PgAsyncDatabaseException
+from bento_lib.search.postgres import SearchAggregate, SearchPage
 
 TEST_SCHEMA = pathlib.Path(__file__).parent / "data" / "test.sql"
 
@@ -33,7 +34,7 @@ async def db_cleanup(pg_async_db: PgAsyncDatabase):
     yield
     conn: asyncpg.Connection
     async with pg_async_db.connect() as conn:
-        await conn.execute("DROP TABLE IF EXISTS test_table")
+        await conn.execute("DROP TABLE IF EXISTS test_table, test_table_item, test_ref")
     await pg_async_db.close()
 
 
@@ -42,7 +43,7 @@ async def db_cleanup_no_init(pg_async_db_no_init: PgAsyncDatabase):
     yield
     conn: asyncpg.Connection
     async with pg_async_db_no_init.connect() as conn:
-        await conn.execute("DROP TABLE IF EXISTS test_table")
+        await conn.execute("DROP TABLE IF EXISTS test_table, test_table_item, test_ref")
     await pg_async_db_no_init.close()
 
 
@@ -144,3 +145,183 @@ async def test_pg_async_db_parallel_exc_close_then_connect(pg_async_db: PgAsyncD
 
     await asyncio.gather(pg_async_db.close(), _c())
     assert pg_async_db._pool is not None
+
+
+TEST_SEARCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "id": {
+            "type": "integer",
+            "search": {"operations": ["eq", "in"], "queryable": "all"},
+        },
+    },
+    "search": {"database": {"relation": "test_table", "primary_key": "id"}},
+}
+
+
+# noinspection PyUnusedLocal
+@pytest.mark.asyncio
+async def test_pg_async_db_search(pg_async_db: PgAsyncDatabase, db_cleanup):
+    conn: asyncpg.Connection
+    async with pg_async_db.connect() as conn:
+        await conn.execute("INSERT INTO test_table (id) VALUES (1), (2), (3)")
+
+    res = await pg_async_db.search(["#in", ["#resolve", "id"], ["#list", 1, 3]], TEST_SEARCH_SCHEMA)
+    assert sorted(r["id"] for r in res) == [1, 3]
+
+    res = await pg_async_db.search(["#eq", ["#resolve", "id"], 2], TEST_SEARCH_SCHEMA)
+    assert [r["id"] for r in res] == [2]
+
+    query = ["#eq", ["#resolve", "id"], ["#resolve", "id"]]
+    streamed = [r["id"] async for r in pg_async_db.stream_search(query, TEST_SEARCH_SCHEMA, prefetch=1)]
+    assert sorted(streamed) == [1, 2, 3]
+
+    res = await pg_async_db.search(query, TEST_SEARCH_SCHEMA, aggregate=SearchAggregate())
+    assert [r["count"] for r in res] == [3]
+
+    res = await pg_async_db.search(query, TEST_SEARCH_SCHEMA, aggregate=SearchAggregate([("id",)]))
+    assert sorted((r["group_0"], r["grouping"], r["count"]) for r in res if r["grouping"] == 0) == [
+        (1, 0, 1),
+        (2, 0, 1),
+        (3, 0, 1),
+    ]
+    assert [r["count"] for r in res if r["grouping"] == 1] == [3]
+
+    res = await pg_async_db.search(query, TEST_SEARCH_SCHEMA, page=SearchPage(2, after=1))
+    assert [r["id"] for r in res] == [2, 3]
+
+    batches = [[r["id"] for r in b] async for b in pg_async_db.stream_search_batches(query, TEST_SEARCH_SCHEMA, 2)]
+    assert sorted(i for b in batches for i in b) == [1, 2, 3]
+    assert [len(b) for b in batches] == [2, 1]
+
+    pages = [[r["id"] for r in p] async for p in pg_async_db.search_pages(query, TEST_SEARCH_SCHEMA, 2)]
+    assert pages == [[1, 2], [3]]
+
+
+TEST_SEARCH_EQ = {"operations": ["eq"], "queryable": "all"}
+TEST_SEARCH_ARRAYS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "id": {"type": "integer", "search": TEST_SEARCH_EQ},
+        "name": {"type": "string", "search": TEST_SEARCH_EQ},
+        "tags": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"v": {"type": "string", "search": TEST_SEARCH_EQ}},
+                "search": {"database": {"type": "jsonb"}},
+            },
+            "search": {"database": {"type": "array"}},
+        },
+        "items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "code": {"type": "string", "search": TEST_SEARCH_EQ},
+                    "ref": {
+                        "type": "object",
+                        "properties": {"code": {"type": "string", "search": TEST_SEARCH_EQ}},
+                        "search": {
+                            "database": {
+                                "relation": "test_ref",
+                                "primary_key": "id",
+                                "relationship": {"type": "MANY_TO_ONE", "foreign_key": "ref_id"},
+                            }
+                        },
+                    },
+                },
+                "search": {
+                    "database": {
+                        "relation": "test_table_item",
+                        "primary_key": "id",
+                        "relationship": {"type": "MANY_TO_ONE", "foreign_key": "id"},
+                    }
+                },
+            },
+            "search": {
+                "database": {
+                    "relation": "test_table_item",
+                    "relationship": {
+                        "type": "ONE_TO_MANY",
+                        "parent_foreign_key": "test_table_id",
+                        "parent_primary_key": "id",
+                    },
+                }
+            },
+        },
+    },
+    "search": {"database": {"relation": "test_table", "primary_key": "id"}},
+}
+
+TEST_NAME = ["#resolve", "name"]
+TEST_TAG = ["#resolve", "tags", "[item]", "v"]
+TEST_ITEM_CODE = ["#resolve", "items", "[item]", "code"]
+TEST_ITEM_REF_CODE = ["#resolve", "items", "[item]", "ref", "code"]
+
+
+async def _insert_search_arrays_data(pg_async_db: PgAsyncDatabase):
+    conn: asyncpg.Connection
+    async with pg_async_db.connect() as conn:
+        await conn.execute(
+            "INSERT INTO test_table (id, name, tags) VALUES (1, 'a', '{}'), (2, 'a', ARRAY['{\"v\": \"x\"}'::jsonb]), "
+            "(3, 'b', ARRAY['{\"v\": \"x\"}'::jsonb, '{\"v\": \"y\"}'::jsonb]), (4, 'c', '{}')"
+        )
+        await conn.execute("INSERT INTO test_ref (id, code) VALUES (1, 'r')")
+        await conn.execute(
+            "INSERT INTO test_table_item (test_table_id, ref_id, code) VALUES (2, NULL, 'c'), (3, 1, 'd'), (4, NULL, 'c')"
+        )
+
+
+# noinspection PyUnusedLocal
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "query,expected",
+    [
+        # Rows with empty arrays have no joined rows to match, even when other terms match
+        (["#or", ["#eq", TEST_NAME, "a"], ["#eq", TEST_TAG, "y"]], [2, 3]),
+        (["#or", ["#eq", TEST_TAG, "y"], ["#eq", TEST_ITEM_CODE, "c"]], [2, 3]),
+        (["#and", ["#eq", TEST_NAME, "a"], ["#or", ["#eq", TEST_TAG, "x"], ["#eq", TEST_ITEM_CODE, "c"]]], [2]),
+        # Rows without a related row or without items (left-joined) still have a row of NULLs to match
+        (["#or", ["#eq", TEST_ITEM_CODE, "c"], ["#eq", TEST_ITEM_REF_CODE, "r"]], [2, 3, 4]),
+        (["#not", ["#and", ["#eq", TEST_ITEM_CODE, "c"], ["#eq", TEST_NAME, "b"]]], [1, 2, 3, 4]),
+        (["#or", ["#eq", TEST_NAME, "b"], ["#not", ["#eq", TEST_ITEM_CODE, "zz"]]], [2, 3, 4]),
+    ],
+)
+async def test_pg_async_db_search_exists_subqueries(pg_async_db: PgAsyncDatabase, db_cleanup, query, expected):
+    await _insert_search_arrays_data(pg_async_db)
+
+    # EXISTS subqueries match the same rows as joins, but without duplicates
+    res = await pg_async_db.search(query, TEST_SEARCH_ARRAYS_SCHEMA)
+    assert sorted({r["id"] for r in res}) == expected
+    res = await pg_async_db.search(query, TEST_SEARCH_ARRAYS_SCHEMA, exists_subqueries=True)
+    assert sorted(r["id"] for r in res) == expected
+
+
+# noinspection PyUnusedLocal
+@pytest.mark.asyncio
+@pytest.mark.parametrize("exists_subqueries", [False, True])
+async def test_pg_async_db_search_aggregate_arrays(pg_async_db: PgAsyncDatabase, db_cleanup, exists_subqueries):
+    await _insert_search_arrays_data(pg_async_db)
+
+    # Breaking counts down by array fields doesn't drop rows with empty arrays from the total or other breakdowns
+    query = ["#eq", TEST_NAME, "a"]
+    aggregate = SearchAggregate([("name",), ("tags", "[item]", "v"), ("items", "[item]", "code")])
+    res = await pg_async_db.search(
+        query, TEST_SEARCH_ARRAYS_SCHEMA, exists_subqueries=exists_subqueries, aggregate=aggregate
+    )
+    counts = {(r["grouping"], r["group_0"], r["group_1"], r["group_2"]): r["count"] for r in res}
+    assert counts == {
+        (7, None, None, None): 2,  # Total
+        (3, "a", None, None): 2,
+        (5, None, "x", None): 1,
+        (5, None, None, None): 1,  # Row 1 has no tags
+        (6, None, None, "c"): 1,
+        (6, None, None, None): 1,  # Row 1 has no items
+    }
+
+    # Arrays accessed by the query still only count rows with matching items
+    res = await pg_async_db.search(
+        ["#eq", TEST_TAG, "x"], TEST_SEARCH_ARRAYS_SCHEMA, exists_subqueries=exists_subqueries, aggregate=aggregate
+    )
+    assert [r["count"] for r in res if r["grouping"] == 7] == [2]
@@ -1,9 +1,27 @@
+import json
+import pickle
+from copy import deepcopy
 from datetime import UTC, datetime
 
+import jsonschema
 import psycopg2.sql
 from pytest import mark, raises
 
-from bento_lib.search import build_search_response, data_structure, operations, postgres, queries
+from bento_lib.search import (
+    _validation,
+    build_search_response,
+    cache,
+    columnar,
+    data_structure,
+    indexing,
+    ndjson,
+    operations,
+    optimizer,
+    parallel,
+    postgres,
+    queries,
+    search_schema,
+)
 
 NUMBER_SEARCH = {
     "operations": [
@@ -639,6 +657,17 @@ TEST_QUERIES = [
         "ds": (False, True, 2, 2),  # Accessing 2 biosamples, each with 1 test_postgres_array item
         "ps": (False, ("a",)),
     },
+    # n-ary #and / #or
+    {
+        "query": ["#and", TEST_QUERY_1, TEST_QUERY_2, ["#eq", ["#resolve", "subject", "sex"], "MALE"]],
+        "ds": (False, True, 2, 1),
+        "ps": (False, ("XO", "%TE%", "MALE")),
+    },
+    {
+        "query": ["#or", False, ["#eq", ["#resolve", "subject", "sex"], "FEMALE"], TEST_QUERY_2],
+        "ds": (False, True, 2, 1),
+        "ps": (False, (False, "FEMALE", "%TE%")),
+    },
 ]
 
 TEST_LARGE_QUERY_1 = [
@@ -745,6 +774,17 @@ TEST_DATA_2 = {
     "data_type_2": [{"id": "test2", "children": [{"id": f"child{i}", "prop": f"prop{i}"} for i in range(999, -1, -1)]}],
 }
 
+TEST_DATA_1_VARIANT_1 = deepcopy(TEST_DATA_1)
+TEST_DATA_1_VARIANT_1["subject"]["karyotypic_sex"] = "XX"
+TEST_DATA_1_VARIANT_1["biosamples"][0]["tumor_grade"] = []
+TEST_DATA_1_VARIANT_1["test_op_1"] = []
+
+TEST_DATA_1_VARIANT_2 = deepcopy(TEST_DATA_1)
+TEST_DATA_1_VARIANT_2["biosamples"] = []
+TEST_DATA_1_VARIANT_2["test_op_3"] = [[10]]
+
+TEST_DATA_BATCH = (TEST_DATA_1, TEST_DATA_1_VARIANT_1, TEST_DATA_1_VARIANT_2, TEST_DATA_1)
+
 INVALID_DATA = [{True, False}]
 
 # Expression, Internal, Result, Index Combination
@@ -899,6 +939,79 @@ def test_queries_and_ast():
         ) == queries.convert_query_to_ast_and_preprocess(a)
 
 
+def test_queries_independent_components():
+    assert queries.independent_components([]) == []
+    assert queries.independent_components([(), ("a",), ("b",), ("b", "c"), ("a", "c"), ()]) == [[0], [1, 2, 3, 4], [5]]
+    assert queries.independent_components([("a",), ("b",), ("a",)]) == [[0, 2], [1]]
+
+
+def test_expression_hashing():
+    assert hash(queries.convert_query_to_ast(TEST_QUERY_3)) == hash(queries.convert_query_to_ast(TEST_QUERY_3))
+    assert len({queries.convert_query_to_ast(TEST_QUERY_1), queries.convert_query_to_ast(TEST_QUERY_1)}) == 1
+    assert queries.convert_query_to_ast(["#list", 1, 2]) != queries.convert_query_to_ast(["#list", 1])
+
+
+def test_ast_nodes():
+    ast = queries.convert_query_to_ast(TEST_QUERY_2)
+
+    # Nodes are slotted and immutable
+    assert not hasattr(ast, "__dict__")
+    assert not hasattr(ast.args[1], "__dict__")
+    with raises(AttributeError):
+        ast.fn = queries.FUNCTION_NOT
+    with raises(AttributeError):
+        ast.args[1].value = "XO"
+    with raises(AttributeError):
+        del ast.args
+
+    # Literals are interned, but literals of different types are kept distinct
+    assert queries.convert_query_to_ast(TEST_QUERY_2).args[0].args[1] is ast.args[0].args[1]
+    assert queries.Literal("[item]") is queries.Literal("[item]")
+    assert queries.Literal(1) == queries.Literal(True)
+    assert queries.Literal(1) is not queries.Literal(True)
+    assert queries.Literal(True).value is True
+
+    # Nodes survive pickling and copying
+    assert pickle.loads(pickle.dumps(ast)) == ast
+    assert deepcopy(ast) == ast
+    assert hash(deepcopy(ast)) == hash(ast)
+
+
+TEST_CANONICAL_QUERIES = (
+    (["#and", TEST_QUERY_1, TEST_QUERY_2], ["#and", TEST_QUERY_2, TEST_QUERY_1]),
+    (["#and", TEST_QUERY_3, TEST_QUERY_1], ["#and", TEST_QUERY_2, TEST_QUERY_1]),  # Duplicate terms
+    (["#and", ["#and", True, TEST_QUERY_1], TEST_QUERY_2], ["#and", TEST_QUERY_2, ["#and", TEST_QUERY_1, True]]),
+    (["#or", TEST_QUERY_1, ["#not", ["#not", TEST_QUERY_1]]], TEST_QUERY_1),
+    (
+        ["#in", ["#resolve", "subject", "sex"], ["#list", "MALE", "FEMALE", "MALE"]],
+        ["#in", ["#resolve", "subject", "sex"], ["#list", "FEMALE", "MALE"]],
+    ),
+)
+
+
+@mark.parametrize("a, b", TEST_CANONICAL_QUERIES)
+def test_query_canonicalization(a, b):
+    ca = queries.canonicalize(queries.convert_query_to_ast(a))
+    cb = queries.canonicalize(queries.convert_query_to_ast(b))
+    assert ca == cb
+    assert hash(ca) == hash(cb)
+    assert queries.canonicalize(ca) == ca
+    assert queries.convert_query_to_ast(queries.ast_to_query(ca)) == ca
+
+
+def test_query_canonicalization_literal_types():
+    # Literals which compare equal in Python, but not in Postgres, should not be merged or considered equal
+    q1 = ["#or", ["#eq", ["#resolve", "test_op_2", "[item]"], 1], ["#eq", ["#resolve", "test_op_2", "[item]"], True]]
+    assert queries.ast_to_query(queries.canonicalize(queries.convert_query_to_ast(q1))) == [
+        "#or",
+        ["#eq", ["#resolve", "test_op_2", "[item]"], 1],
+        ["#eq", ["#resolve", "test_op_2", "[item]"], True],
+    ]
+    assert cache.query_fingerprint(queries.convert_query_to_ast(["#eq", 1, 1])) != cache.query_fingerprint(
+        queries.convert_query_to_ast(["#eq", 1, True])
+    )
+
+
 def test_postgres_schemas():
     null_schema = postgres.json_schema_to_postgres_schema("test", {"type": "integer"}, "json")
     assert null_schema[0] is None and null_schema[1] is None and null_schema[2] is None
@@ -928,6 +1041,30 @@ def test_postgres_collect_resolve_join_tables():
     assert postgres.collect_resolve_join_tables((), {}, None, None) == ()
 
 
+def test_postgres_resolve_join_tables():
+    resolve = queries.convert_query_to_ast(TEST_QUERY_2[1]).args
+    tables = postgres.resolve_join_tables(resolve, TEST_SCHEMA)
+
+    # Join data is memoized per schema and path
+    assert postgres.resolve_join_tables(queries.convert_query_to_ast(TEST_QUERY_2[1]).args, TEST_SCHEMA) is tables
+    assert postgres.resolve_join_tables(resolve, deepcopy(TEST_SCHEMA)) is not tables
+    assert [t.current_alias_str for t in tables] == [
+        t.current_alias_str for t in postgres.collect_resolve_join_tables((postgres.QUERY_ROOT, *resolve), TEST_SCHEMA)
+    ]
+
+    # Joins shared between resolves are only collected once
+    ast = queries.convert_query_to_ast(["#and", TEST_QUERY_2, TEST_QUERY_2, TEST_QUERY_1])
+    aliases = [t.current_alias_str for t in postgres.collect_join_tables(ast, (), TEST_SCHEMA)]
+    assert len(aliases) == len(set(aliases))
+    table_aliases = [t.current_alias_str for t in tables if t.current_alias_str is not None]
+    assert aliases[: len(table_aliases)] == table_aliases
+
+    # Errors are not memoized
+    for _ in range(2):
+        with raises(ValueError):
+            postgres.resolve_join_tables(queries.convert_query_to_ast(["#resolve", "missing"]).args, TEST_SCHEMA)
+
+
 def test_postgres_invalid_schemas():
     with raises(SyntaxError):
         postgres.search_query_to_psycopg2_sql(TEST_EXPR_4, TEST_INVALID_SCHEMA)
@@ -953,6 +1090,7 @@ def test_postgres_valid_queries(query):
 @mark.parametrize("e, i, _v, _ic", DS_VALID_EXPRESSIONS)
 def test_postgres_valid_expressions(e, i, _v, _ic):
     postgres.search_query_to_psycopg2_sql(e, TEST_SCHEMA, i)
+    postgres.search_query_to_psycopg2_sql(e, TEST_SCHEMA, i, exists_subqueries=True)
 
 
 @mark.parametrize("e, i, ex", PG_INVALID_EXPRESSIONS)
@@ -960,6 +1098,477 @@ def test_postgres_invalid_expressions(e, i, ex):
     with raises(ex):
         postgres.search_query_to_psycopg2_sql(e, TEST_SCHEMA, i)
 
+    # Invalid queries are never cached, so they raise every time
+    with raises(ex):
+        postgres.search_query_to_psycopg2_sql(e, TEST_SCHEMA, i)
+
+    with raises(ex):
+        postgres.search_query_to_psycopg2_sql(e, TEST_SCHEMA, i, exists_subqueries=True)
+
+
+@mark.parametrize("query", TEST_QUERIES)
+def test_postgres_exists_subqueries_queries(query):
+    e = query["query"]
+    i, p = query["ps"]
+
+    sql_text, params = postgres.search_query_to_asyncpg_sql(e, TEST_SCHEMA, i, exists_subqueries=True)
+    # Independent components may be re-ordered, and with them their parameters
+    assert sorted(map(repr, params)) == sorted(repr(list(v) if isinstance(v, tuple) else v) for v in p)
+    # Arrays are never joined in the outer query
+    assert "unnest" not in sql_text.split(" WHERE ")[0]
+    assert "array_elements" not in sql_text.split(" WHERE ")[0]
+
+
+def test_postgres_exists_subqueries():
+    q_bs_1 = ["#eq", ["#resolve", "biosamples", "[item]", "tumor_grade", "[item]", "id"], "a"]
+    q_bs_2 = ["#eq", ["#resolve", "biosamples", "[item]", "test_postgres_array", "[item]", "test"], "b"]
+    q_op = ["#eq", ["#resolve", "test_op_3", "[item]", "[item]"], 3]
+
+    sql_text, params = postgres.search_query_to_asyncpg_sql(
+        ["#and", q_bs_1, TEST_QUERY_1, q_op, q_bs_2], TEST_SCHEMA, exists_subqueries=True
+    )
+
+    # Many-to-one relations stay joined in the outer query
+    assert sql_text.startswith(
+        'SELECT "_root".* FROM "patients_phenopacket" AS "_root" LEFT JOIN "patients_individual" AS "_root_subject" ON '
+        '"_root"."subject_id" = "_root_subject"."individual_id" WHERE (EXISTS (SELECT 1 FROM '
+        '"patients_phenopacket_biosamples" AS "_root_biosamples" JOIN "patients_biosample" AS "_root_biosamples_item" '
+        'ON "_root_biosamples"."biosample_id" = "_root_biosamples_item"."biosample_id" JOIN '
+    )
+    # Terms sharing a top-level array share a subquery (correlated to the outer query), and shared relations are only
+    # included once; other arrays get their own subqueries. Relations the subquery's expression is null-rejecting for are
+    # inner-joined, and array functions are cross-joined.
+    assert sql_text.count("EXISTS") == 2
+    assert sql_text.count('AS "_root_biosamples_item"') == 1
+    assert "LEFT JOIN" not in sql_text.split(" WHERE ")[1]
+    assert 'CROSS JOIN unnest("_root_biosamples_item"."test_postgres_array")' in sql_text
+    assert 'WHERE "_root"."phenopacket_id" = "_root_biosamples"."phenopacket_id" AND ' in sql_text
+    assert sql_text.endswith(
+        '(("_root_subject"."karyotypic_sex") = ($3)) AND (EXISTS (SELECT 1 FROM '
+        'jsonb_array_elements("_root"."test_op_3") AS "_root_test_op_3" CROSS JOIN '
+        'jsonb_array_elements("_root_test_op_3") AS "_root_test_op_3_item" WHERE (("_root_test_op_3_item"."[item]") = '
+        "($4))))"
+    )
+    assert params == ["a", "b", "XO", 3]
+
+    # Relations the expression isn't null-rejecting for are left-joined, as they are without subqueries: a row without
+    # biosamples still has a (NULL) biosample, for which NOT (... AND ...) can be true.
+    sql_text, _ = postgres.search_query_to_asyncpg_sql(
+        ["#not", ["#and", q_bs_1, TEST_QUERY_1]], TEST_SCHEMA, exists_subqueries=True
+    )
+    assert (
+        'WHERE EXISTS (SELECT 1 FROM (SELECT 1) AS "_exists" LEFT JOIN "patients_phenopacket_biosamples" AS '
+        in sql_text
+    )
+    assert 'ON "_root"."phenopacket_id" = "_root_biosamples"."phenopacket_id" LEFT JOIN ' in sql_text
+
+    # #or components are split in the same way; other expressions accessing arrays are wrapped as a whole. Since rows
+    # with an empty array have no rows to match when it's joined, rows must have items in arrays accessed by optional
+    # components.
+    sql_text, params = postgres.search_query_to_asyncpg_sql(
+        ["#or", ["#not", q_op], TEST_QUERY_1], TEST_SCHEMA, exists_subqueries=True
+    )
+    assert sql_text.endswith(
+        'WHERE EXISTS (SELECT 1 FROM jsonb_array_elements("_root"."test_op_3") AS "_root_test_op_3" CROSS JOIN '
+        'jsonb_array_elements("_root_test_op_3") AS "_root_test_op_3_item") AND ((EXISTS (SELECT 1 FROM '
+        'jsonb_array_elements("_root"."test_op_3") AS "_root_test_op_3" CROSS JOIN '
+        'jsonb_array_elements("_root_test_op_3") AS "_root_test_op_3_item" WHERE (NOT (("_root_test_op_3_item"."[item]") '
+        '= ($1))))) OR (("_root_subject"."karyotypic_sex") = ($2)))'
+    )
+    assert params == [3, "XO"]
+
+    # Queries without arrays compile as usual
+    assert postgres.search_query_to_psycopg2_sql(
+        TEST_QUERY_1, TEST_SCHEMA, exists_subqueries=True
+    ) == postgres.search_ast_to_psycopg2_sql(queries.convert_query_to_ast(TEST_QUERY_1), TEST_SCHEMA)
+
+    # EXISTS subquery SQL is cached separately from join SQL
+    cache = postgres.SQLTemplateCache()
+    sql_joins, _ = cache.search_query_to_psycopg2_sql(TEST_QUERY_2, TEST_SCHEMA)
+    sql_exists, _ = cache.search_query_to_psycopg2_sql(TEST_QUERY_2, TEST_SCHEMA, exists_subqueries=True)
+    assert sql_exists != sql_joins
+    assert cache.search_query_to_psycopg2_sql(TEST_QUERY_2, TEST_SCHEMA, exists_subqueries=True)[0] is sql_exists
+    assert (cache.hits, cache.misses, len(cache)) == (1, 2, 2)
+
+    # Terms re-ordered into EXISTS subqueries have their parameters out of query order, so their SQL isn't cached, even
+    # if the parameters happen to be equal to the query's values in order.
+    def _reordered_query(a, b, c):
+        tg = ["#resolve", "biosamples", "[item]", "tumor_grade", "[item]", "id"]
+        return ["#and", ["#eq", tg, a], ["#eq", ["#resolve", "subject", "karyotypic_sex"], b], ["#eq", tg, c]]
+
+    for fn, expected_params in (
+        (cache.search_query_to_psycopg2_sql, ("A", "C", "B")),
+        (cache.search_query_to_asyncpg_sql, ["A", "C", "B"]),
+        (cache.search_query_to_psycopg3_sql, {"p1": "A", "p2": "C", "p3": "B"}),
+    ):
+        cache.clear()
+        fn(_reordered_query("X", "X", "X"), TEST_SCHEMA, exists_subqueries=True)
+        sql_2, params_2 = fn(_reordered_query("A", "B", "C"), TEST_SCHEMA, exists_subqueries=True)
+        assert params_2 == expected_params
+        assert (sql_2, params_2) == fn(_reordered_query("A", "B", "C"), TEST_SCHEMA, exists_subqueries=True)
+        assert (cache.hits, len(cache)) == (0, 0)
+
+    # Without EXISTS subqueries, the same shape is cached as usual
+    cache.search_query_to_psycopg2_sql(_reordered_query("X", "X", "X"), TEST_SCHEMA)
+    assert cache.search_query_to_psycopg2_sql(_reordered_query("A", "B", "C"), TEST_SCHEMA)[1] == ("A", "B", "C")
+    assert (cache.hits, len(cache)) == (1, 1)
+
+
+def test_postgres_aggregate():
+    count = postgres.SearchAggregate()
+    breakdown = postgres.SearchAggregate([("subject", "sex"), ("biosamples", "[item]", "procedure", "code", "id")])
+    assert count == postgres.SearchAggregate(())
+    assert breakdown == postgres.SearchAggregate(
+        [["subject", "sex"], ["biosamples", "[item]", "procedure", "code", "id"]]
+    )
+    assert hash(breakdown) != hash(count)
+
+    # Counts are of distinct root rows, unless rows are known to be unique
+    sql_text, params = postgres.search_query_to_asyncpg_sql(TEST_QUERY_2, TEST_SCHEMA, aggregate=count)
+    assert sql_text.startswith('SELECT COUNT(DISTINCT "_root"."phenopacket_id") AS "count" FROM "patients_phenopacket"')
+    assert sql_text.endswith(' WHERE "_root_biosamples_item_procedure_code"."id" LIKE $1')
+    assert params == ["%TE%"]
+    sql_text, _ = postgres.search_query_to_asyncpg_sql(
+        TEST_QUERY_2, TEST_SCHEMA, exists_subqueries=True, aggregate=count
+    )
+    assert sql_text.startswith(
+        'SELECT COUNT(*) AS "count" FROM "patients_phenopacket" AS "_root" WHERE EXISTS (SELECT 1 FROM '
+    )
+
+    # Breakdowns have a grouping set per field, plus the total count; fields to group by are always joined
+    for exists_subqueries in (False, True):
+        sql_text, params = postgres.search_query_to_asyncpg_sql(
+            TEST_QUERY_1, TEST_SCHEMA, exists_subqueries=exists_subqueries, aggregate=breakdown
+        )
+        assert sql_text.startswith(
+            'SELECT "_root_subject"."sex" AS "group_0", "_root_biosamples_item_procedure_code"."id" AS "group_1", '
+            'GROUPING("_root_subject"."sex", "_root_biosamples_item_procedure_code"."id") AS "grouping", '
+            'COUNT(DISTINCT "_root"."phenopacket_id") AS "count" FROM "patients_phenopacket" AS "_root" LEFT JOIN '
+        )
+        assert 'LEFT JOIN "patients_ontology" AS "_root_biosamples_item_procedure_code" ON ' in sql_text
+        assert sql_text.endswith(
+            'WHERE ("_root_subject"."karyotypic_sex") = ($1) GROUP BY GROUPING SETS (("_root_subject"."sex"), '
+            '("_root_biosamples_item_procedure_code"."id"), ())'
+        )
+        assert params == ["XO"]
+
+    # Arrays only accessed to group by are left-joined, so that rows with empty arrays are still counted; arrays accessed
+    # by the query are still cross-joined, as they are without grouping.
+    array_breakdown = postgres.SearchAggregate([("test_op_3", "[item]", "[item]")])
+    for exists_subqueries in (False, True):
+        sql_text, _ = postgres.search_query_to_asyncpg_sql(
+            TEST_QUERY_1, TEST_SCHEMA, exists_subqueries=exists_subqueries, aggregate=array_breakdown
+        )
+        assert (
+            'LEFT JOIN LATERAL jsonb_array_elements("_root"."test_op_3") AS "_root_test_op_3" ON true LEFT JOIN LATERAL '
+            'jsonb_array_elements("_root_test_op_3") AS "_root_test_op_3_item" ON true WHERE '
+        ) in sql_text
+    sql_text, _ = postgres.search_query_to_asyncpg_sql(
+        ["#eq", ["#resolve", "test_op_3", "[item]", "[item]"], 3], TEST_SCHEMA, aggregate=array_breakdown
+    )
+    assert (
+        'FROM "patients_phenopacket" AS "_root" CROSS JOIN jsonb_array_elements("_root"."test_op_3") AS "_root_test_op_3" '
+        'CROSS JOIN jsonb_array_elements("_root_test_op_3") AS "_root_test_op_3_item" WHERE '
+    ) in sql_text
+
+    # Fields to group by must be accessible
+    internal_breakdown = postgres.SearchAggregate([("subject", "id")])
+    with raises(ValueError):
+        postgres.search_query_to_psycopg2_sql(TEST_QUERY_1, TEST_SCHEMA, aggregate=internal_breakdown)
+    postgres.search_query_to_psycopg2_sql(TEST_QUERY_1, TEST_SCHEMA, internal=True, aggregate=internal_breakdown)
+    with raises(ValueError):
+        postgres.search_query_to_psycopg2_sql(TEST_QUERY_1, TEST_SCHEMA, aggregate=postgres.SearchAggregate([("x",)]))
+
+    # Distinct rows can only be counted with a primary key
+    schema = deepcopy(TEST_SCHEMA)
+    del schema["search"]["database"]["primary_key"]
+    with raises(SyntaxError):
+        postgres.search_query_to_psycopg2_sql(TEST_QUERY_1, schema, aggregate=count)
+    postgres.search_query_to_psycopg2_sql(TEST_QUERY_1, schema, exists_subqueries=True, aggregate=count)
+
+    # Aggregate SQL is cached per aggregate
+    cache = postgres.SQLTemplateCache()
+    sql_1, _ = cache.search_query_to_psycopg2_sql(TEST_QUERY_1, TEST_SCHEMA, aggregate=breakdown)
+    assert (
+        cache.search_query_to_psycopg2_sql(["#eq", TEST_QUERY_1[1], "XX"], TEST_SCHEMA, aggregate=breakdown)[0] is sql_1
+    )
+    assert cache.search_query_to_psycopg2_sql(TEST_QUERY_1, TEST_SCHEMA, aggregate=count)[0] != sql_1
+    assert cache.search_query_to_psycopg2_sql(TEST_QUERY_1, TEST_SCHEMA)[0] != sql_1
+    assert (cache.hits, cache.misses, len(cache)) == (1, 3, 3)
+
+
+def test_postgres_search_page():
+    first_page = postgres.SearchPage(10)
+    second_page = first_page.next_page("abc")
+    assert (second_page.limit, second_page.after) == (10, "abc")
+    with raises(ValueError):
+        postgres.SearchPage(0)
+
+    # Pages are in primary key order; joined rows are de-duplicated with DISTINCT ON, since the key is ordered on anyway
+    sql_text, params = postgres.search_query_to_asyncpg_sql(TEST_QUERY_2, TEST_SCHEMA, page=first_page)
+    assert sql_text.startswith('SELECT DISTINCT ON ("_root"."phenopacket_id") "_root".* FROM "patients_phenopacket" ')
+    assert sql_text.endswith(
+        'WHERE "_root_biosamples_item_procedure_code"."id" LIKE $1 ORDER BY "_root"."phenopacket_id" LIMIT $2'
+    )
+    assert params == ["%TE%", 10]
+
+    # Later pages seek past the last key of the previous page
+    sql_text, params = postgres.search_query_to_psycopg3_sql(TEST_QUERY_2, TEST_SCHEMA, page=second_page)
+    assert sql_text.endswith(
+        'WHERE ("_root_biosamples_item_procedure_code"."id" LIKE %(p1)s) AND "_root"."phenopacket_id" > %(p2)s '
+        'ORDER BY "_root"."phenopacket_id" LIMIT %(p3)s'
+    )
+    assert params == {"p1": "%TE%", "p2": "abc", "p3": 10}
+    sql_text, params = postgres.search_query_to_asyncpg_sql(
+        TEST_QUERY_2, TEST_SCHEMA, exists_subqueries=True, page=second_page
+    )
+    assert sql_text.startswith('SELECT "_root".* FROM "patients_phenopacket" AS "_root" WHERE (EXISTS (SELECT 1 ')
+    assert sql_text.endswith('AND "_root"."phenopacket_id" > $2 ORDER BY "_root"."phenopacket_id" LIMIT $3')
+    assert params == ["%TE%", "abc", 10]
+
+    # Pagination needs a primary key, and cannot be combined with aggregation
+    schema = deepcopy(TEST_SCHEMA)
+    del schema["search"]["database"]["primary_key"]
+    with raises(SyntaxError):
+        postgres.search_query_to_psycopg2_sql(TEST_QUERY_1, schema, page=first_page)
+    with raises(ValueError):
+        postgres.search_query_to_psycopg2_sql(
+            TEST_QUERY_1, TEST_SCHEMA, aggregate=postgres.SearchAggregate(), page=first_page
+        )
+
+    # Page SQL is re-used for every later page, with the key and page size as parameters
+    cache = postgres.SQLTemplateCache()
+    sql_1, params_1 = cache.search_query_to_asyncpg_sql(TEST_QUERY_2, TEST_SCHEMA, page=second_page)
+    sql_2, params_2 = cache.search_query_to_asyncpg_sql(TEST_QUERY_2, TEST_SCHEMA, page=second_page.next_page("def"))
+    assert sql_2 is sql_1
+    assert (params_1, params_2) == (["%TE%", "abc", 10], ["%TE%", "def", 10])
+    assert cache.search_query_to_asyncpg_sql(TEST_QUERY_2, TEST_SCHEMA, page=first_page)[0] != sql_1
+    assert cache.search_query_to_asyncpg_sql(TEST_QUERY_2, TEST_SCHEMA)[0] != sql_1
+    assert (cache.hits, cache.misses, len(cache)) == (1, 3, 3)
+
+
+def test_postgres_index_recommendations():
+    ddl = postgres.postgres_index_ddl(TEST_SCHEMA)
+    assert ddl[0] == "CREATE EXTENSION IF NOT EXISTS pg_trgm"
+    # Join keys of array / nested object relations, other than primary keys
+    assert postgres.recommend_postgres_indexes(TEST_SCHEMA)[:4] == [
+        postgres.PostgresIndex("patients_phenopacket_biosamples", "phenopacket_id"),
+        postgres.PostgresIndex("patients_phenopacket_biosamples", "biosample_id"),
+        postgres.PostgresIndex("patients_biosample", "procedure_id"),
+        postgres.PostgresIndex("patients_procedure", "code_id"),
+    ]
+    assert ddl[1] == (
+        'CREATE INDEX IF NOT EXISTS "patients_phenopacket_biosamples_phenopacket_id_idx" '
+        'ON "patients_phenopacket_biosamples" USING btree ("phenopacket_id")'
+    )
+    # Pattern matching operations get trigram indexes; comparisons get btree indexes
+    assert (
+        'CREATE INDEX IF NOT EXISTS "patients_ontology_label_trgm_idx" ON "patients_ontology" '
+        'USING gin ("label" gin_trgm_ops)'
+    ) in ddl
+    assert (
+        'CREATE INDEX IF NOT EXISTS "patients_individual_sex_idx" ON "patients_individual" USING btree ("sex")'
+    ) in ddl
+    assert len(ddl) == len(set(ddl)) == 12
+
+    # Internal fields are only included if requested
+    indexes = postgres.recommend_postgres_indexes(TEST_SCHEMA, internal=True)
+    assert postgres.PostgresIndex("patients_individual", "id") in indexes
+    assert postgres.PostgresIndex("patients_individual", "id") not in postgres.recommend_postgres_indexes(TEST_SCHEMA)
+
+    # Fields stored in JSON(B) columns can't be indexed for generated SQL, but JSON(B) indexes can be requested
+    assert not any(i.column in ("taxonomy", "test_op_1") for i in indexes)
+    indexes = postgres.recommend_postgres_indexes(TEST_SCHEMA, json_indexes=True)
+    assert postgres.PostgresIndex("patients_individual", "taxonomy", json_path=("id",)).ddl == (
+        'CREATE INDEX IF NOT EXISTS "patients_individual_taxonomy_id_idx" ON "patients_individual" '
+        "USING btree ((\"taxonomy\" ->> 'id'))"
+    )
+    assert postgres.PostgresIndex("patients_individual", "taxonomy", json_path=("id",)) in indexes
+    assert postgres.PostgresIndex("patients_phenopacket", "test_op_1", "gin", "jsonb_path_ops") in indexes
+
+    # Typed values in nested JSON objects are cast
+    schema = {
+        "type": "object",
+        "properties": {
+            "extra": {
+                "type": "object",
+                "properties": {
+                    "inner": {
+                        "type": "object",
+                        "properties": {"age": {"type": "integer", "search": NUMBER_SEARCH}},
+                        "search": {"database": {"type": "json"}},
+                    },
+                },
+                "search": {"database": {"type": "json", "field": "extra_properties"}},
+            },
+        },
+        "search": {"database": {"relation": "a_table_with_a_particularly_long_name_for_testing", "primary_key": "id"}},
+    }
+    (index,) = postgres.recommend_postgres_indexes(schema, json_indexes=True)
+    assert index.expression == "(\"extra_properties\" -> 'inner' ->> 'age')::INTEGER"
+    assert len(index.name) == 63
+    assert index.name.startswith("a_table_with_a_particularly_long_name_for_testing_extr_")
+    assert postgres.postgres_index_ddl(schema) == []
+
+
+@mark.parametrize("query", TEST_QUERIES)
+def test_postgres_sql_template_cache_queries(query):
+    e = query["query"]
+    i, _p = query["ps"]
+
+    cache = postgres.SQLTemplateCache()
+    expected = postgres.search_ast_to_psycopg2_sql(queries.convert_query_to_ast_and_preprocess(e), TEST_SCHEMA, i)
+
+    assert cache.search_query_to_psycopg2_sql(e, TEST_SCHEMA, i) == expected
+    assert cache.search_query_to_psycopg2_sql(deepcopy(e), TEST_SCHEMA, i) == expected
+    assert (cache.hits, cache.misses, len(cache)) == (1, 1, 1)
+
+
+def test_postgres_sql_template_cache():
+    cache = postgres.SQLTemplateCache(max_size=2)
+
+    sql_1, params_1 = cache.search_query_to_psycopg2_sql(["#and", TEST_QUERY_1, TEST_QUERY_2], TEST_SCHEMA)
+    sql_2, params_2 = cache.search_query_to_psycopg2_sql(
+        ["#and", ["#eq", TEST_QUERY_1[1], "XX"], ["#co", TEST_QUERY_2[1], "a_b"]], TEST_SCHEMA
+    )
+    assert sql_2 is sql_1
+    assert params_1 == ("XO", "%TE%")
+    assert params_2 == ("XX", r"%a\_b%")
+
+    # Lists of any length share a shape
+    in_1 = cache.search_query_to_psycopg2_sql(["#in", TEST_QUERY_1[1], ["#list", "XO"]], TEST_SCHEMA)
+    in_2 = cache.search_query_to_psycopg2_sql(["#in", TEST_QUERY_1[1], ["#list", "XX", "XO"]], TEST_SCHEMA)
+    assert in_2[0] is in_1[0]
+    assert in_2[1] == (("XX", "XO"),)
+    assert (cache.hits, cache.misses, len(cache)) == (2, 2, 2)
+
+    # Different resolve paths, internal flags, and schema objects don't share SQL; the least recently used shape is evicted
+    cache.search_query_to_psycopg2_sql(["#eq", ["#resolve", "subject", "sex"], "XO"], TEST_SCHEMA)
+    cache.search_query_to_psycopg2_sql(["#and", TEST_QUERY_1, TEST_QUERY_2], TEST_SCHEMA, internal=True)
+    cache.search_query_to_psycopg2_sql(["#and", TEST_QUERY_1, TEST_QUERY_2], deepcopy(TEST_SCHEMA))
+    assert (cache.hits, cache.misses, len(cache)) == (2, 5, 2)
+
+    # Type-invalid values for wildcard patterns raise, even if the shape is cached
+    cache.search_query_to_psycopg2_sql(TEST_QUERY_2, TEST_SCHEMA)
+    with raises(TypeError):
+        cache.search_query_to_psycopg2_sql(["#co", TEST_QUERY_2[1], 5], TEST_SCHEMA)
+
+    cache.clear()
+    assert (cache.hits, cache.misses, len(cache)) == (0, 0, 0)
+
+    with raises(ValueError):
+        postgres.SQLTemplateCache(max_size=0)
+
+
+@mark.parametrize("query", TEST_QUERIES)
+def test_postgres_asyncpg_sql_queries(query):
+    e = query["query"]
+    i, p = query["ps"]
+
+    sql_text, params = postgres.search_query_to_asyncpg_sql(e, TEST_SCHEMA, i)
+    assert params == [list(v) if isinstance(v, tuple) else v for v in p]
+    assert "%s" not in sql_text
+    assert all(f"${n}" in sql_text for n in range(1, len(params) + 1))
+    assert f"${len(params) + 1}" not in sql_text
+    assert (sql_text, params) == postgres.search_ast_to_asyncpg_sql(
+        queries.convert_query_to_ast_and_preprocess(e), TEST_SCHEMA, i
+    )
+
+
+def test_postgres_asyncpg_sql():
+    cache = postgres.SQLTemplateCache()
+
+    # #in becomes an array comparison, typed from the schema where possible, with list parameters
+    sql_1, params_1 = cache.search_query_to_asyncpg_sql(
+        ["#and", TEST_QUERY_1, ["#in", TEST_QUERY_1[1], ["#list", "XO", "XX"]]], TEST_SCHEMA
+    )
+    assert sql_1.endswith(
+        'WHERE (("_root_subject"."karyotypic_sex") = ($1)) AND (("_root_subject"."karyotypic_sex") = ANY($2::TEXT[]))'
+    )
+    assert params_1 == ["XO", ["XO", "XX"]]
+    sql_2, params_2 = postgres.search_query_to_asyncpg_sql(
+        ["#in", ["#resolve", "test_op_2", "[item]"], ["#list", 1, 2]], TEST_SCHEMA
+    )
+    assert sql_2.endswith('WHERE ("_root_test_op_2"."[item]") = ANY($1)')
+    assert params_2 == [[1, 2]]
+
+    # psycopg2 SQL is unaffected
+    sql_obj, _ = cache.search_query_to_psycopg2_sql(["#in", TEST_QUERY_1[1], ["#list", "XO", "XX"]], TEST_SCHEMA)
+    assert isinstance(sql_obj.seq[-1], postgres.InComposable)
+    assert sql_obj.seq[-1].element_type == "TEXT"
+
+    # SQL text is cached per shape, separately from psycopg2 SQL
+    sql_3, params_3 = cache.search_query_to_asyncpg_sql(
+        ["#and", TEST_QUERY_1, ["#in", TEST_QUERY_1[1], ["#list", "XX"]]], TEST_SCHEMA
+    )
+    assert sql_3 is sql_1
+    assert params_3 == ["XO", ["XX"]]
+    assert (cache.hits, cache.misses, len(cache)) == (1, 2, 2)
+
+    # Identifiers are always quoted; literal percent signs are un-escaped
+    assert (
+        postgres.render_asyncpg_sql(
+            psycopg2.sql.SQL("SELECT {} FROM {} WHERE {} LIKE '%%a' AND {} = {}").format(
+                psycopg2.sql.Identifier("a", 'b"c'),
+                psycopg2.sql.Identifier("t"),
+                psycopg2.sql.Identifier("d"),
+                psycopg2.sql.Identifier("e"),
+                psycopg2.sql.Placeholder(),
+            )
+        )
+        == 'SELECT "a"."b""c" FROM "t" WHERE "d" LIKE \'%a\' AND "e" = $1'
+    )
+
+    with raises(TypeError):
+        postgres.render_asyncpg_sql(psycopg2.sql.Literal(5))
+    with raises(TypeError):
+        postgres.render_asyncpg_sql(psycopg2.sql.Placeholder("named"))
+
+
+@mark.parametrize("query", TEST_QUERIES)
+def test_postgres_psycopg3_sql_queries(query):
+    e = query["query"]
+    i, p = query["ps"]
+
+    sql_text, params = postgres.search_query_to_psycopg3_sql(e, TEST_SCHEMA, i)
+    assert params == {f"p{n}": list(v) if isinstance(v, tuple) else v for n, v in enumerate(p, 1)}
+    assert all(f"%(p{n})s" in sql_text for n in range(1, len(p) + 1))
+    assert f"%(p{len(p) + 1})s" not in sql_text
+    assert (sql_text, params) == postgres.search_ast_to_psycopg3_sql(
+        queries.convert_query_to_ast_and_preprocess(e), TEST_SCHEMA, i
+    )
+
+
+def test_postgres_psycopg3_sql():
+    cache = postgres.SQLTemplateCache()
+    query = ["#and", TEST_QUERY_1, ["#in", TEST_QUERY_1[1], ["#list", "XO", "XX"]]]
+
+    sql_1, params_1 = cache.search_query_to_psycopg3_sql(query, TEST_SCHEMA)
+    assert sql_1.endswith(
+        'WHERE (("_root_subject"."karyotypic_sex") = (%(p1)s)) AND '
+        '(("_root_subject"."karyotypic_sex") = ANY(%(p2)s::TEXT[]))'
+    )
+    assert params_1 == {"p1": "XO", "p2": ["XO", "XX"]}
+
+    # Large lists are un-nested, and don't share SQL text with small lists
+    sql_2, params_2 = cache.search_query_to_psycopg3_sql(query, TEST_SCHEMA, large_list_size=1)
+    assert sql_2.endswith("IN (SELECT unnest(%(p2)s::TEXT[])))")
+    assert params_2 == params_1
+    sql_3, _ = cache.search_query_to_psycopg3_sql(
+        ["#and", TEST_QUERY_1, ["#in", TEST_QUERY_1[1], ["#list", "XX"]]], TEST_SCHEMA, large_list_size=1
+    )
+    assert sql_3 is sql_1
+    sql_4, _ = cache.search_query_to_psycopg3_sql(
+        ["#and", TEST_QUERY_1, ["#in", TEST_QUERY_1[1], ["#list", "XX", "XY", "XO"]]], TEST_SCHEMA, large_list_size=1
+    )
+    assert sql_4 is sql_2
+    assert (cache.hits, cache.misses, len(cache)) == (2, 2, 2)
+
+    # Literal percent signs stay escaped for psycopg 3
+    assert postgres.render_psycopg3_sql(psycopg2.sql.SQL("LIKE '%%a' AND {}").format(psycopg2.sql.Placeholder())) == (
+        "LIKE '%%a' AND %(p1)s"
+    )
+
 
 @mark.parametrize("e, i, v, ic", DS_VALID_EXPRESSIONS)
 def test_data_structure_search_1(e, i, v, ic):
@@ -1060,6 +1669,43 @@ def test_data_structure_search_5():
         )
 
 
+def test_data_structure_validator_cache():
+    v = _validation.get_schema_validator(TEST_SCHEMA)
+    assert v.has_fast_path
+    assert _validation.get_schema_validator(TEST_SCHEMA) is v
+
+    # Equal schemas with the same $id share a validator, but not if their contents differ
+    schema_with_id = {**TEST_SCHEMA, "$id": "bento:test_schema"}
+    v2 = _validation.get_schema_validator(schema_with_id)
+    assert _validation.get_schema_validator(deepcopy(schema_with_id)) is v2
+    assert _validation.get_schema_validator({**schema_with_id, "required": ["id"]}) is not v2
+
+    # Unsupported keywords fall back to jsonschema only
+    v3 = _validation.get_schema_validator({"type": "string", "pattern": "^a"})
+    assert not v3.has_fast_path
+    assert v3.errors("abc") == ()
+    assert len(v3.errors("bcd")) == 1
+
+
+@mark.parametrize(
+    "d",
+    (
+        TEST_DATA_1,
+        TEST_DATA_1_VARIANT_1,
+        INVALID_DATA,
+        {**TEST_DATA_1, "subject": {**TEST_DATA_1["subject"], "sex": "UNKNOWN"}},
+        {**TEST_DATA_1, "subject": {"id": "S1"}},
+        {**TEST_DATA_1, "test_op_1": [1, True, "a"]},
+        {**TEST_DATA_1, "test_op_3": [[1.5], 2]},
+    ),
+)
+def test_data_structure_validator_errors(d):
+    # The compiled fast path must agree with jsonschema on both validity and error messages
+    assert _validation.get_schema_validator(TEST_SCHEMA).errors(d) == tuple(
+        err.message for err in jsonschema.Draft7Validator(TEST_SCHEMA).iter_errors(d)
+    )
+
+
 def test_large_data_structure_query():
     def large_query():
         assert data_structure.check_ast_against_data_structure(
@@ -1080,3 +1726,780 @@ def test_check_operation_permissions(e, i, _v, ic):
         TEST_SCHEMA,
         search_getter=lambda rl, s: data_structure._resolve_properties_and_check(rl, s, ic),
     )
+
+
+def test_check_query_permissions_cache():
+    calls = []
+
+    def search_getter(rl, s):
+        calls.append(rl)
+        return data_structure._resolve_search_properties(rl, s)
+
+    ast = queries.convert_query_to_ast(["#and", TEST_QUERY_1, TEST_QUERY_2])
+    schema = deepcopy(TEST_SCHEMA)
+
+    queries.check_query_permissions(ast, schema, search_getter)
+    n_calls = len(calls)
+    assert n_calls > 0
+
+    # Identical queries against the same schema object are not checked again
+    queries.check_query_permissions(
+        queries.convert_query_to_ast(["#and", TEST_QUERY_1, TEST_QUERY_2]), schema, search_getter
+    )
+    assert len(calls) == n_calls
+
+    # ... but other internal flags, schema objects, and queries are
+    queries.check_query_permissions(ast, schema, search_getter, internal=True)
+    queries.check_query_permissions(ast, deepcopy(TEST_SCHEMA), search_getter)
+    queries.check_query_permissions(queries.convert_query_to_ast(TEST_QUERY_1), schema, search_getter)
+    assert len(calls) == n_calls * 3 + 2
+
+    # Failed checks are not cached
+    forbidden = queries.convert_query_to_ast(["#eq", ["#resolve", "subject", "id"], "1"])
+    for _ in range(2):
+        with raises(ValueError):
+            queries.check_query_permissions(forbidden, schema, search_getter)
+
+
+def test_compiled_search_schema():
+    compiled = search_schema.get_compiled_search_schema(TEST_SCHEMA)
+    assert search_schema.get_compiled_search_schema(TEST_SCHEMA) is compiled
+    assert search_schema.get_compiled_search_schema(deepcopy(TEST_SCHEMA)) is not compiled
+
+    root = compiled.get(())
+    assert root.schema is TEST_SCHEMA
+    assert root.field is None
+    assert root.array_paths == ()
+
+    id_path = compiled.get(queries.convert_query_to_ast(["#resolve", "id"]).args)
+    assert id_path.queryable == "internal"
+    assert id_path.operations == {operations.SEARCH_OP_EQ, operations.SEARCH_OP_IN}
+    assert id_path.field == "phenopacket_id"
+
+    code_id_path = compiled.get(queries.convert_query_to_ast(TEST_QUERY_2[1]).args)
+    assert code_id_path.path == ("biosamples", "[item]", "procedure", "code", "id")
+    assert code_id_path.array_paths == ("_root.biosamples",)
+    assert code_id_path.search_properties == code_id_path.schema["search"]
+    assert code_id_path.field == "id"
+
+    # Paths in pre-order
+    assert list(compiled.paths)[:3] == [(), ("id",), ("biosamples",)]
+
+    for invalid in (["#resolve", "biosamples", "procedure"], ["#resolve", "id", "x"], ["#resolve", "missing"]):
+        assert compiled.get(queries.convert_query_to_ast(invalid).args) is None
+
+
+@mark.parametrize("query", TEST_QUERIES)
+def test_data_structure_compiled_query(query):
+    q = query["query"]
+    i, v, _ni, nm = query["ds"]
+
+    compiled = data_structure.compile_query(queries.convert_query_to_ast(q), TEST_SCHEMA, i)
+
+    # Compiled plans are re-usable across many checks
+    for _ in range(2):
+        assert compiled.check(TEST_DATA_1) == v
+        assert compiled.check(TEST_DATA_1, skip_schema_validation=True) == v
+        assert len(tuple(compiled.check(TEST_DATA_1, return_all_index_combinations=True))) == nm
+
+
+@mark.parametrize("e, i, v, ic", DS_VALID_EXPRESSIONS)
+def test_data_structure_compiled_query_evaluation(e, i, v, ic):
+    compiled = data_structure.compile_query(queries.convert_query_to_ast(e), TEST_SCHEMA, i)
+    assert compiled(TEST_DATA_1, ic) == v
+
+
+@mark.parametrize("e, i, ex, ic", DS_INVALID_EXPRESSIONS)
+def test_data_structure_compiled_query_invalid(e, i, ex, ic):
+    with raises(ex):
+        data_structure.compile_query(queries.convert_query_to_ast(e), TEST_SCHEMA, i)(TEST_DATA_1, ic)
+
+
+@mark.parametrize("query", TEST_QUERIES)
+def test_data_structure_columnar(query):
+    q = queries.convert_query_to_ast(query["query"])
+    i = query["ds"][0]
+
+    expected = [data_structure.check_ast_against_data_structure(q, d, TEST_SCHEMA, i) for d in TEST_DATA_BATCH]
+
+    assert columnar.check_ast_against_data_structures(q, TEST_DATA_BATCH, TEST_SCHEMA, i).tolist() == expected
+    assert columnar.check_ast_against_data_structures(
+        q, TEST_DATA_BATCH, TEST_SCHEMA, i, return_indices=True
+    ).tolist() == [j for j, e in enumerate(expected) if e]
+
+
+TEST_DATA_1_VARIANT_3 = deepcopy(TEST_DATA_1_VARIANT_1)
+TEST_DATA_1_VARIANT_3["biosamples"] = TEST_DATA_1_VARIANT_3["biosamples"][:1]  # Only the item with no tumour grades
+
+TEST_TUMOR_GRADE_ID = ["#resolve", "biosamples", "[item]", "tumor_grade", "[item]", "id"]
+TEST_POSTGRES_ARRAY_TEST = ["#resolve", "biosamples", "[item]", "test_postgres_array", "[item]", "test"]
+
+
+# Query, Expected result for (TEST_DATA_1, TEST_DATA_1_VARIANT_1, TEST_DATA_1_VARIANT_3)
+@mark.parametrize(
+    "query, expected",
+    (
+        # A biosample with an empty nested array has no index combinations, even if a sibling nested array matches
+        (
+            ["#or", ["#eq", TEST_TUMOR_GRADE_ID, "TG1"], ["#eq", TEST_POSTGRES_ARRAY_TEST, "test_value"]],
+            [True, True, False],
+        ),
+        (
+            ["#or", ["#eq", TEST_POSTGRES_ARRAY_TEST, "test_value"], ["#eq", TEST_TUMOR_GRADE_ID, "TG1"]],
+            [True, True, False],
+        ),
+        (["#or", ["#eq", TEST_TUMOR_GRADE_ID, "TG1"], ["#co", TEST_QUERY_2[1], "TEST"]], [True, False, False]),
+        (["#not", ["#eq", TEST_TUMOR_GRADE_ID, "TG1"]], [True, True, False]),
+        # ... but the sibling nested array alone still matches
+        (["#eq", TEST_POSTGRES_ARRAY_TEST, "test_value"], [True, True, True]),
+    ),
+)
+def test_data_structure_columnar_empty_nested_arrays(query, expected):
+    q = queries.convert_query_to_ast(query)
+    batch = (TEST_DATA_1, TEST_DATA_1_VARIANT_1, TEST_DATA_1_VARIANT_3)
+
+    assert [data_structure.check_ast_against_data_structure(q, d, TEST_SCHEMA, True) for d in batch] == expected
+    assert columnar.check_ast_against_data_structures(q, batch, TEST_SCHEMA, True).tolist() == expected
+
+
+def test_data_structure_columnar_errors():
+    with raises(ValueError):
+        columnar.check_ast_against_data_structures(
+            queries.convert_query_to_ast(TEST_EXPR_1), [TEST_DATA_1, INVALID_DATA], TEST_SCHEMA
+        )
+
+    with raises(TypeError):
+        columnar.check_ast_against_data_structures(
+            queries.convert_query_to_ast(["#lt", ["#resolve", "test_op_1", "[item]"], "a"]),
+            TEST_DATA_BATCH,
+            TEST_SCHEMA,
+        )
+
+    assert columnar.check_ast_against_data_structures(
+        queries.convert_query_to_ast(TEST_LARGE_QUERY_1), [TEST_DATA_2], TEST_SCHEMA_2
+    ).tolist() == [True]
+
+
+TEST_NDJSON_LINES = [json.dumps(d).encode() for d in TEST_DATA_BATCH]
+
+
+@mark.parametrize("query", TEST_QUERIES)
+def test_data_structure_ndjson(query):
+    q = queries.convert_query_to_ast(query["query"])
+    i = query["ds"][0]
+
+    expected = [
+        line
+        for line, d in zip(TEST_NDJSON_LINES, TEST_DATA_BATCH)
+        if data_structure.check_ast_against_data_structure(q, d, TEST_SCHEMA, i)
+    ]
+
+    assert list(ndjson.filter_ndjson_lines(q, [*TEST_NDJSON_LINES, b"\n"], TEST_SCHEMA, i)) == expected
+    assert list(ndjson.filter_ndjson_lines(q, TEST_NDJSON_LINES, TEST_SCHEMA, i, limit=1)) == expected[:1]
+
+
+def test_data_structure_ndjson_projection():
+    q = queries.convert_query_to_ast(TEST_QUERY_17)
+
+    def lines():
+        yield TEST_NDJSON_LINES[0]
+        raise AssertionError("Read past limit")
+
+    # Lines should not be read once the limit is reached
+    assert list(ndjson.filter_ndjson_lines(q, lines(), TEST_SCHEMA, limit=1)) == [TEST_NDJSON_LINES[0]]
+    assert list(ndjson.filter_ndjson_lines(q, lines(), TEST_SCHEMA, limit=0)) == []
+
+    # Only the projected parts of data structures are validated
+    d = deepcopy(TEST_DATA_1)
+    d["subject"]["sex"] = 5
+    assert list(ndjson.filter_ndjson_lines(q, [json.dumps(d)], TEST_SCHEMA)) == [json.dumps(d)]
+    d["test_op_2"] = {}
+    with raises(ValueError):
+        list(ndjson.filter_ndjson_lines(q, [json.dumps(d)], TEST_SCHEMA))
+
+
+def test_data_structure_parallel():
+    q = queries.convert_query_to_ast(TEST_QUERY_17)
+    data = TEST_DATA_BATCH * 3
+    compiled = data_structure.compile_query(q, TEST_SCHEMA)
+
+    with parallel.ParallelSearchExecutor(q, TEST_SCHEMA, max_workers=2, chunk_size=2) as executor:
+        expected = [compiled.check(d) for d in data]
+        assert executor.check(data) == expected
+        assert executor.check(iter(data), return_indices=True) == [i for i, e in enumerate(expected) if e]
+        assert executor.index_combinations(data) == [
+            list(compiled.check(d, return_all_index_combinations=True)) for d in data
+        ]
+
+        with raises(ValueError):
+            executor.check([TEST_DATA_1, INVALID_DATA])
+
+    with raises(ValueError):
+        parallel.ParallelSearchExecutor(q, TEST_SCHEMA, chunk_size=0)
+
+    with raises(ValueError):  # Invalid queries are rejected before any workers are started
+        parallel.ParallelSearchExecutor(
+            queries.convert_query_to_ast(["#lt", ["#resolve", "subject", "sex"], "a"]), TEST_SCHEMA
+        )
+
+
+@mark.parametrize("query", TEST_QUERIES)
+def test_indexed_collection(query):
+    q = queries.convert_query_to_ast(query["query"])
+    i = query["ds"][0]
+
+    collection = indexing.IndexedCollection(TEST_SCHEMA, TEST_DATA_BATCH)
+    assert len(collection) == len(TEST_DATA_BATCH)
+    assert collection.search(q, i) == [
+        j
+        for j, d in enumerate(TEST_DATA_BATCH)
+        if data_structure.check_ast_against_data_structure(q, d, TEST_SCHEMA, i)
+    ]
+
+
+TEST_INDEXED_QUERY_1 = ["#eq", ["#resolve", "subject", "karyotypic_sex"], "XX"]
+TEST_INDEXED_QUERY_2 = [
+    "#in",
+    ["#resolve", "biosamples", "[item]", "tumor_grade", "[item]", "id"],
+    ["#list", "TG1", "TG3"],
+]
+
+
+def test_indexed_collection_planning():
+    collection = indexing.IndexedCollection(TEST_SCHEMA, TEST_DATA_BATCH)
+    assert ("subject", "karyotypic_sex") in collection.hash_indexes
+    assert ("biosamples", "[item]", "tumor_grade", "[item]", "id") in collection.hash_indexes
+
+    def plan(query):
+        return collection._plan(queries.convert_query_to_ast(query))
+
+    # Non-array leaves are answered exactly by the index, array leaves give candidates
+    assert plan(TEST_INDEXED_QUERY_1) == ({1}, True)
+    assert plan(["#eq", "XX", ["#resolve", "subject", "karyotypic_sex"]]) == ({1}, True)
+    assert plan(TEST_INDEXED_QUERY_2) == ({0, 1, 3}, False)
+    assert plan(["#and", TEST_INDEXED_QUERY_1, TEST_INDEXED_QUERY_2]) == ({1}, False)
+    assert plan(["#or", TEST_INDEXED_QUERY_1, ["#eq", ["#resolve", "subject", "karyotypic_sex"], "XO"]]) == (
+        {0, 1, 2, 3},
+        True,
+    )
+    assert plan(["#and", TEST_INDEXED_QUERY_1, TEST_QUERY_17]) == ({1}, False)
+    assert plan(["#or", TEST_INDEXED_QUERY_1, TEST_QUERY_16]) == (None, False)
+    assert plan(["#not", TEST_INDEXED_QUERY_1]) == (None, False)
+
+    # Indexes are kept up to date when records are added and removed
+    assert collection.search(queries.convert_query_to_ast(TEST_INDEXED_QUERY_1)) == [1]
+    collection.remove(1)
+    assert collection.add(TEST_DATA_1_VARIANT_1) == 4
+    assert collection.search(queries.convert_query_to_ast(TEST_INDEXED_QUERY_1)) == [4]
+    assert collection[4] is TEST_DATA_1_VARIANT_1
+
+    with raises(ValueError):
+        collection.add(INVALID_DATA)
+
+
+TEST_RANGE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "age": {"type": "number", "search": NUMBER_SEARCH},
+        "date": {"type": "string", "format": "date", "search": NUMBER_SEARCH},
+        "visits": {"type": "array", "items": {"type": "number", "search": NUMBER_SEARCH}},
+    },
+    "required": ["age", "date", "visits"],
+    "search": {"operations": [], "queryable": "all"},
+}
+TEST_RANGE_DATA = [
+    {"age": a, "date": d, "visits": v}
+    for a, d, v in (
+        (10, "2020-01-05", [1, 2]),
+        (25.5, "2021-06-30", []),
+        (40, "2019-12-31", [40]),
+        (40, "2021-01-01", [3, 100]),
+        (70, "2022-02-02", [5.5]),
+    )
+]
+
+
+@mark.parametrize(
+    "query, plan",
+    (
+        (["#lt", ["#resolve", "age"], 40], ({0, 1}, True)),
+        (["#le", ["#resolve", "age"], 40], ({0, 1, 2, 3}, True)),
+        (["#gt", 40, ["#resolve", "age"]], ({0, 1}, True)),
+        (["#ge", ["#resolve", "age"], 40.0], ({2, 3, 4}, True)),
+        (["#and", ["#gt", ["#resolve", "age"], 10], ["#le", ["#resolve", "age"], 40]], ({1, 2, 3}, True)),
+        (
+            ["#and", ["#ge", ["#resolve", "date"], "2020-01-01"], ["#lt", ["#resolve", "date"], "2021-01-01"]],
+            ({0}, True),
+        ),
+        (
+            [
+                "#and",
+                ["#ge", ["#resolve", "age"], 40],
+                ["#and", ["#lt", ["#resolve", "age"], 70], ["#gt", ["#resolve", "age"], 30]],
+            ],
+            ({2, 3}, True),
+        ),
+        (["#or", ["#lt", ["#resolve", "age"], 20], ["#ge", ["#resolve", "date"], "2022-01-01"]], ({0, 4}, True)),
+        (
+            ["#and", ["#gt", ["#resolve", "visits", "[item]"], 4], ["#lt", ["#resolve", "visits", "[item]"], 50]],
+            ({2, 4}, False),
+        ),
+        (["#and", ["#gt", ["#resolve", "age"], 10], ["#lt", ["#resolve", "age"], "a"]], ({1, 2, 3, 4}, False)),
+        (["#not", ["#lt", ["#resolve", "age"], 40]], (None, False)),
+    ),
+)
+def test_indexed_collection_range(query, plan):
+    collection = indexing.IndexedCollection(TEST_RANGE_SCHEMA, TEST_RANGE_DATA)
+    ast = queries.convert_query_to_ast(query)
+    assert collection._plan(ast) == plan
+
+    def expected():
+        return [
+            i
+            for i, d in enumerate(TEST_RANGE_DATA)
+            if data_structure.check_ast_against_data_structure(ast, d, TEST_RANGE_SCHEMA)
+        ]
+
+    try:
+        assert collection.search(ast) == expected()
+    except TypeError:
+        with raises(TypeError):
+            expected()
+
+    # Indexes are kept up to date when records are removed and re-added
+    for i in range(len(TEST_RANGE_DATA)):
+        collection.remove(i)
+        collection.add(TEST_RANGE_DATA[i])
+    assert len(collection) == len(TEST_RANGE_DATA)
+    assert collection._plan(ast) == ((None if plan[0] is None else {i + 5 for i in plan[0]}), plan[1])
+
+
+def test_indexed_collection_range_incomparable():
+    # Comparing values of different types raises an error in the evaluator, so index results can't be exact
+    schema = {
+        **TEST_RANGE_SCHEMA,
+        "properties": {"age": {"type": ["number", "string"], "search": NUMBER_SEARCH}},
+        "required": [],
+    }
+    collection = indexing.IndexedCollection(schema, [{"age": 5}, {"age": "unknown"}, {"age": float("nan")}])
+    ast = queries.convert_query_to_ast(["#lt", ["#resolve", "age"], 10])
+    assert collection._plan(ast) == (None, False)
+    with raises(TypeError):
+        collection.search(ast)
+
+    collection.remove(1)
+    assert collection._plan(ast) == ({0}, True)
+    assert collection.search(ast) == [0]
+
+
+TEXT_SEARCH = {
+    "operations": [
+        operations.SEARCH_OP_CO,
+        operations.SEARCH_OP_ICO,
+        operations.SEARCH_OP_ISW,
+        operations.SEARCH_OP_IEW,
+        operations.SEARCH_OP_LIKE,
+        operations.SEARCH_OP_ILIKE,
+    ],
+    "queryable": "all",
+}
+TEST_TEXT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string", "search": TEXT_SEARCH},
+        "tags": {"type": "array", "items": {"type": "string", "search": TEXT_SEARCH}},
+    },
+    "required": ["name", "tags"],
+    "search": {"operations": [], "queryable": "all"},
+}
+TEST_TEXT_DATA = [
+    {"name": n, "tags": t}
+    for n, t in (
+        ("Hello World", ["greeting"]),
+        ("HELLO there", []),
+        ("İstanbul", ["city", "TURKEY"]),
+        ("Straße", ["street"]),
+        ("ſtop sign", ["sign"]),
+        ("abc_def 50% off", ["sale"]),
+        ("Kelvin", ["unit", "TEMPERATURE"]),
+    )
+]
+
+
+@mark.parametrize(
+    "fn, path, value",
+    (
+        ("#co", "name", "ello"),
+        ("#co", "name", "ELLO"),
+        ("#ico", "name", "ELLO"),
+        ("#ico", "name", "strasse"),
+        ("#ico", "name", "stan"),
+        ("#isw", "name", "hel"),
+        ("#iew", "name", "BUL"),
+        ("#iew", "name", "e"),
+        ("#like", "name", "Hel%or_d"),
+        ("#like", "name", "abc\\_def 50\\% %"),
+        ("#ilike", "name", "%stan%"),
+        ("#ilike", "name", "ISTANBUL"),
+        ("#ilike", "name", "STOP%"),
+        ("#ilike", "name", "%KELVIN"),
+        ("#ilike", "name", "%HELLO%"),
+        ("#ico", "tags", "TEMP"),
+        ("#ilike", "tags", "%eet"),
+    ),
+)
+def test_indexed_collection_text(fn, path, value):
+    collection = indexing.IndexedCollection(TEST_TEXT_SCHEMA, TEST_TEXT_DATA)
+    resolve = ["#resolve", path] if path == "name" else ["#resolve", path, "[item]"]
+    ast = queries.convert_query_to_ast([fn, resolve, value])
+
+    expected = [
+        i
+        for i, d in enumerate(TEST_TEXT_DATA)
+        if data_structure.check_ast_against_data_structure(ast, d, TEST_TEXT_SCHEMA)
+    ]
+    assert collection.search(ast) == expected
+
+    # Trigram candidates must include all matches, but are never exact
+    candidates, exact = collection._plan(ast)
+    assert not exact
+    assert candidates is None or candidates >= set(expected)
+
+
+def test_indexed_collection_text_planning():
+    collection = indexing.IndexedCollection(TEST_TEXT_SCHEMA, TEST_TEXT_DATA)
+
+    def plan(query):
+        return collection._plan(queries.convert_query_to_ast(query))
+
+    assert plan(["#ico", ["#resolve", "name"], "hello"]) == ({0, 1}, False)
+    assert plan(["#like", ["#resolve", "name"], "H%ld"]) == (None, False)  # No literal parts of at least 3 characters
+    assert plan(["#ilike", ["#resolve", "name"], "%TANBUL"]) == ({2}, False)
+    assert plan(["#ilike", ["#resolve", "name"], "%STANBUL"]) == ({2}, False)  # Only "tanbul" is used for #ilike
+    assert plan(["#co", ["#resolve", "tags", "[item]"], "gn"]) == (None, False)
+    assert plan(["#and", ["#ico", ["#resolve", "name"], "hello"], ["#co", ["#resolve", "name"], "World"]]) == (
+        {0},
+        False,
+    )
+
+
+TEST_INDEPENDENT_ARRAYS_QUERY = [
+    "#and",
+    ["#eq", ["#resolve", "data_type_1", "[item]", "children", "[item]", "prop"], "prop999"],
+    ["#eq", ["#resolve", "data_type_2", "[item]", "children", "[item]", "prop"], "prop0"],
+]
+
+
+TEST_NESTED_ARRAY_QUERY = ["#eq", ["#resolve", "biosamples", "[item]", "tumor_grade", "[item]", "id"], "TG1"]
+
+
+@mark.parametrize("q1", [q["query"] for q in TEST_QUERIES if isinstance(q["query"], list)])
+@mark.parametrize("q2, nested_first", ((TEST_QUERY_17, False), (TEST_NESTED_ARRAY_QUERY, True)))
+@mark.parametrize("op", [queries.FUNCTION_AND, queries.FUNCTION_OR])
+def test_data_structure_array_pushdown(q1, q2, nested_first, op):
+    # Splitting independent array predicates should give the same result as evaluating the full cross product, including
+    # when a nested array is resolved before a shallower resolve of the same top-level array.
+    ast = queries.convert_query_to_ast([op, q2, q1] if nested_first else [op, q1, q2])
+    compiled = data_structure.compile_query(ast, TEST_SCHEMA, True)
+    for d in TEST_DATA_BATCH:
+        assert compiled.check(d) == any(True for _ in compiled.check(d, return_all_index_combinations=True))
+
+
+def test_data_structure_array_pushdown_nested_first():
+    code_id = ["#resolve", "biosamples", "[item]", "procedure", "code", "id"]
+    for query in (
+        ["#and", TEST_NESTED_ARRAY_QUERY, ["#isw", code_id, "TE"]],
+        ["#or", TEST_NESTED_ARRAY_QUERY, ["#ilike", code_id, "%te%"]],
+    ):
+        assert data_structure.check_ast_against_data_structure(
+            queries.convert_query_to_ast(query), TEST_DATA_1, TEST_SCHEMA, internal=True
+        )
+
+
+def test_data_structure_array_pushdown_large():
+    # 1000 x 1000 index combinations if evaluated as a cross product
+    assert data_structure.check_ast_against_data_structure(
+        queries.convert_query_to_ast(TEST_INDEPENDENT_ARRAYS_QUERY), TEST_DATA_2, TEST_SCHEMA_2
+    )
+    assert not data_structure.check_ast_against_data_structure(
+        queries.convert_query_to_ast(["#not", TEST_INDEPENDENT_ARRAYS_QUERY]),
+        {"data_type_1": [], "data_type_2": TEST_DATA_2["data_type_2"]},
+        TEST_SCHEMA_2,
+    )
+
+
+TEST_MEMOIZED_QUERY = [
+    "#and",
+    ["#eq", ["#resolve", "subject", "sex"], "MALE"],
+    [
+        "#or",
+        ["#ico", ["#resolve", "biosamples", "[item]", "procedure", "code", "label"], "dummy"],
+        ["#eq", ["#resolve", "biosamples", "[item]", "tumor_grade", "[item]", "id"], "TG2"],
+    ],
+]
+
+
+@mark.parametrize("sex, nm", (("MALE", 4), ("FEMALE", 0)))
+def test_data_structure_memoization(sex, nm):
+    # Sub-expressions depending on only some arrays (or none) are memoized across index combinations; results should be
+    # the same as evaluating each index combination separately.
+    ast = queries.convert_query_to_ast(TEST_MEMOIZED_QUERY)
+    d = deepcopy(TEST_DATA_1)
+    d["subject"]["sex"] = sex
+
+    compiled = data_structure.compile_query(ast, TEST_SCHEMA, True)
+    ics = tuple(compiled.check(d, return_all_index_combinations=True))
+    assert len(ics) == nm
+    assert compiled.check(d) == (nm > 0)
+
+    als = data_structure._collect_array_lengths(ast, d, TEST_SCHEMA, resolve_checks=True)
+    assert ics == tuple(
+        ic
+        for ic in data_structure._create_all_index_combinations({}, als)
+        if data_structure.evaluate(ast, d, TEST_SCHEMA, ic, True) is True
+    )
+
+    # Evaluating with a fixed index combination should not use state from previous calls
+    for ic in ics:
+        assert compiled(d, ic) is True
+
+
+TEST_LIKE_PATTERNS = (
+    "label",
+    "LABEL%",
+    "%label",
+    "la%el",
+    "%ab%",
+    "%%ab%%",
+    "lab_l",
+    "%a_e%",
+    "50\\%",
+    "\\_%",
+    "ß%",
+    "%k",
+    "",
+    "%",
+)
+TEST_LIKE_VALUES = ("label", "LABEL", "Label\n", "la\nbel", "lab\n", "labels", "50%", "_x", "SS", "Straße", "K", "")
+
+
+@mark.parametrize("pattern", TEST_LIKE_PATTERNS)
+@mark.parametrize("case_insensitive", (False, True))
+def test_data_structure_like_patterns(pattern, case_insensitive):
+    # Fast paths for simple pattern shapes should behave exactly the same as the Regex form of the pattern
+    regex = data_structure.regex_from_like_pattern(pattern, case_insensitive)
+    like_match = data_structure.compile_like_pattern(pattern, case_insensitive)
+    assert like_match is data_structure.compile_like_pattern(pattern, case_insensitive)  # cached
+    for v in TEST_LIKE_VALUES:
+        assert like_match(v) == (regex.match(v) is not None)
+
+
+@mark.parametrize("query", TEST_QUERIES)
+def test_data_structure_canonical_query(query):
+    q = query["query"]
+    i, v, _ni, nm = query["ds"]
+
+    ast = queries.canonicalize(queries.convert_query_to_ast(q))
+    assert data_structure.check_ast_against_data_structure(ast, TEST_DATA_1, TEST_SCHEMA, i) == v
+    assert (
+        len(
+            tuple(
+                data_structure.check_ast_against_data_structure(
+                    ast, TEST_DATA_1, TEST_SCHEMA, i, return_all_index_combinations=True
+                )
+            )
+        )
+        == nm
+    )
+
+
+def test_query_result_cache():
+    c = cache.QueryResultCache(max_size=2)
+    q1 = queries.convert_query_to_ast(TEST_QUERY_3)
+    q1_reordered = queries.convert_query_to_ast(["#and", TEST_QUERY_2, TEST_QUERY_1])
+    q2 = queries.convert_query_to_ast(TEST_QUERY_1)
+
+    assert c.get(q1, TEST_SCHEMA, 1) is None
+    c.put(q1, TEST_SCHEMA, 1, [0, 2])
+    assert c.get(q1_reordered, TEST_SCHEMA, 1) == [0, 2]  # Equivalent queries share results
+    assert c.get(q1, deepcopy(TEST_SCHEMA), 1) == [0, 2]
+    assert c.get(q1, TEST_SCHEMA, 2) is None  # New dataset version
+    assert c.get(q1, TEST_SCHEMA, 1, internal=True) is None
+    assert (c.hits, c.misses) == (2, 3)
+
+    calls = []
+    assert c.get_or_compute(q2, TEST_SCHEMA, 1, lambda: calls.append(1) or [1]) == [1]
+    assert c.get_or_compute(q2, TEST_SCHEMA, 1, lambda: calls.append(1) or [1]) == [1]
+    assert len(calls) == 1
+
+    # Least recently used results are evicted first
+    c.put(q2, TEST_SCHEMA, 2, [])
+    assert len(c) == 2
+    assert c.get(q1, TEST_SCHEMA, 1) is None
+    assert c.get(q2, TEST_SCHEMA, 1) == [1]
+
+    c.clear()
+    assert len(c) == 0 and (c.hits, c.misses) == (0, 0)
+
+    with raises(ValueError):
+        cache.QueryResultCache(max_size=0)
+
+
+TEST_OPTIMIZER_QUERY = [
+    "#and",
+    ["#ilike", ["#resolve", "biosamples", "[item]", "procedure", "code", "label"], "%label"],
+    ["#and", ["#eq", ["#resolve", "subject", "sex"], "MALE"], ["#eq", ["#resolve", "subject", "karyotypic_sex"], "XO"]],
+]
+
+
+def test_optimizer_reordering():
+    ast = queries.convert_query_to_ast(TEST_OPTIMIZER_QUERY)
+    eq_sex, eq_ks = (
+        queries.convert_query_to_ast(["#eq", ["#resolve", "subject", k], v])
+        for k, v in (("sex", "MALE"), ("karyotypic_sex", "XO"))
+    )
+
+    # Cheap predicates which don't touch arrays go first
+    optimized = optimizer.optimize_query(ast)
+    assert queries.ast_to_and_asts(optimized)[:2] == (eq_sex, eq_ks)
+    assert queries.ast_to_and_asts(optimized)[2].fn == queries.FUNCTION_ILIKE
+
+    # With sampled data where every subject is MALE, #eq on sex is not selective and should be evaluated later
+    estimator = optimizer.sample_selectivity_estimator(TEST_DATA_BATCH, TEST_SCHEMA)
+    assert estimator(eq_sex) == 1.0
+    assert estimator(eq_ks) == 0.75
+    optimized = optimizer.optimize_query(ast, estimator)
+    assert queries.ast_to_and_asts(optimized)[0] == eq_ks
+    assert queries.ast_to_and_asts(optimized)[-1] == eq_sex  # Always True, so never short-circuits the #and
+
+    # #or: terms which are likely to be True go first
+    or_ast = queries.convert_query_to_ast(["#or", ["#eq", ["#resolve", "subject", "karyotypic_sex"], "XO"], True])
+    assert optimizer.optimize_query(or_ast).args[0] == queries.Literal(True)
+
+    # Non-boolean #and / #or terms are never reordered
+    non_bool = queries.convert_query_to_ast(["#and", ["#resolve", "subject", "sex"], False])
+    assert optimizer.optimize_query(non_bool) == non_bool
+
+    cost, sel = optimizer.estimate_cost_and_selectivity(optimized, estimator)
+    assert cost > 0 and 0 < sel < 1
+
+
+@mark.parametrize("query", TEST_QUERIES)
+def test_optimizer_equivalence(query):
+    q = query["query"]
+    i, v, _ni, nm = query["ds"]
+
+    ast = optimizer.optimize_query(queries.convert_query_to_ast(q))
+    assert data_structure.check_ast_against_data_structure(ast, TEST_DATA_1, TEST_SCHEMA, i) == v
+    assert (
+        len(
+            tuple(
+                data_structure.check_ast_against_data_structure(
+                    ast, TEST_DATA_1, TEST_SCHEMA, i, return_all_index_combinations=True
+                )
+            )
+        )
+        == nm
+    )
+
+    pi, p = query["ps"]
+    _, params = postgres.search_ast_to_psycopg2_sql(ast, TEST_SCHEMA, pi)
+    assert sorted(map(repr, params)) == sorted(map(repr, p))
+
+
+def test_indexed_collection_selectivity():
+    coll = indexing.IndexedCollection(TEST_SCHEMA, TEST_DATA_BATCH)
+    assert coll.estimate_selectivity(queries.convert_query_to_ast(TEST_QUERY_1)) == 0.75
+    assert coll.estimate_selectivity(queries.convert_query_to_ast(["#not", TEST_QUERY_1])) is None
+    assert (
+        indexing.IndexedCollection(TEST_SCHEMA).estimate_selectivity(queries.convert_query_to_ast(TEST_QUERY_1)) is None
+    )
+
+
+def test_queries_n_ary():
+    assert queries.convert_query_to_ast_and_preprocess(TEST_QUERY_5) == queries.convert_query_to_ast(
+        ["#and", TEST_QUERY_1, TEST_QUERY_2, False]
+    )
+    assert queries.and_asts_to_ast(queries.ast_to_and_asts(queries.convert_query_to_ast(TEST_QUERY_5))) == (
+        queries.convert_query_to_ast(["#and", TEST_QUERY_1, TEST_QUERY_2, False])
+    )
+    assert queries.and_asts_to_ast((queries.Literal(True),)) == queries.Literal(True)
+
+    with raises(SyntaxError):
+        queries.convert_query_to_ast(["#and", True])
+
+
+def test_deep_queries():
+    # Generated queries can contain very long right-deep #and / #or chains, far deeper than Python's recursion limit
+    n = 5000
+    terms = [["#eq", ["#resolve", "subject", "karyotypic_sex"], f"X{i}"] for i in range(n - 1)] + [TEST_QUERY_1]
+    query = terms[-1]
+    for t in reversed(terms[:-1]):
+        query = ["#or", t, query]
+
+    ast = queries.convert_query_to_ast(query)
+    assert len(queries.flatten_boolean_expressions(ast).args) == n
+    assert len(queries.convert_query_to_ast_and_preprocess(query).args) == n
+    assert len(queries.canonicalize(ast).args) == n
+    assert queries.ast_to_query(queries.flatten_boolean_expressions(ast))[1] == terms[0]
+
+    assert data_structure.check_ast_against_data_structure(ast, TEST_DATA_1, TEST_SCHEMA)
+    assert data_structure.evaluate(ast, TEST_DATA_1, TEST_SCHEMA, None) is True
+    assert not data_structure.check_ast_against_data_structure(
+        queries.convert_query_to_ast(["#and", query, False]), TEST_DATA_1, TEST_SCHEMA
+    )
+
+    _, params = postgres.search_query_to_psycopg2_sql(query, TEST_SCHEMA)
+    assert len(params) == n
+
+    # Mixed #and / #not / #or nesting can't be flattened, so each level remains a separate node (~1200 levels here)
+    n = 400
+    query = TEST_QUERY_1
+    for i in range(n):
+        query = ["#and", True, ["#not", ["#or", ["#eq", ["#resolve", "subject", "karyotypic_sex"], f"X{i}"], query]]]
+
+    ast = queries.convert_query_to_ast(query)
+    ast_2 = queries.convert_query_to_ast(query)
+    assert ast is not ast_2
+    assert hash(ast) == hash(ast_2)
+    assert ast == ast_2
+    assert ast != queries.convert_query_to_ast(["#and", False, query[2]])
+
+    assert data_structure.check_ast_against_data_structure(ast, TEST_DATA_1, TEST_SCHEMA)
+    assert data_structure.evaluate(ast, TEST_DATA_1, TEST_SCHEMA, None) is True
+
+    _, params = postgres.search_query_to_psycopg2_sql(query, TEST_SCHEMA)
+    assert len(params) == 2 * n + 1
+    _, params = postgres.search_query_to_asyncpg_sql(query, TEST_SCHEMA, exists_subqueries=True)
+    assert len(params) == 2 * n + 1
+
+    # Alternating #and / #or nesting can't be flattened either; here, each level is split into independent components
+    #  (a scalar term, and the rest of the query, which accesses an array.) Scalar terms are True for #and and False for
+    #  #or, so the query is True exactly when its innermost term is, i.e. for one item of test_op_1.
+    n = 1200
+    for item, expected in ((6, True), (8, False)):
+        query = ["#eq", ["#resolve", "test_op_1", "[item]"], item]
+        for i in range(n):
+            k = "XO" if i % 2 else f"X{i}"
+            query = ["#and" if i % 2 else "#or", ["#eq", ["#resolve", "subject", "karyotypic_sex"], k], query]
+
+        ast = queries.convert_query_to_ast(query)
+        assert [data_structure.evaluate(ast, TEST_DATA_1, TEST_SCHEMA, {"_root.test_op_1": j}) for j in range(3)] == [
+            False,
+            expected,
+            False,
+        ]
+        assert data_structure.check_ast_against_data_structure(ast, TEST_DATA_1, TEST_SCHEMA) is expected
+        assert list(
+            data_structure.check_ast_against_data_structure(
+                ast, TEST_DATA_1, TEST_SCHEMA, return_all_index_combinations=True
+            )
+        ) == ([{"_root.test_op_1": 1}] if expected else [])
+
+        _, params = postgres.search_query_to_psycopg2_sql(query, TEST_SCHEMA)
+        assert len(params) == n + 1
+        sql_text, params = postgres.search_query_to_asyncpg_sql(query, TEST_SCHEMA, exists_subqueries=True)
+        assert len(params) == n + 1
+        assert (
+            sql_text.count("EXISTS") == 2
+        )  # Including one for test_op_1 having items; see test_postgres_exists_subqueries